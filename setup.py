@@ -22,7 +22,9 @@ setuptools_args = {}
 if 'setuptools' in sys.modules:
     setuptools_args['install_requires'] = ['jinja2',
                                            'wheel',
+                                           'packaging',
                                            'delocate>=0.6.0']
+    setuptools_args['extras_require'] = {'watch': ['watchdog']}
 
 setup(name='wheels2dmg',
       version=versioneer.get_version(),
@@ -39,6 +41,9 @@ setup(name='wheels2dmg',
       },
       scripts = [pjoin('scripts', f) for f in (
           'wheels2dmg',
+          'wheels2dmg-catalog',
+          'wheels2dmg-history',
+          'wheels2dmg-cache',
       )],
       license='BSD license',
       classifiers = ['Intended Audience :: Developers',
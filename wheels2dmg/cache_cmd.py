@@ -0,0 +1,43 @@
+""" wheels2dmg-cache command module
+"""
+from __future__ import division, print_function
+
+from argparse import ArgumentParser
+
+from .wheelcache import WheelCache
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description="Export or import wheel cache entries, to share a "
+        "wheel cache (such as the --source-cache-dir of wheels2dmg) between "
+        "build hosts")
+    parser.add_argument('cache_dir', type=str,
+                        help='wheel cache directory')
+    parser.add_argument('action', choices=('export', 'import', 'list'),
+                        help='"export" to write all cache entries to '
+                        'ARCHIVE, "import" to add entries from ARCHIVE, '
+                        '"list" to list cache keys')
+    parser.add_argument('archive', type=str, nargs='?',
+                        help='tar archive filename; use ".tar.gz" extension '
+                        'to compress on export')
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    cache = WheelCache(args.cache_dir)
+    if args.action == 'list':
+        for key in cache.keys():
+            print(key)
+        return
+    if args.archive is None:
+        parser.error('Need ARCHIVE for ' + args.action)
+    if args.action == 'export':
+        n_keys = cache.export_archive(args.archive)
+        print('Exported {0} entries to {1}'.format(n_keys, args.archive))
+    else:
+        n_added = cache.import_archive(args.archive)
+        print('Imported {0} new entries from {1}'.format(n_added,
+                                                          args.archive))
@@ -0,0 +1,348 @@
+""" SQLite catalog of wheel metadata
+
+We read the metadata for each wheel from the zip central directory and the
+``WHEEL`` and ``METADATA`` members, seeking to each of these in the file, so
+we never unpack or read the rest of the wheel.  The catalog stores one record
+per wheel content hash, and remembers the size and modification time of each
+wheel file, so updating the catalog for a directory only hashes and reads
+wheels that are new or have changed.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import join as pjoin, abspath
+import json
+import sqlite3
+import zipfile
+import zlib
+from glob import glob
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from .wheelcache import file_sha256
+
+# Errors from reading a broken or unsupported wheel zip file
+ZIP_ERRORS = (zipfile.BadZipfile, zlib.error, NotImplementedError)
+
+
+class WheelInfoError(ValueError):
+    """ Error for wheel without readable metadata """
+
+
+# Extensions for files containing compiled code
+BINARY_EXTS = ('.so', '.dylib', '.pyd')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wheels (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT,
+    version TEXT,
+    tags TEXT,
+    requires TEXT,
+    n_files INTEGER,
+    size INTEGER,
+    uncompressed_size INTEGER,
+    has_binaries INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT,
+    file_size INTEGER,
+    mtime REAL,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS wheels_name ON wheels (name);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+"""
+
+WHEEL_FIELDS = ('sha256', 'name', 'version', 'tags', 'requires', 'n_files',
+                'size', 'uncompressed_size', 'has_binaries')
+
+
+def _headers(text, field):
+    """ Return values for header `field` in RFC 822 style `text` """
+    values = []
+    prefix = field + ':'
+    for line in text.splitlines():
+        if line == '': # End of headers
+            break
+        if line.startswith(prefix):
+            values.append(line[len(prefix):].strip())
+    return values
+
+
+def read_wheel_info(wheel_fname):
+    """ Return metadata dictionary for wheel `wheel_fname`
+
+    Reads only the zip central directory and the ``.dist-info/WHEEL`` and
+    ``.dist-info/METADATA`` members.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Wheel filename
+
+    Returns
+    -------
+    info : dict
+        Dictionary with keys ``name``, ``version``, ``tags`` (list),
+        ``requires`` (list of ``Requires-Dist`` values), ``n_files``,
+        ``size`` (compressed size of members), ``uncompressed_size`` and
+        ``has_binaries`` (True if wheel contains ``.so``, ``.dylib`` files).
+
+    Raises
+    ------
+    WheelInfoError
+        If `wheel_fname` is not a valid zip file, or has no ``WHEEL`` or
+        ``METADATA`` member, or the metadata has no name or version.
+    """
+    try:
+        with zipfile.ZipFile(wheel_fname) as zf:
+            infos = zf.infolist()
+            members = {}
+            for info in infos:
+                parts = info.filename.split('/')
+                if len(parts) == 2 and parts[0].endswith('.dist-info'):
+                    members[parts[1]] = info.filename
+            contents = {}
+            for key in ('METADATA', 'WHEEL'):
+                if not key in members:
+                    raise WheelInfoError(
+                        '{0}: no .dist-info/{1} member'.format(
+                            wheel_fname, key))
+                contents[key] = zf.read(members[key]).decode('utf-8',
+                                                             'replace')
+    except ZIP_ERRORS as e:
+        raise WheelInfoError('{0}: cannot read zip file; {1}'.format(
+            wheel_fname, e))
+    metadata, wheel = contents['METADATA'], contents['WHEEL']
+    name_version = []
+    for key in ('Name', 'Version'):
+        values = _headers(metadata, key)
+        if len(values) == 0:
+            raise WheelInfoError('{0}: no {1} in METADATA'.format(
+                wheel_fname, key))
+        name_version.append(values[0])
+    files = [info for info in infos if not info.filename.endswith('/')]
+    return dict(
+        name=name_version[0],
+        version=name_version[1],
+        tags=_headers(wheel, 'Tag'),
+        requires=_headers(metadata, 'Requires-Dist'),
+        n_files=len(files),
+        size=sum(info.compress_size for info in files),
+        uncompressed_size=sum(info.file_size for info in files),
+        has_binaries=any(info.filename.endswith(BINARY_EXTS)
+                         for info in files))
+
+
+def read_top_level(wheel_fname):
+    """ Return names of top-level modules that wheel `wheel_fname` installs
+
+    Use ``.dist-info/top_level.txt`` if present, otherwise find packages and
+    modules at the root of the wheel from the zip central directory.
+
+    Returns
+    -------
+    names : list
+        Sorted list of top-level importable names
+    """
+    with zipfile.ZipFile(wheel_fname) as zf:
+        paths = [info.filename for info in zf.infolist()]
+        top_levels = [path for path in paths
+                      if path.count('/') == 1 and
+                      path.split('/')[0].endswith('.dist-info') and
+                      path.endswith('/top_level.txt')]
+        if len(top_levels) == 1:
+            text = zf.read(top_levels[0]).decode('utf-8', 'replace')
+            return sorted(set(line.strip().replace('/', '.')
+                              for line in text.splitlines()
+                              if line.strip()))
+    names = set()
+    for path in paths:
+        parts = path.split('/')
+        if parts[0].endswith(('.dist-info', '.data')):
+            continue
+        if len(parts) == 2 and parts[1] == '__init__.py':
+            names.add(parts[0])
+        elif len(parts) == 1 and parts[0].endswith(('.py',) + BINARY_EXTS):
+            names.add(parts[0].split('.')[0])
+    return sorted(names)
+
+
+def _hash_and_read(path):
+    """ Return hash, metadata, error message for wheel `path`
+
+    Metadata is None, and error message is a str, if we could not read the
+    wheel.
+    """
+    try:
+        return file_sha256(path), read_wheel_info(path), None
+    except WheelInfoError as e:
+        return None, None, str(e)
+
+
+class WheelCatalog(object):
+    """ SQLite index of wheel metadata, keyed by wheel content hash
+    """
+
+    def __init__(self, db_fname):
+        """ Initialize catalog
+
+        Parameters
+        ----------
+        db_fname : str
+            Filename of SQLite database.  Created if it does not exist.
+        """
+        self.db_fname = db_fname
+        self.conn = sqlite3.connect(db_fname, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        # Wheels we could not read, from last call to ``update``
+        self.bad_wheels = {}
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, wheel_dir, n_jobs=None):
+        """ Update catalog for wheels in directory `wheel_dir`
+
+        Read wheels that are new or have changed size or modification time.
+        Forget files from `wheel_dir` that no longer exist.  Skip wheels we
+        cannot read; we store their paths, with the error message, in the
+        ``bad_wheels`` dictionary, and do not record them in the catalog.
+
+        Parameters
+        ----------
+        wheel_dir : str
+            Directory containing wheels
+        n_jobs : None or int, optional
+            Number of wheels to hash and read at the same time.  None means
+            use the number of CPUs.
+
+        Returns
+        -------
+        n_read : int
+            Number of wheels we hashed and read successfully
+        n_removed : int
+            Number of missing wheel files we removed from the catalog
+        """
+        wheel_dir = abspath(wheel_dir)
+        known = dict(
+            (row[0], row[1:]) for row in self.conn.execute(
+                'SELECT path, file_size, mtime FROM files WHERE dir = ?',
+                (wheel_dir,)))
+        to_read = []
+        stats = {}
+        for path in glob(pjoin(wheel_dir, '*.whl')):
+            stat = os.stat(path)
+            stats[path] = (stat.st_size, stat.st_mtime)
+            if known.get(path) != stats[path]:
+                to_read.append(path)
+        results = []
+        if to_read:
+            n_jobs = cpu_count() if n_jobs is None else n_jobs
+            pool = ThreadPool(min(n_jobs, len(to_read)))
+            try:
+                results = pool.map(_hash_and_read, to_read)
+            finally:
+                pool.close()
+                pool.join()
+        self.bad_wheels = dict((path, error) for path, (_, _, error)
+                               in zip(to_read, results)
+                               if not error is None)
+        removed = [path for path in known
+                   if not path in stats or path in self.bad_wheels]
+        n_read = 0
+        with self.conn:
+            for path in removed:
+                self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            for path, (sha256, info, error) in zip(to_read, results):
+                if not error is None:
+                    continue
+                n_read += 1
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                    (path, wheel_dir) + stats[path] + (sha256,))
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO wheels VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (sha256, info['name'], info['version'],
+                     json.dumps(info['tags']), json.dumps(info['requires']),
+                     info['n_files'], info['size'],
+                     info['uncompressed_size'], int(info['has_binaries'])))
+        return n_read, len(removed)
+
+    def _row2dict(self, row):
+        record = dict(zip(('path',) + WHEEL_FIELDS, row))
+        record['tags'] = json.loads(record['tags'])
+        record['requires'] = json.loads(record['requires'])
+        record['has_binaries'] = bool(record['has_binaries'])
+        return record
+
+    def query(self, wheel_dir=None, name=None, has_binaries=None):
+        """ Return list of records for cataloged wheel files
+
+        Parameters
+        ----------
+        wheel_dir : None or str, optional
+            If not None, only return wheel files in this directory
+        name : None or str, optional
+            If not None, only return wheels with this distribution name
+            (case insensitive)
+        has_binaries : None or bool, optional
+            If not None, only return wheels with (True) or without (False)
+            ``.so`` / ``.dylib`` files
+
+        Returns
+        -------
+        records : list
+            List of dictionaries, one per wheel file, with ``path`` key, and
+            keys as for :func:`read_wheel_info`, plus ``sha256``.
+        """
+        sql = ('SELECT files.path, ' +
+               ', '.join('wheels.' + f for f in WHEEL_FIELDS) +
+               ' FROM files JOIN wheels ON files.sha256 = wheels.sha256')
+        where, params = [], []
+        if not wheel_dir is None:
+            where.append('files.dir = ?')
+            params.append(abspath(wheel_dir))
+        if not name is None:
+            where.append('lower(wheels.name) = lower(?)')
+            params.append(name)
+        if not has_binaries is None:
+            where.append('wheels.has_binaries = ?')
+            params.append(int(has_binaries))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY files.path'
+        return [self._row2dict(row) for row in self.conn.execute(sql, params)]
+
+    def get(self, path, current=False):
+        """ Return record for wheel file `path` or None if not cataloged
+
+        Parameters
+        ----------
+        path : str
+            Wheel filename
+        current : bool, optional
+            If True, also return None if the file has changed size or
+            modification time since we cataloged it, or no longer exists.
+            Use this to read the catalog without updating it.
+        """
+        path = abspath(path)
+        sql = ('SELECT files.path, ' +
+               ', '.join('wheels.' + f for f in WHEEL_FIELDS) +
+               ', files.file_size, files.mtime'
+               ' FROM files JOIN wheels ON files.sha256 = wheels.sha256'
+               ' WHERE files.path = ?')
+        rows = list(self.conn.execute(sql, (path,)))
+        if len(rows) == 0:
+            return None
+        if current:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if (stat.st_size, stat.st_mtime) != tuple(rows[0][-2:]):
+                return None
+        return self._row2dict(rows[0][:-2])
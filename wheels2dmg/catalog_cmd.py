@@ -0,0 +1,55 @@
+""" wheels2dmg-catalog command module
+"""
+from __future__ import division, print_function
+
+import sys
+import json
+from argparse import ArgumentParser
+
+from .catalog import WheelCatalog
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description="Update and query SQLite catalog of wheel metadata")
+    parser.add_argument('db_fname', type=str,
+                        help='catalog database filename')
+    parser.add_argument('wheel_dirs', type=str, nargs='*', default=[],
+                        help='directories of wheels to add to catalog, and '
+                        'to query', metavar='WHEEL_DIR')
+    parser.add_argument('--name', type=str,
+                        help='only list wheels for this distribution name')
+    parser.add_argument('--binaries', action='store_true',
+                        help='only list wheels with .so or .dylib files')
+    parser.add_argument('--pure', action='store_true',
+                        help='only list wheels without .so or .dylib files')
+    parser.add_argument('--json', action='store_true',
+                        help='print records as JSON')
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    has_binaries = True if args.binaries else False if args.pure else None
+    catalog = WheelCatalog(args.db_fname)
+    records = []
+    for wheel_dir in args.wheel_dirs:
+        catalog.update(wheel_dir)
+        for path, error in sorted(catalog.bad_wheels.items()):
+            print('Skipping unreadable wheel ' + error, file=sys.stderr)
+        records += catalog.query(wheel_dir, args.name, has_binaries)
+    if len(args.wheel_dirs) == 0:
+        records = catalog.query(None, args.name, has_binaries)
+    catalog.close()
+    if args.json:
+        print(json.dumps(records, indent=2, sort_keys=True))
+        return
+    for record in records:
+        print('{0} {1} files={2} size={3} uncompressed={4}{5}'.format(
+            record['name'],
+            record['version'],
+            record['n_files'],
+            record['size'],
+            record['uncompressed_size'],
+            ' binaries' if record['has_binaries'] else ''))
@@ -0,0 +1,175 @@
+""" Compiler cache (``ccache``) for building wheels from source
+
+We point ``CC``, ``CXX`` and ``FC`` at small wrapper scripts that run the
+real compiler via ``ccache``.  Build systems that split ``CC`` on spaces, or
+check it is a single executable, then work as usual.  Each Python version and
+architecture has its own cache directory, because their objects can't be
+shared.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import join as pjoin, abspath, isfile, exists
+from tempfile import gettempdir
+import stat
+import shlex
+try:
+    from shlex import quote as sh_quote # Python 3
+except ImportError:
+    from pipes import quote as sh_quote # Python 2
+
+from .runner import CommandRunner
+
+# Environment variables for compilers, and default compiler for each
+COMPILERS = (('CC', 'cc'), ('CXX', 'c++'), ('FC', 'gfortran'))
+
+# {command} is the shell-quoted ccache path and compiler words
+WRAPPER_TEMPLATE = """#!/bin/sh
+exec {command} "$@"
+"""
+
+# Names of ``ccache --print-stats`` counters for hits and misses; ccache 3
+# and 4 use different names
+HIT_STATS = ('direct_cache_hit', 'preprocessed_cache_hit',
+             'cache_hit_direct', 'cache_hit_cpp')
+MISS_STATS = ('cache_miss',)
+
+
+def find_executable(name, path=None):
+    """ Return full path of executable `name` on `path`, or None
+
+    Parameters
+    ----------
+    name : str
+        Name of executable
+    path : None or str, optional
+        Search path, separated by ``os.pathsep``.  None means use the
+        ``PATH`` environment variable.
+    """
+    path = os.environ.get('PATH', os.defpath) if path is None else path
+    for dirname in path.split(os.pathsep):
+        candidate = pjoin(dirname, name)
+        if isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+class CompilerCache(object):
+    """ ``ccache`` directories and compiler wrappers for source builds
+    """
+
+    def __init__(self, cache_root, ccache_path=None):
+        """ Initialize compiler cache
+
+        Parameters
+        ----------
+        cache_root : str
+            Directory containing cache directories for each Python version
+            and architecture.  Created if it does not exist.
+        ccache_path : None or str, optional
+            Path to ``ccache`` executable.  None means find ``ccache`` on the
+            ``PATH``.
+
+        Raises
+        ------
+        RuntimeError
+            If we cannot find ``ccache``
+        """
+        self.cache_root = abspath(cache_root)
+        if not exists(self.cache_root):
+            os.makedirs(self.cache_root)
+        ccache_path = (find_executable('ccache') if ccache_path is None
+                       else ccache_path)
+        if ccache_path is None:
+            raise RuntimeError('Need ccache on the PATH for compiler cache')
+        self.ccache_path = ccache_path
+        # Keep all output lines, for statistics
+        self.runner = CommandRunner(echo=False, tail_lines=None)
+
+    def cache_dir(self, pyv_mm, arch):
+        """ Return cache directory for Python `pyv_mm`, architecture `arch`
+        """
+        return pjoin(self.cache_root, 'py{0}-{1}'.format(pyv_mm, arch))
+
+    def write_wrappers(self, wrapper_dir, environ=None):
+        """ Write compiler wrapper scripts to `wrapper_dir`
+
+        Parameters
+        ----------
+        wrapper_dir : str
+            Directory to which to write wrappers.  Created if it does not
+            exist.
+        environ : None or dict, optional
+            Environment giving real compilers in ``CC``, ``CXX``, ``FC``.
+            None means use ``os.environ``.  Missing or empty variables give
+            default compilers.  Values can include arguments, as in ``CC="gcc
+            -arch x86_64"``; we split them as the shell would.
+
+        Returns
+        -------
+        wrappers : dict
+            Mapping of compiler environment variable name to wrapper path
+        """
+        environ = os.environ if environ is None else environ
+        if not exists(wrapper_dir):
+            os.makedirs(wrapper_dir)
+        wrappers = {}
+        for var, default in COMPILERS:
+            wrapper = pjoin(wrapper_dir, default)
+            compiler = shlex.split(environ.get(var, '')) or [default]
+            command = ' '.join(sh_quote(word) for word in
+                               [self.ccache_path] + compiler)
+            with open(wrapper, 'wt') as fobj:
+                fobj.write(WRAPPER_TEMPLATE.format(command=command))
+            os.chmod(wrapper, os.stat(wrapper).st_mode |
+                     stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+            wrappers[var] = wrapper
+        return wrappers
+
+    def build_env(self, pyv_mm, arch, wrapper_dir, environ=None):
+        """ Return environment for compiling via ``ccache``
+
+        Parameters
+        ----------
+        pyv_mm : str
+            Python major, minor version without dot, e.g. "34"
+        arch : str
+            Architecture of build, e.g. "x86_64"
+        wrapper_dir : str
+            Directory to which to write compiler wrappers
+        environ : None or dict, optional
+            Environment to modify.  None means use ``os.environ``.
+
+        Returns
+        -------
+        env : dict
+            Copy of `environ` with compiler and ``ccache`` variables
+        """
+        environ = os.environ if environ is None else environ
+        env = dict(environ)
+        env.update(self.write_wrappers(wrapper_dir, environ))
+        env['CCACHE_DIR'] = self.cache_dir(pyv_mm, arch)
+        # pip builds in randomly named temporary directories; use paths
+        # relative to the temporary directory so builds share cache entries
+        env['CCACHE_BASEDIR'] = os.path.realpath(gettempdir())
+        env['CCACHE_NOHASHDIR'] = '1'
+        return env
+
+    def stats(self, pyv_mm, arch):
+        """ Return hit and miss counts for cache directory
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with ``hits`` and ``misses``
+        """
+        env = dict(os.environ, CCACHE_DIR=self.cache_dir(pyv_mm, arch))
+        record = self.runner.check_call([self.ccache_path, '--print-stats'],
+                                        env=env)
+        counts = {}
+        for line in record.output_tail.splitlines():
+            parts = line.split('\t')
+            if len(parts) == 2 and parts[1].strip().isdigit():
+                counts[parts[0]] = int(parts[1])
+        return dict(hits=sum(counts.get(name, 0) for name in HIT_STATS),
+                    misses=sum(counts.get(name, 0) for name in MISS_STATS))
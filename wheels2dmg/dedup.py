@@ -0,0 +1,345 @@
+""" Find and consolidate copies of the same library in several wheels
+
+Delocate copies the libraries that a wheel needs into a ``.dylibs``
+directory inside the wheel.  Wheels in the same wheelhouse often carry their
+own copies of the same libraries, such as ``libgfortran`` or OpenBLAS.  We
+find copies with the same contents, and can move them into one support wheel
+that the other wheels depend on.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import join as pjoin, dirname, basename, relpath, normpath
+import re
+import io
+import shutil
+import hashlib
+import zipfile
+from glob import glob
+from tempfile import mkdtemp
+from collections import defaultdict, Counter
+
+from delocate.tools import zip2dir
+
+from .macho import get_install_names, set_install_names, MachOError
+from .planner import parse_wheel_fname
+from .wheeltools import write_record, write_wheel_zip
+from .tmpdirs import REAPER
+
+# Directory in wheel to which delocate copies libraries
+LIB_SDIR = '.dylibs'
+
+LOADER_PATH = '@loader_path/'
+
+# Read library contents in chunks of this many bytes
+READ_BLOCKSIZE = 2 ** 20
+
+SUPPORT_WHEEL_TEMPLATE = """Wheel-Version: 1.0
+Generator: wheels2dmg
+Root-Is-Purelib: false
+{tags}
+"""
+
+SUPPORT_METADATA_TEMPLATE = """Metadata-Version: 2.1
+Name: {name}
+Version: {version}
+Summary: Libraries shared between wheels
+"""
+
+
+def find_libs(wheel_fname):
+    """ Return libraries that delocate has copied into wheel `wheel_fname`
+
+    Returns
+    -------
+    libs : list
+        List of (path, sha256, size) tuples, where `path` is the path of the
+        library within the wheel, and `sha256` is the hex digest of the
+        library contents.
+    """
+    libs = []
+    with zipfile.ZipFile(wheel_fname) as zf:
+        for info in zf.infolist():
+            parts = info.filename.split('/')
+            if len(parts) < 2 or parts[-2] != LIB_SDIR or parts[-1] == '':
+                continue
+            sha = hashlib.sha256()
+            with zf.open(info) as fobj:
+                for block in iter(lambda: fobj.read(READ_BLOCKSIZE), b''):
+                    sha.update(block)
+            libs.append((info.filename, sha.hexdigest(), info.file_size))
+    return libs
+
+
+def find_duplicates(wheel_fnames):
+    """ Return libraries with the same contents in more than one place
+
+    Parameters
+    ----------
+    wheel_fnames : sequence
+        Filenames of wheels to search
+
+    Returns
+    -------
+    duplicates : dict
+        Mapping of sha256 hex digest of library contents to list of
+        (wheel_fname, path, size) tuples, one per copy, for libraries with
+        more than one copy.
+    """
+    copies = defaultdict(list)
+    for wheel_fname in wheel_fnames:
+        for path, sha, size in find_libs(wheel_fname):
+            copies[sha].append((wheel_fname, path, size))
+    return dict((sha, lib_copies) for sha, lib_copies in copies.items()
+                if len(lib_copies) > 1)
+
+
+def duplicate_report(duplicates):
+    """ Return summary of `duplicates` from :func:`find_duplicates`
+
+    Returns
+    -------
+    report : dict
+        Dictionary with ``duplicated_bytes`` (bytes taken by copies after
+        the first of each library), and ``libraries``, a list with a dict
+        for each duplicated library, with ``name``, ``sha256``, ``size`` and
+        ``copies`` (list of "<wheel>:<path>" strings).  Libraries with the
+        most duplicated bytes come first.
+    """
+    libraries = []
+    for sha, copies in duplicates.items():
+        size = copies[0][2]
+        libraries.append(dict(
+            name=basename(copies[0][1]),
+            sha256=sha,
+            size=size,
+            copies=sorted('{0}:{1}'.format(basename(wheel_fname), path)
+                          for wheel_fname, path, size in copies)))
+    libraries.sort(key=lambda lib: (-lib['size'] * (len(lib['copies']) - 1),
+                                    lib['name']))
+    return dict(duplicated_bytes=sum(lib['size'] * (len(lib['copies']) - 1)
+                                     for lib in libraries),
+                libraries=libraries)
+
+
+def _loaded_path(path, install_name):
+    """ Return path in wheel of `install_name` loaded from file `path`
+
+    Returns None if `install_name` is not relative to ``@loader_path``.
+    """
+    if not install_name.startswith(LOADER_PATH):
+        return None
+    return normpath(pjoin(dirname(path), install_name[len(LOADER_PATH):]))
+
+
+def _depends(fname):
+    """ Return library dependencies of `fname`, empty if not Mach-O """
+    try:
+        depends = get_install_names(fname)[1]
+    except MachOError:
+        return []
+    return [] if depends is None else depends
+
+
+def _add_requirement(wheel_dir, requirement):
+    """ Add ``Requires-Dist`` `requirement` to metadata of unpacked wheel """
+    metadata = glob(pjoin(wheel_dir, '*.dist-info', 'METADATA'))[0]
+    with io.open(metadata, 'rt', encoding='utf-8') as fobj:
+        lines = fobj.read().split('\n')
+    # Headers end at the first blank line
+    end = lines.index('') if '' in lines else len(lines)
+    lines.insert(end, u'Requires-Dist: ' + requirement)
+    with io.open(metadata, 'wt', encoding='utf-8') as fobj:
+        fobj.write(u'\n'.join(lines))
+
+
+def _plan_moves(groups, wheel_dirs, support_pkg):
+    """ Drop groups and wheels we cannot consolidate, return changes
+
+    Parameters
+    ----------
+    groups : dict
+        Mapping of sha256 to dict mapping wheel filename to list of paths of
+        library copies in the wheel.  Modified in-place to remove groups and
+        wheels we cannot consolidate.
+    wheel_dirs : dict
+        Mapping of wheel filename to directory containing unpacked wheel
+    support_pkg : str
+        Name of package directory in support wheel
+
+    Returns
+    -------
+    moving : dict
+        Mapping of wheel filename to set of paths of libraries to move
+    changes : dict
+        Mapping of wheel filename to dict mapping file path to dict of
+        install name changes for the file
+    """
+    while True:
+        moving = defaultdict(set)
+        for by_wheel in groups.values():
+            for wheel_fname, paths in by_wheel.items():
+                moving[wheel_fname].update(paths)
+        # Moved libraries can only load other moved libraries from the same
+        # directory, relative to the loading library
+        bad_groups = set()
+        for sha, by_wheel in groups.items():
+            for wheel_fname, paths in by_wheel.items():
+                for path in paths:
+                    for name in _depends(pjoin(wheel_dirs[wheel_fname],
+                                               path)):
+                        dep_path = _loaded_path(path, name)
+                        if dep_path is None:
+                            continue
+                        if (not dep_path in moving[wheel_fname] or
+                            dirname(dep_path) != dirname(path)):
+                            bad_groups.add(sha)
+        if bad_groups:
+            for sha in bad_groups:
+                del groups[sha]
+            continue
+        # Point files loading moved libraries at the support wheel
+        changes = defaultdict(dict)
+        bad_wheels = set()
+        for wheel_fname, moved in moving.items():
+            wheel_dir = wheel_dirs[wheel_fname]
+            for root, dirs, files in os.walk(wheel_dir):
+                for fname in files:
+                    full_path = pjoin(root, fname)
+                    path = relpath(full_path, wheel_dir)
+                    if path in moved:
+                        continue
+                    file_changes = {}
+                    for name in _depends(full_path):
+                        dep_path = _loaded_path(path, name)
+                        if not dep_path in moved:
+                            continue
+                        new_path = pjoin(support_pkg, LIB_SDIR,
+                                         basename(dep_path))
+                        file_changes[name] = LOADER_PATH + relpath(
+                            new_path, dirname(path) or '.')
+                    if len(file_changes) == 0:
+                        continue
+                    try:
+                        set_install_names(full_path, file_changes,
+                                          dry_run=True)
+                    except MachOError:
+                        bad_wheels.add(wheel_fname)
+                    changes[wheel_fname][full_path] = file_changes
+        if len(bad_wheels) == 0:
+            return moving, changes
+        for sha, by_wheel in list(groups.items()):
+            for wheel_fname in bad_wheels:
+                by_wheel.pop(wheel_fname, None)
+            if sum(len(paths) for paths in by_wheel.values()) < 2:
+                del groups[sha]
+
+
+def consolidate_libs(wheel_fnames, support_name, support_version, out_dir):
+    """ Move copies of libraries in several wheels into a support wheel
+
+    Write a support wheel with one copy of each library that has more than
+    one copy in `wheel_fnames`, and rewrite the wheels in-place to load the
+    libraries from the support wheel, and to depend on the support wheel.
+
+    We leave libraries in place when we cannot safely move them; when copies
+    have different names, when different libraries have the same name, when
+    a library loads a library we are not moving, or when the new install
+    names do not fit in the headers of a binary in a wheel.
+
+    Parameters
+    ----------
+    wheel_fnames : sequence
+        Filenames of wheels to consolidate
+    support_name : str
+        Distribution name of support wheel
+    support_version : str
+        Version of support wheel
+    out_dir : str
+        Directory to which to write support wheel
+
+    Returns
+    -------
+    support_fname : None or str
+        Filename of written support wheel, or None if there were no
+        libraries to consolidate
+    moved : dict
+        Mapping of library name to (size, n_copies) tuple for consolidated
+        libraries, where `n_copies` is the number of copies removed from
+        wheels
+    """
+    duplicates = find_duplicates(wheel_fnames)
+    groups = {}
+    lib_sizes = {}
+    for sha, copies in duplicates.items():
+        names = set(basename(path) for wheel_fname, path, size in copies)
+        if len(names) != 1:
+            continue
+        by_wheel = defaultdict(list)
+        for wheel_fname, path, size in copies:
+            by_wheel[wheel_fname].append(path)
+        groups[sha] = dict(by_wheel)
+        lib_sizes[sha] = (names.pop(), copies[0][2])
+    # Libraries must have unique names in the support wheel
+    name_counts = Counter(lib_sizes[sha][0] for sha in groups)
+    for sha in list(groups):
+        if name_counts[lib_sizes[sha][0]] > 1:
+            del groups[sha]
+    if len(groups) == 0:
+        return None, {}
+    support_pkg = re.sub(r'[^\w.]+', '_', support_name)
+    tmp_root = mkdtemp()
+    try:
+        wheel_dirs = {}
+        for by_wheel in groups.values():
+            for wheel_fname in by_wheel:
+                if wheel_fname in wheel_dirs:
+                    continue
+                wheel_dir = pjoin(tmp_root, str(len(wheel_dirs)))
+                zip2dir(wheel_fname, wheel_dir)
+                wheel_dirs[wheel_fname] = wheel_dir
+        moving, changes = _plan_moves(groups, wheel_dirs, support_pkg)
+        if len(groups) == 0:
+            return None, {}
+        # Support wheel
+        support_dir = pjoin(tmp_root, 'support')
+        lib_dir = pjoin(support_dir, support_pkg, LIB_SDIR)
+        os.makedirs(lib_dir)
+        moved = {}
+        for sha, by_wheel in groups.items():
+            name, size = lib_sizes[sha]
+            wheel_fname, paths = sorted(by_wheel.items())[0]
+            shutil.copy2(pjoin(wheel_dirs[wheel_fname], paths[0]),
+                         pjoin(lib_dir, name))
+            moved[name] = (size, sum(len(paths)
+                                     for paths in by_wheel.values()))
+        plat = parse_wheel_fname(sorted(moving)[0])['plat']
+        info_dir = pjoin(support_dir, '{0}-{1}.dist-info'.format(
+            support_pkg, support_version))
+        os.makedirs(info_dir)
+        with open(pjoin(info_dir, 'WHEEL'), 'wt') as fobj:
+            fobj.write(SUPPORT_WHEEL_TEMPLATE.format(
+                tags='\n'.join('Tag: {0}-none-{1}'.format(py, tag)
+                               for py in ('py2', 'py3')
+                               for tag in plat.split('.'))))
+        with open(pjoin(info_dir, 'METADATA'), 'wt') as fobj:
+            fobj.write(SUPPORT_METADATA_TEMPLATE.format(
+                name=support_name, version=support_version))
+        write_record(support_dir)
+        support_fname = pjoin(out_dir, '{0}-{1}-py2.py3-none-{2}.whl'.format(
+            support_pkg, support_version, plat))
+        write_wheel_zip(support_dir, support_fname)
+        # Wheels loading from support wheel
+        for wheel_fname, paths in moving.items():
+            wheel_dir = wheel_dirs[wheel_fname]
+            for path in paths:
+                os.unlink(pjoin(wheel_dir, path))
+            for full_path, file_changes in changes[wheel_fname].items():
+                set_install_names(full_path, file_changes)
+            _add_requirement(wheel_dir, u'{0}=={1}'.format(support_name,
+                                                          support_version))
+            write_record(wheel_dir)
+            write_wheel_zip(wheel_dir, wheel_fname)
+    finally:
+        REAPER.reap(tmp_root)
+    return support_fname, moved
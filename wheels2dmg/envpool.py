@@ -0,0 +1,162 @@
+""" Pool of isolated build environments, reused between builds
+
+Each environment is a virtualenv for one Python.org Python, with pip from one
+version of ``get-pip.py`` and ``wheel`` installed.  We keep several
+environments for each Python and pip, so concurrent builds can each lease
+their own.  A lease holds an exclusive ``flock`` on a lock file next to the
+environment, so leases work across threads and processes.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import exists, join as pjoin, abspath
+import shutil
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+from .wheelcache import file_sha256, make_key
+from .runner import CommandRunner
+
+# File in environment directory recording a completed environment
+ENV_MARKER = 'wheels2dmg-env.json'
+
+# Command to check environment is usable
+HEALTH_CHECK = 'import pip, wheel'
+
+
+class BuildEnv(object):
+    """ Leased build environment
+    """
+
+    def __init__(self, env_dir, key, created=False):
+        self.env_dir = env_dir
+        self.key = key
+        self.created = created
+
+    @property
+    def python(self):
+        """ Path to Python executable in environment """
+        return pjoin(self.env_dir, 'bin', 'python')
+
+    @property
+    def pip_cmd(self):
+        """ Command list to run pip in environment """
+        return [self.python, '-m', 'pip']
+
+
+class BuildEnvPool(object):
+    """ Pool of virtualenvs in a directory, keyed by Python and pip version
+    """
+
+    def __init__(self, pool_dir, runner=None):
+        """ Initialize pool
+
+        Parameters
+        ----------
+        pool_dir : str
+            Directory in which to keep environments.  Created if it does not
+            exist.
+        runner : None or :class:`CommandRunner` instance, optional
+            Runner with which to run commands.  If None, make a new runner.
+        """
+        self.pool_dir = abspath(pool_dir)
+        if not exists(self.pool_dir):
+            os.makedirs(self.pool_dir)
+        self.runner = CommandRunner() if runner is None else runner
+
+    def env_key(self, python_path, get_pip_path):
+        """ Return key for environments from `python_path`, `get_pip_path`
+        """
+        return make_key(os.path.realpath(python_path),
+                        file_sha256(get_pip_path))
+
+    def is_healthy(self, env_dir, key):
+        """ Return True if environment `env_dir` is complete and working
+        """
+        marker = pjoin(env_dir, ENV_MARKER)
+        if not exists(marker):
+            return False
+        with open(marker, 'rt') as fobj:
+            if json.load(fobj).get('key') != key:
+                return False
+        env = BuildEnv(env_dir, key)
+        if not exists(env.python):
+            return False
+        record = self.runner.run([env.python, '-c', HEALTH_CHECK])
+        return record.returncode == 0
+
+    def create(self, env_dir, key, python_path, get_pip_path, pip_params=()):
+        """ Make new environment in `env_dir`, replacing any existing
+
+        Parameters
+        ----------
+        env_dir : str
+            Directory for environment
+        key : str
+            Key for environment, from :meth:`env_key`
+        python_path : str
+            Path to Python executable for environment.  Python should have
+            the ``venv`` module (Python >= 3.4).
+        get_pip_path : str
+            Path to local copy of ``get-pip.py``
+        pip_params : sequence, optional
+            Parameters to pass to pip when installing
+        """
+        if exists(env_dir):
+            shutil.rmtree(env_dir)
+        self.runner.check_call([python_path, '-m', 'venv', '--without-pip',
+                                env_dir])
+        env = BuildEnv(env_dir, key)
+        self.runner.check_call([env.python, get_pip_path] + list(pip_params))
+        self.runner.check_call(env.pip_cmd +
+                               ['install', '--upgrade', 'wheel'] +
+                               list(pip_params))
+        with open(pjoin(env_dir, ENV_MARKER), 'wt') as fobj:
+            json.dump(dict(key=key,
+                           python=python_path,
+                           created=time.time()), fobj)
+
+    @contextmanager
+    def lease(self, python_path, get_pip_path, pip_params=()):
+        """ Context manager giving exclusive use of a build environment
+
+        Use an idle healthy environment for this Python and ``get-pip.py``
+        if there is one, otherwise make a new one.
+
+        Parameters
+        ----------
+        python_path : str
+            Path to Python executable for environment
+        get_pip_path : str
+            Path to local copy of ``get-pip.py``
+        pip_params : sequence, optional
+            Parameters to pass to pip when installing
+
+        Yields
+        ------
+        env : :class:`BuildEnv` instance
+            Leased environment
+        """
+        key = self.env_key(python_path, get_pip_path)
+        slot = 0
+        while True:
+            env_dir = pjoin(self.pool_dir, '{0}-{1}'.format(key[:16], slot))
+            lock_fobj = open(env_dir + '.lock', 'a')
+            try:
+                fcntl.flock(lock_fobj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                lock_fobj.close()
+                slot += 1
+                continue
+            break
+        try:
+            created = not self.is_healthy(env_dir, key)
+            if created:
+                self.create(env_dir, key, python_path, get_pip_path,
+                            pip_params)
+            yield BuildEnv(env_dir, key, created)
+        finally:
+            fcntl.flock(lock_fobj, fcntl.LOCK_UN)
+            lock_fobj.close()
@@ -0,0 +1,208 @@
+""" Progress events from builds, for running builds in-process
+
+A :class:`PkgWriter` has an :class:`EventEmitter` as its ``events``
+attribute.  The writer and its command runner emit :class:`Event` tuples as
+the build goes: stages starting and ending, wheels fetched and processed,
+external commands, and bytes written to outputs.  Callers can pass
+callbacks to the emitter, or iterate over events with :class:`BuildEvents`,
+and can cancel the build from another thread.
+"""
+from __future__ import division, print_function
+
+import os
+import time
+import threading
+from collections import namedtuple
+
+try:
+    from queue import Queue # Python 3
+except ImportError:
+    from Queue import Queue # Python 2
+
+# Kinds of event, and the keys in the event ``info`` dict
+STAGE_START = 'stage_start'         # name
+STAGE_END = 'stage_end'             # name, time, error
+WHEEL_FETCHED = 'wheel_fetched'     # filename, size
+WHEEL_PROCESSED = 'wheel_processed' # filename, action
+COMMAND_START = 'command_start'     # cmd
+COMMAND_END = 'command_end'         # cmd, returncode, wall_time
+BYTES_WRITTEN = 'bytes_written'     # format, filename, size
+BUILD_END = 'build_end'             # outputs, error
+
+EVENT_KINDS = (STAGE_START, STAGE_END, WHEEL_FETCHED, WHEEL_PROCESSED,
+               COMMAND_START, COMMAND_END, BYTES_WRITTEN, BUILD_END)
+
+# `kind` from ``EVENT_KINDS``; `time` in seconds since the epoch; `info`
+# dict with values for this kind of event
+Event = namedtuple('Event', ['kind', 'time', 'info'])
+
+
+class BuildCancelled(Exception):
+    """ Error for a build cancelled with :meth:`EventEmitter.cancel` """
+
+
+class EventEmitter(object):
+    """ Send build events to callbacks, and carry cancellation requests
+
+    Callbacks run in the thread emitting the event, which may not be the
+    thread that started the build, but only one callback runs at a time.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self._cancelled = threading.Event()
+        self._on_cancel = []
+
+    def add_callback(self, callback):
+        """ Call ``callback(event)`` for each :class:`Event` """
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """ Stop calling `callback` for events """
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def emit(self, kind, **info):
+        """ Send event of kind `kind` with `info` to callbacks, return event
+        """
+        event = Event(kind, time.time(), info)
+        with self._lock:
+            for callback in self._callbacks:
+                callback(event)
+        return event
+
+    @property
+    def cancelled(self):
+        """ True if someone has asked to cancel the build """
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """ Ask build to stop at the next check, stop running commands
+
+        Can be called from any thread.
+        """
+        self._cancelled.set()
+        with self._lock:
+            on_cancel = list(self._on_cancel)
+        for func in on_cancel:
+            func()
+
+    def reset(self):
+        """ Clear cancellation request, for a new build """
+        self._cancelled.clear()
+
+    def check(self):
+        """ Raise BuildCancelled if someone has asked to cancel the build """
+        if self.cancelled:
+            raise BuildCancelled('Build cancelled')
+
+    def add_on_cancel(self, func):
+        """ Call `func` on :meth:`cancel`, e.g. to stop a running process
+
+        Call now if already cancelled.
+        """
+        with self._lock:
+            self._on_cancel.append(func)
+        if self.cancelled:
+            func()
+
+    def remove_on_cancel(self, func):
+        """ Stop calling `func` on :meth:`cancel` """
+        with self._lock:
+            self._on_cancel.remove(func)
+
+
+class BuildEvents(object):
+    """ Iterate over events from ``write_dmg`` running in another thread
+
+    Something like::
+
+        build = BuildEvents(pkg_writer, out_dir)
+        for event in build:
+            if stalled(event):
+                build.cancel()
+        print(build.result)
+
+    Iteration ends after the :data:`BUILD_END` event, and then raises any
+    error from the build, including :class:`BuildCancelled`.  Starting the
+    iteration clears any cancellation of an earlier build with the same
+    writer.
+    """
+
+    def __init__(self, pkg_writer, out_dir, **kwargs):
+        """ Initialize build event iterator
+
+        Parameters
+        ----------
+        pkg_writer : :class:`PkgWriter` instance
+            Writer with which to build
+        out_dir : str
+            Directory to which to write outputs
+        \\*\\*kwargs : dict
+            Other keyword arguments for ``pkg_writer.write_dmg``
+        """
+        self.pkg_writer = pkg_writer
+        self.out_dir = out_dir
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self._queue = Queue()
+        self._thread = None
+
+    def _run(self):
+        events = self.pkg_writer.events
+        events.add_callback(self._queue.put)
+        try:
+            self.result = self.pkg_writer.write_dmg(self.out_dir,
+                                                    **self.kwargs)
+        except BaseException as err:
+            self.error = err
+        finally:
+            events.remove_callback(self._queue.put)
+            self._queue.put(None)
+
+    def __iter__(self):
+        if not self._thread is None:
+            raise RuntimeError('Can only iterate over build once')
+        # New build; clear cancellation of an earlier build, before the
+        # build thread starts, so we keep any cancel from now on
+        self.pkg_writer.events.reset()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            yield event
+        self._thread.join()
+        if not self.error is None:
+            raise self.error
+
+    def cancel(self):
+        """ Cancel build; iteration stops soon after """
+        self.pkg_writer.events.cancel()
+
+
+def format_event(event):
+    """ Return one-line progress message for `event`, or None to skip it
+    """
+    info = event.info
+    if event.kind == STAGE_START:
+        return '{0} ...'.format(info['name'])
+    if event.kind == STAGE_END:
+        return '{0} {1} ({2:.1f}s)'.format(
+            info['name'], 'failed' if info['error'] else 'done', info['time'])
+    if event.kind == WHEEL_FETCHED:
+        return '  fetched {0}'.format(info['filename'])
+    if event.kind == WHEEL_PROCESSED:
+        return '  {0} {1}'.format(info['action'], info['filename'])
+    if event.kind == COMMAND_END and info['returncode'] != 0:
+        return '  {0} exited with code {1}'.format(
+            os.path.basename(info['cmd'][0]), info['returncode'])
+    if event.kind == BYTES_WRITTEN:
+        return '  wrote {0} ({1:.1f} MB)'.format(info['filename'],
+                                                 info['size'] / 2 ** 20)
+    return None
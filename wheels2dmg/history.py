@@ -0,0 +1,279 @@
+""" SQLite database of builds, and detection of build regressions
+"""
+from __future__ import division, print_function
+
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pkg_name TEXT,
+    pkg_version TEXT,
+    pyv_mm TEXT,
+    start_time REAL,
+    inputs_digest TEXT,
+    status TEXT,
+    error TEXT,
+    total_time REAL,
+    stage_times TEXT,
+    wheelhouse_size INTEGER,
+    dmg_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS build_wheels (
+    build_id INTEGER,
+    filename TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS builds_pkg ON builds (pkg_name, pyv_mm);
+CREATE INDEX IF NOT EXISTS build_wheels_build ON build_wheels (build_id);
+"""
+
+BUILD_FIELDS = ('id', 'pkg_name', 'pkg_version', 'pyv_mm', 'start_time',
+                'inputs_digest', 'status', 'error', 'total_time',
+                'stage_times', 'wheelhouse_size', 'dmg_size')
+
+# Default fractional increase over baseline that counts as a regression
+THRESHOLDS = dict(total_time=0.25,
+                  wheelhouse_size=0.1,
+                  dmg_size=0.1)
+
+# Number of earlier successful builds to use as baseline
+N_BASELINE = 5
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    mid = n // 2
+    return values[mid] if n % 2 else (values[mid - 1] + values[mid]) / 2.
+
+
+class BuildHistory(object):
+    """ Persistent record of builds in SQLite database
+    """
+
+    def __init__(self, db_fname):
+        """ Initialize build history
+
+        Parameters
+        ----------
+        db_fname : str
+            Filename of SQLite database.  Created if it does not exist.
+        """
+        self.db_fname = db_fname
+        # Builds may run in another thread (see ``events.BuildEvents``)
+        self.conn = sqlite3.connect(db_fname, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def record(self, pkg_name, pkg_version, pyv_mm, start_time,
+               inputs_digest, status, total_time, stage_times, wheels,
+               dmg_size=None, error=None):
+        """ Record build, return build id
+
+        Parameters
+        ----------
+        pkg_name : str
+            Name of package / installer
+        pkg_version : str
+            Version of package / installer
+        pyv_mm : str
+            Python major, minor version without dot, e.g. "34"
+        start_time : float
+            Time at which build started, in seconds since the epoch
+        inputs_digest : str
+            Digest of build inputs
+        status : str
+            "ok" for successful build, "failed" otherwise
+        total_time : float
+            Build time in seconds
+        stage_times : dict
+            Mapping of stage name to time in seconds
+        wheels : sequence
+            Sequence of (filename, size) pairs for wheels in wheelhouse
+        dmg_size : None or int, optional
+            Size of disk image in bytes, if built
+        error : None or str, optional
+            Error message for failed build
+
+        Returns
+        -------
+        build_id : int
+            Identifier for recorded build
+        """
+        wheels = list(wheels)
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO builds (' + ', '.join(BUILD_FIELDS[1:]) + ') '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (pkg_name, pkg_version, pyv_mm, start_time, inputs_digest,
+                 status, error, total_time, json.dumps(stage_times),
+                 sum(size for fname, size in wheels), dmg_size))
+            build_id = cursor.lastrowid
+            self.conn.executemany(
+                'INSERT INTO build_wheels VALUES (?, ?, ?)',
+                [(build_id, fname, size) for fname, size in wheels])
+        return build_id
+
+    def _row2dict(self, row):
+        build = dict(zip(BUILD_FIELDS, row))
+        build['stage_times'] = json.loads(build['stage_times'])
+        return build
+
+    def get(self, build_id):
+        """ Return build record dictionary for `build_id`, with wheels
+
+        Returns None if there is no such build.
+        """
+        with self._lock:
+            rows = list(self.conn.execute(
+                'SELECT ' + ', '.join(BUILD_FIELDS) + ' FROM builds '
+                'WHERE id = ?', (build_id,)))
+            if len(rows) == 0:
+                return None
+            build = self._row2dict(rows[0])
+            build['wheels'] = dict(self.conn.execute(
+                'SELECT filename, size FROM build_wheels WHERE build_id = ?',
+                (build_id,)))
+        return build
+
+    def builds(self, pkg_name, pyv_mm=None, status=None, before_id=None,
+               limit=None):
+        """ Return build records for `pkg_name`, newest first
+
+        Parameters
+        ----------
+        pkg_name : str
+            Name of package / installer
+        pyv_mm : None or str, optional
+            If not None, only return builds for this Python version
+        status : None or str, optional
+            If not None, only return builds with this status
+        before_id : None or int, optional
+            If not None, only return builds recorded before this build id
+        limit : None or int, optional
+            If not None, maximum number of builds to return
+
+        Returns
+        -------
+        builds : list
+            List of build record dictionaries, without wheels
+        """
+        sql = ('SELECT ' + ', '.join(BUILD_FIELDS) + ' FROM builds '
+               'WHERE pkg_name = ?')
+        params = [pkg_name]
+        for field, value, op in (('pyv_mm', pyv_mm, '='),
+                                 ('status', status, '='),
+                                 ('id', before_id, '<')):
+            if not value is None:
+                sql += ' AND {0} {1} ?'.format(field, op)
+                params.append(value)
+        sql += ' ORDER BY id DESC'
+        if not limit is None:
+            sql += ' LIMIT {0:d}'.format(limit)
+        with self._lock:
+            rows = list(self.conn.execute(sql, params))
+        return [self._row2dict(row) for row in rows]
+
+    def estimate(self, pkg_name, pyv_mm, n_baseline=N_BASELINE):
+        """ Estimate build times from recent builds of the same package
+
+        Parameters
+        ----------
+        pkg_name : str
+            Name of package / installer
+        pyv_mm : str
+            Python major, minor version without dot, e.g. "34"
+        n_baseline : int, optional
+            Number of recent successful builds from which to estimate
+
+        Returns
+        -------
+        estimate : None or dict
+            None if there are no successful builds.  Otherwise dictionary
+            with keys ``total_time`` (median build time in seconds),
+            ``stage_times`` (dict of stage name to median time over the
+            builds running that stage) and ``build_ids`` (ids of builds we
+            used).
+        """
+        builds = self.builds(pkg_name, pyv_mm, status='ok',
+                             limit=n_baseline)
+        if len(builds) == 0:
+            return None
+        stages = set(name for b in builds for name in b['stage_times'])
+        return dict(
+            total_time=_median([b['total_time'] for b in builds]),
+            stage_times=dict(
+                (name, _median([b['stage_times'][name] for b in builds
+                                if name in b['stage_times']]))
+                for name in stages),
+            build_ids=[b['id'] for b in builds])
+
+    def compare(self, build_id, thresholds=None, n_baseline=N_BASELINE):
+        """ Compare build `build_id` to earlier builds of same package
+
+        The baseline for each measure is the median over the last
+        `n_baseline` successful builds of the same package and Python
+        version.
+
+        Parameters
+        ----------
+        build_id : int
+            Build to compare
+        thresholds : None or dict, optional
+            Mapping of measure name ("total_time", "wheelhouse_size",
+            "dmg_size") to fractional increase over baseline that counts as
+            regression.  Missing measures use defaults from ``THRESHOLDS``.
+        n_baseline : int, optional
+            Number of earlier successful builds in baseline
+
+        Returns
+        -------
+        comparison : dict
+            Dictionary with keys ``build`` (build record), ``baseline_ids``
+            (ids of baseline builds), ``measures`` (dict of measure name to
+            dict with ``value``, ``baseline``, ``change``, ``regression``),
+            ``regressions`` (list of regressed measure names), and
+            ``added_wheels``, ``removed_wheels`` relative to the most recent
+            baseline build.
+        """
+        all_thresholds = dict(THRESHOLDS)
+        if not thresholds is None:
+            all_thresholds.update(thresholds)
+        build = self.get(build_id)
+        if build is None:
+            raise ValueError('No build with id {0}'.format(build_id))
+        baseline = self.builds(build['pkg_name'], build['pyv_mm'],
+                               status='ok', before_id=build_id,
+                               limit=n_baseline)
+        measures = {}
+        regressions = []
+        for name, threshold in sorted(all_thresholds.items()):
+            value = build[name]
+            values = [b[name] for b in baseline if b[name] is not None]
+            if value is None or len(values) == 0:
+                continue
+            base = _median(values)
+            change = (value - base) / base if base else 0.
+            regressed = change > threshold
+            measures[name] = dict(value=value, baseline=base, change=change,
+                                  regression=regressed)
+            if regressed:
+                regressions.append(name)
+        added, removed = [], []
+        if baseline:
+            last_wheels = self.get(baseline[0]['id'])['wheels']
+            added = sorted(set(build['wheels']) - set(last_wheels))
+            removed = sorted(set(last_wheels) - set(build['wheels']))
+        return dict(build=build,
+                    baseline_ids=[b['id'] for b in baseline],
+                    measures=measures,
+                    regressions=regressions,
+                    added_wheels=added,
+                    removed_wheels=removed)
@@ -0,0 +1,81 @@
+""" wheels2dmg-history command module
+"""
+from __future__ import division, print_function
+
+import sys
+import json
+from argparse import ArgumentParser
+
+from .history import BuildHistory, THRESHOLDS, N_BASELINE
+
+
+def get_parser():
+    parser = ArgumentParser(
+        description="List builds from build history, and check most recent "
+        "or given build for regressions against earlier builds",
+        epilog="Exit code is 1 if the checked build has regressions")
+    parser.add_argument('db_fname', type=str,
+                        help='build history database filename')
+    parser.add_argument('pkg_name', type=str, help='root name of installer')
+    parser.add_argument('--python-version', type=str,
+                        help='Python version of builds to check, in '
+                        'major.minor[.extra] format (default is Python '
+                        'version of most recent build)')
+    parser.add_argument('--build-id', type=int,
+                        help='build to check (default most recent)')
+    parser.add_argument('--list', action='store_true',
+                        help='list builds instead of checking')
+    parser.add_argument('--n-baseline', type=int, default=N_BASELINE,
+                        help='number of earlier successful builds to compare '
+                        'against (default %(default)s)')
+    for name, default in sorted(THRESHOLDS.items()):
+        parser.add_argument('--{0}-threshold'.format(name.replace('_', '-')),
+                            type=float, default=default, dest=name,
+                            help='fractional increase in {0} over baseline '
+                            'that counts as regression (default '
+                            '%(default)s)'.format(name.replace('_', ' ')))
+    parser.add_argument('--json', action='store_true',
+                        help='print output as JSON')
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    pyv_mm = (None if args.python_version is None else
+              args.python_version.replace('.', '')[:2])
+    history = BuildHistory(args.db_fname)
+    builds = history.builds(args.pkg_name, pyv_mm)
+    if args.list:
+        history.close()
+        if args.json:
+            print(json.dumps(builds, indent=2, sort_keys=True))
+            return
+        for build in builds:
+            print('{id} {pkg_version} py{pyv_mm} {status} '
+                  'time={total_time:.1f}s wheelhouse={wheelhouse_size} '
+                  'dmg={dmg_size}'.format(**build))
+        return
+    if args.build_id is None:
+        if len(builds) == 0:
+            sys.exit('No builds for {0}'.format(args.pkg_name))
+        args.build_id = builds[0]['id']
+    thresholds = dict((name, getattr(args, name)) for name in THRESHOLDS)
+    comparison = history.compare(args.build_id, thresholds, args.n_baseline)
+    history.close()
+    if args.json:
+        print(json.dumps(comparison, indent=2, sort_keys=True))
+    else:
+        print('Build {0} against builds {1}'.format(
+            args.build_id, comparison['baseline_ids']))
+        for name, measure in sorted(comparison['measures'].items()):
+            print('{0}: {1} (baseline {2}, {3:+.1%}){4}'.format(
+                name, measure['value'], measure['baseline'],
+                measure['change'],
+                ' REGRESSION' if measure['regression'] else ''))
+        for wheel in comparison['added_wheels']:
+            print('Added wheel: ' + wheel)
+        for wheel in comparison['removed_wheels']:
+            print('Removed wheel: ' + wheel)
+    if comparison['regressions']:
+        sys.exit(1)
@@ -0,0 +1,425 @@
+""" Read and thin Mach-O fat (universal) binaries in pure Python
+
+A fat binary starts with a big-endian header giving the number of
+architecture slices, followed by one record per slice giving the CPU type and
+the offset and size of the slice in the file.  Each slice is a complete
+single-architecture ("thin") Mach-O binary.
+
+We can also read and change the library install names in the load commands
+of thin and fat binaries, so we can do this on systems without
+``install_name_tool``.
+"""
+from __future__ import division, print_function
+
+import os
+import struct
+
+FAT_MAGIC = 0xcafebabe
+FAT_MAGIC_64 = 0xcafebabf
+
+FAT_HEADER = struct.Struct('>II')
+FAT_ARCH = struct.Struct('>iiIII')
+FAT_ARCH_64 = struct.Struct('>iiQQII')
+
+# Java class files share the fat magic number; their version field would give
+# a slice count of at least 45
+MAX_FAT_ARCHS = 44
+
+CPU_ARCH_ABI64 = 0x01000000
+CPU_TYPES = {
+    7: 'i386',
+    7 | CPU_ARCH_ABI64: 'x86_64',
+    12: 'arm',
+    12 | CPU_ARCH_ABI64: 'arm64',
+    18: 'ppc',
+    18 | CPU_ARCH_ABI64: 'ppc64',
+}
+
+# Architectures for macosx platform tag suffixes
+PLAT_ARCHS = {
+    'i386': frozenset(['i386']),
+    'x86_64': frozenset(['x86_64']),
+    'ppc': frozenset(['ppc']),
+    'ppc64': frozenset(['ppc64']),
+    'arm64': frozenset(['arm64']),
+    'intel': frozenset(['i386', 'x86_64']),
+    'fat': frozenset(['i386', 'ppc']),
+    'fat3': frozenset(['i386', 'x86_64', 'ppc']),
+    'fat64': frozenset(['x86_64', 'ppc64']),
+    'universal': frozenset(['i386', 'x86_64', 'ppc', 'ppc64']),
+    'universal2': frozenset(['x86_64', 'arm64']),
+}
+
+# Copy slices in chunks of this many bytes
+COPY_BLOCKSIZE = 2 ** 20
+
+
+class MachOError(Exception):
+    """ Error for invalid Mach-O files or thinning requests """
+
+
+class FatArch(object):
+    """ Record for one architecture slice in a fat binary """
+
+    def __init__(self, cputype, cpusubtype, offset, size, align):
+        self.cputype = cputype
+        self.cpusubtype = cpusubtype
+        self.offset = offset
+        self.size = size
+        self.align = align
+
+    @property
+    def name(self):
+        """ Architecture name, e.g. "x86_64" """
+        return CPU_TYPES.get(self.cputype, 'cpu{0}'.format(self.cputype))
+
+
+def read_fat_archs(fobj):
+    """ Return list of :class:`FatArch` for fat binary in `fobj`, or None
+
+    Parameters
+    ----------
+    fobj : file-like
+        File object open for binary reading, positioned at start of file
+
+    Returns
+    -------
+    fat_archs : None or list
+        None if `fobj` is not a fat binary, otherwise list of
+        :class:`FatArch` instances, one per slice
+    """
+    header = fobj.read(FAT_HEADER.size)
+    if len(header) < FAT_HEADER.size:
+        return None
+    magic, n_archs = FAT_HEADER.unpack(header)
+    if not magic in (FAT_MAGIC, FAT_MAGIC_64) or n_archs > MAX_FAT_ARCHS:
+        return None
+    arch_struct = FAT_ARCH if magic == FAT_MAGIC else FAT_ARCH_64
+    fat_archs = []
+    for i in range(n_archs):
+        record = fobj.read(arch_struct.size)
+        if len(record) < arch_struct.size:
+            raise MachOError('Truncated fat header')
+        fat_archs.append(FatArch(*arch_struct.unpack(record)[:5]))
+    return fat_archs
+
+
+def get_archs(fname):
+    """ Return set of architecture names in fat binary `fname`, or None
+
+    Returns None if `fname` is not a fat binary.
+    """
+    with open(fname, 'rb') as fobj:
+        fat_archs = read_fat_archs(fobj)
+    return None if fat_archs is None else set(a.name for a in fat_archs)
+
+
+def _copy_range(in_fobj, out_fobj, offset, size):
+    in_fobj.seek(offset)
+    while size > 0:
+        block = in_fobj.read(min(size, COPY_BLOCKSIZE))
+        if not block:
+            raise MachOError('Slice extends past end of file')
+        out_fobj.write(block)
+        size -= len(block)
+
+
+def thin_fat(in_fname, out_fname, keep_archs):
+    """ Write fat binary `in_fname` to `out_fname` with only `keep_archs`
+
+    If only one architecture remains, write a thin binary.
+
+    Parameters
+    ----------
+    in_fname : str
+        Filename of fat binary
+    out_fname : str
+        Filename to write.  Can be the same as `in_fname`, to thin in place.
+    keep_archs : sequence
+        Names of architectures to keep, e.g. ``['x86_64']``
+
+    Returns
+    -------
+    removed : set
+        Names of architectures removed.  Empty if `in_fname` is not a fat
+        binary, or has no architectures outside `keep_archs`; we don't write
+        `out_fname` in that case.
+
+    Raises
+    ------
+    MachOError
+        If `in_fname` has none of the architectures in `keep_archs`
+    """
+    keep_archs = set(keep_archs)
+    with open(in_fname, 'rb') as in_fobj:
+        fat_archs = read_fat_archs(in_fobj)
+        if fat_archs is None:
+            return set()
+        kept = [a for a in fat_archs if a.name in keep_archs]
+        removed = set(a.name for a in fat_archs) - keep_archs
+        if len(removed) == 0:
+            return removed
+        if len(kept) == 0:
+            raise MachOError('{0} has none of architectures {1}'.format(
+                in_fname, ', '.join(sorted(keep_archs))))
+        tmp_fname = out_fname + '.thinning'
+        with open(tmp_fname, 'wb') as out_fobj:
+            if len(kept) == 1:
+                _copy_range(in_fobj, out_fobj, kept[0].offset, kept[0].size)
+            else:
+                _write_fat(in_fobj, out_fobj, kept)
+    os.rename(tmp_fname, out_fname)
+    return removed
+
+
+def _write_fat(in_fobj, out_fobj, fat_archs):
+    """ Write fat binary with slices `fat_archs` from `in_fobj` """
+    need_64 = False
+    offset = FAT_HEADER.size + FAT_ARCH.size * len(fat_archs)
+    new_offsets = []
+    for fat_arch in fat_archs:
+        alignment = 2 ** fat_arch.align
+        offset = (offset + alignment - 1) // alignment * alignment
+        new_offsets.append(offset)
+        offset += fat_arch.size
+        need_64 = need_64 or offset > 0xffffffff
+    if need_64:
+        raise MachOError('Thinned binary too large for 32-bit fat header')
+    out_fobj.write(FAT_HEADER.pack(FAT_MAGIC, len(fat_archs)))
+    for fat_arch, new_offset in zip(fat_archs, new_offsets):
+        out_fobj.write(FAT_ARCH.pack(fat_arch.cputype, fat_arch.cpusubtype,
+                                     new_offset, fat_arch.size,
+                                     fat_arch.align))
+    for fat_arch, new_offset in zip(fat_archs, new_offsets):
+        out_fobj.write(b'\0' * (new_offset - out_fobj.tell()))
+        _copy_range(in_fobj, out_fobj, fat_arch.offset, fat_arch.size)
+
+
+def thin_platform_tag(platform_tag, keep_archs):
+    """ Return macosx `platform_tag` for binaries thinned to `keep_archs`
+
+    Parameters
+    ----------
+    platform_tag : str
+        Wheel platform tag, e.g. ``macosx_10_6_intel``
+    keep_archs : sequence
+        Names of architectures to keep
+
+    Returns
+    -------
+    new_tag : None or str
+        Platform tag for remaining architectures, e.g. ``macosx_10_6_x86_64``.
+        `platform_tag` if it is not a macosx tag, or the remaining
+        architectures have no tag.  None if no architectures remain.
+    """
+    parts = platform_tag.split('_')
+    suffix = '_'.join(parts[3:])
+    if parts[0] != 'macosx' or not suffix in PLAT_ARCHS:
+        return platform_tag
+    remaining = PLAT_ARCHS[suffix] & set(keep_archs)
+    if len(remaining) == 0:
+        return None
+    for name, archs in PLAT_ARCHS.items():
+        if archs == remaining:
+            return '_'.join(parts[:3] + [name])
+    return platform_tag
+
+
+# Thin Mach-O header magic numbers, as read in little-endian byte order
+MH_MAGICS = {0xfeedface: ('<', 28), 0xcefaedfe: ('>', 28),
+             0xfeedfacf: ('<', 32), 0xcffaedfe: ('>', 32)}
+
+# Load commands naming libraries; see ``mach-o/loader.h``
+LC_REQ_DYLD = 0x80000000
+LC_SEGMENT = 0x1
+LC_SEGMENT_64 = 0x19
+LC_ID_DYLIB = 0xd
+LC_DEP_DYLIBS = (0xc, # LC_LOAD_DYLIB
+                 0x18 | LC_REQ_DYLD, # LC_LOAD_WEAK_DYLIB
+                 0x1f | LC_REQ_DYLD, # LC_REEXPORT_DYLIB
+                 0x20, # LC_LAZY_LOAD_DYLIB
+                 0x23 | LC_REQ_DYLD) # LC_LOAD_UPWARD_DYLIB
+
+
+def _slice_offsets(fobj):
+    """ Return offsets of thin Mach-O binaries in `fobj`, or None """
+    fat_archs = read_fat_archs(fobj)
+    if not fat_archs is None:
+        return [fat_arch.offset for fat_arch in fat_archs]
+    fobj.seek(0)
+    magic = fobj.read(4)
+    if len(magic) == 4 and struct.unpack('<I', magic)[0] in MH_MAGICS:
+        return [0]
+    return None
+
+
+def _read_commands(fobj, offset):
+    """ Return header and load commands for thin binary at `offset` in `fobj`
+
+    Returns
+    -------
+    endian : str
+        "<" for little-endian, ">" for big-endian binary
+    header : bytes
+        Mach-O header
+    commands : list
+        List of (cmd, command bytes) tuples, one per load command
+    """
+    fobj.seek(offset)
+    magic = struct.unpack('<I', fobj.read(4))[0]
+    endian, header_size = MH_MAGICS[magic]
+    header = struct.pack('<I', magic) + fobj.read(header_size - 4)
+    if len(header) < header_size:
+        raise MachOError('Truncated Mach-O header')
+    ncmds, sizeofcmds = struct.unpack(endian + 'II', header[16:24])
+    cmds = fobj.read(sizeofcmds)
+    if len(cmds) < sizeofcmds:
+        raise MachOError('Truncated load commands')
+    commands = []
+    pos = 0
+    for i in range(ncmds):
+        cmd, cmdsize = struct.unpack(endian + 'II', cmds[pos:pos + 8])
+        if cmdsize < 8 or pos + cmdsize > sizeofcmds:
+            raise MachOError('Invalid load command size')
+        commands.append((cmd, cmds[pos:pos + cmdsize]))
+        pos += cmdsize
+    return endian, header, commands
+
+
+def _dylib_name(endian, command):
+    """ Return library name from library load `command` """
+    name_off = struct.unpack(endian + 'I', command[8:12])[0]
+    return command[name_off:].split(b'\0')[0].decode('utf-8')
+
+
+def _set_dylib_name(endian, command, name, align):
+    """ Return library load `command` with new `name`, padded to `align` """
+    name_off = struct.unpack(endian + 'I', command[8:12])[0]
+    encoded = name.encode('utf-8')
+    cmdsize = (name_off + len(encoded) + align) // align * align
+    return (command[:4] + struct.pack(endian + 'I', cmdsize) +
+            command[8:name_off] + encoded +
+            b'\0' * (cmdsize - name_off - len(encoded)))
+
+
+def _first_section_offset(endian, commands):
+    """ Return file offset of first section, or None if no sections
+
+    The space between the end of the load commands and the first section is
+    padding, into which the load commands can grow.
+    """
+    offsets = []
+    for cmd, command in commands:
+        if cmd == LC_SEGMENT:
+            sect_size, sect_fmt, pos = 68, 'I', 56
+        elif cmd == LC_SEGMENT_64:
+            sect_size, sect_fmt, pos = 80, 'Q', 72
+        else:
+            continue
+        nsects = struct.unpack(endian + 'I', command[pos - 8:pos - 4])[0]
+        for i in range(nsects):
+            # Skip section and segment names, address and size
+            off_pos = pos + 32 + 2 * struct.calcsize(sect_fmt)
+            sect_offset = struct.unpack(endian + 'I',
+                                        command[off_pos:off_pos + 4])[0]
+            if sect_offset != 0: # Zero-fill sections have no file contents
+                offsets.append(sect_offset)
+            pos += sect_size
+    return min(offsets) if offsets else None
+
+
+def get_install_names(fname):
+    """ Return install id and library dependencies of Mach-O file `fname`
+
+    For fat binaries, return the values for the first architecture.
+
+    Returns
+    -------
+    install_id : None or str
+        Install name of library, or None if `fname` is not a library
+    depends : None or list
+        Install names of libraries that `fname` depends on, or None if
+        `fname` is not a Mach-O file
+    """
+    with open(fname, 'rb') as fobj:
+        offsets = _slice_offsets(fobj)
+        if offsets is None:
+            return None, None
+        endian, header, commands = _read_commands(fobj, offsets[0])
+    install_id = None
+    depends = []
+    for cmd, command in commands:
+        if cmd == LC_ID_DYLIB:
+            install_id = _dylib_name(endian, command)
+        elif cmd in LC_DEP_DYLIBS:
+            depends.append(_dylib_name(endian, command))
+    return install_id, depends
+
+
+def set_install_names(fname, changes, install_id=None, dry_run=False):
+    """ Change library install names in Mach-O file `fname` in-place
+
+    Load commands with longer names can grow into the padding between the
+    load commands and the first section, as for ``install_name_tool``.
+    Changing load commands invalidates code signatures; binaries that must be
+    signed (such as arm64 binaries) need signing again afterwards.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of thin or fat Mach-O file
+    changes : dict
+        Mapping of old to new install name for library dependencies
+    install_id : None or str, optional
+        If not None, new install id for library
+    dry_run : bool, optional
+        If True, check the new names fit, but do not change the file
+
+    Raises
+    ------
+    MachOError
+        If `fname` is not a Mach-O file, or the new load commands do not fit
+        in the header padding.  We check all architectures before changing
+        the file.
+    """
+    with open(fname, 'r+b') as fobj:
+        offsets = _slice_offsets(fobj)
+        if offsets is None:
+            raise MachOError('{0} is not a Mach-O file'.format(fname))
+        writes = []
+        for offset in offsets:
+            endian, header, commands = _read_commands(fobj, offset)
+            align = 8 if len(header) == 32 else 4
+            new_commands = []
+            for cmd, command in commands:
+                if cmd == LC_ID_DYLIB:
+                    new_name = install_id
+                elif cmd in LC_DEP_DYLIBS:
+                    new_name = changes.get(_dylib_name(endian, command))
+                else:
+                    new_name = None
+                if (not new_name is None and
+                    new_name != _dylib_name(endian, command)):
+                    command = _set_dylib_name(endian, command, new_name,
+                                              align)
+                new_commands.append(command)
+            old_size = sum(len(command) for cmd, command in commands)
+            new_size = sum(len(command) for command in new_commands)
+            if new_commands == [command for cmd, command in commands]:
+                continue
+            limit = _first_section_offset(endian, commands)
+            if limit is None:
+                limit = len(header) + old_size
+            if len(header) + new_size > limit:
+                raise MachOError(
+                    'No room for new install names in {0}'.format(fname))
+            new_header = (header[:20] + struct.pack(endian + 'I', new_size) +
+                          header[24:])
+            writes.append((offset,
+                           new_header + b''.join(new_commands) +
+                           b'\0' * max(old_size - new_size, 0)))
+        if dry_run:
+            return
+        for offset, contents in writes:
+            fobj.seek(offset)
+            fobj.write(contents)
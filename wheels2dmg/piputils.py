@@ -2,10 +2,359 @@
 """
 from __future__ import division, print_function
 
+import re
+import platform
+from os.path import dirname, join as pjoin, isabs, abspath, exists
 from argparse import ArgumentParser
+from collections import OrderedDict
 
-from pip.req import InstallRequirement, RequirementSet, parse_requirements
-from pip.download import PipSession
+try:
+    from urllib2 import urlopen # Python 2
+    from urlparse import urlparse, urljoin
+except ImportError:
+    from urllib.request import urlopen # Python 3
+    from urllib.parse import urlparse, urljoin
+
+from packaging.markers import Marker, InvalidMarker, UndefinedEnvironmentName
+
+# Requirement name, extras, version specifiers, environment marker
+REQ_LINE_RE = re.compile(
+    r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*'
+    r'(\[(?P<extras>[^\]]*)\])?\s*'
+    r'(?P<specs>\(?[^;@()]*\)?)\s*'
+    r'(@\s*(?P<url>[^;\s]+)\s*)?'
+    r'(;\s*(?P<marker>.*))?$')
+
+SPEC_RE = re.compile(r'^(===|==|!=|<=|>=|~=|<|>)\s*([A-Za-z0-9_.*+!-]+)$')
+
+URL_RE = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://')
+
+EGG_FRAGMENT_RE = re.compile(r'#egg=([A-Za-z0-9._-]+)')
+
+# Requirement file options, with (short) alternative, that take an argument
+ARG_OPTIONS = {
+    '-r': 'requirement', '--requirement': 'requirement',
+    '-f': 'find_links', '--find-links': 'find_links',
+    '-i': 'index_url', '--index-url': 'index_url',
+    '--extra-index-url': 'extra_index_url',
+    '-e': 'editable', '--editable': 'editable',
+    '-c': 'constraint', '--constraint': 'constraint',
+}
+
+
+class InstallationError(Exception):
+    """ Error for invalid, unreadable or duplicate requirements """
+
+
+def marker_environment(py_version=None, machine='x86_64'):
+    """ Return environment marker variables for Python.org Python on OSX
+
+    Parameters
+    ----------
+    py_version : None or str, optional
+        Full Python version, e.g. "3.4.1".  None means the version of the
+        running Python.
+    machine : str, optional
+        Machine architecture, as from ``platform.machine()``
+
+    Returns
+    -------
+    environment : dict
+        Mapping of marker variable name to value (see PEP 508)
+    """
+    if py_version is None:
+        py_version = platform.python_version()
+    return dict(os_name='posix',
+                sys_platform='darwin',
+                platform_system='Darwin',
+                platform_machine=machine,
+                platform_python_implementation='CPython',
+                implementation_name='cpython',
+                implementation_version=py_version,
+                python_version='.'.join(py_version.split('.')[:2]),
+                python_full_version=py_version)
+
+
+def canonical_name(name):
+    """ Return normalized distribution name for comparisons """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parse_specs(spec_str):
+    """ Parse comma-separated version specifiers into (op, version) pairs
+
+    Parameters
+    ----------
+    spec_str : str
+        Version specifiers, e.g. ``>=1.2,<1.3``
+
+    Returns
+    -------
+    specs : list
+        List of (operator, version) pairs, e.g. ``[('>=', '1.2'), ('<',
+        '1.3')]``
+
+    Raises
+    ------
+    InstallationError
+        If `spec_str` contains an invalid specifier
+    """
+    specs = []
+    for spec in spec_str.split(','):
+        spec = spec.strip()
+        if spec == '':
+            continue
+        match = SPEC_RE.match(spec)
+        if match is None:
+            raise InstallationError(
+                'Invalid version specifier "{0}"'.format(spec))
+        specs.append(match.groups())
+    return specs
+
+
+class Requirement(object):
+    """ A single requirement, as from a requirement specifier or file line
+    """
+
+    def __init__(self, name, extras=(), specs=(), marker=None, url=None,
+                 comes_from=None):
+        """ Initialize requirement
+
+        Parameters
+        ----------
+        name : str
+            Distribution name
+        extras : sequence, optional
+            Names of extras
+        specs : sequence, optional
+            Sequence of (operator, version) pairs
+        marker : None or str, optional
+            Environment marker
+        url : None or str, optional
+            URL or path for requirement, if given as URL
+        comes_from : None or str, optional
+            Description of where requirement came from, for error messages
+        """
+        self.name = name
+        self.extras = list(extras)
+        self.specs = list(specs)
+        self.marker = marker
+        self.url = url
+        self.comes_from = comes_from
+
+    def applies(self, environment=None):
+        """ True if requirement marker matches `environment`
+
+        Parameters
+        ----------
+        environment : None or dict, optional
+            Marker variables for the target environment.  None means the
+            result of :func:`marker_environment` for the running Python
+            version.
+
+        Returns
+        -------
+        tf : bool
+            True if the requirement has no marker, or the marker matches
+        """
+        if self.marker is None:
+            return True
+        if environment is None:
+            environment = marker_environment()
+        try:
+            return Marker(self.marker).evaluate(dict(environment, extra=''))
+        except UndefinedEnvironmentName as err:
+            raise InstallationError('Cannot evaluate marker "{0}": {1}'.format(
+                self.marker, err))
+
+    @classmethod
+    def from_line(cls, line, comes_from=None):
+        """ Make requirement from requirement specifier `line`
+
+        Parameters
+        ----------
+        line : str
+            Requirement specifier, e.g. ``ipython[notebook]>=1.0``, or URL
+            with ``#egg=name`` fragment
+        comes_from : None or str, optional
+            Description of where `line` came from, for error messages
+
+        Returns
+        -------
+        req : :class:`Requirement` instance
+
+        Raises
+        ------
+        InstallationError
+            If `line` is not a valid requirement
+        """
+        line = line.strip()
+        if URL_RE.match(line) or line.startswith(('.', '/')):
+            egg_match = EGG_FRAGMENT_RE.search(line)
+            if egg_match is None:
+                raise InstallationError(
+                    'Need #egg=name for requirement "{0}"'.format(line))
+            return cls(egg_match.group(1), url=line, comes_from=comes_from)
+        match = REQ_LINE_RE.match(line)
+        if match is None:
+            raise InstallationError(
+                'Invalid requirement "{0}"{1}'.format(
+                    line, '' if comes_from is None else
+                    ' (from {0})'.format(comes_from)))
+        extras = match.group('extras')
+        extras = ([] if extras is None else
+                  [e.strip() for e in extras.split(',') if e.strip()])
+        marker = match.group('marker')
+        if not marker is None:
+            try:
+                Marker(marker)
+            except InvalidMarker as err:
+                raise InstallationError(
+                    'Invalid marker in "{0}": {1}'.format(line, err))
+        return cls(match.group('name'),
+                   extras,
+                   parse_specs(match.group('specs').strip('()')),
+                   marker,
+                   match.group('url'),
+                   comes_from)
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r}, {3!r})'.format(
+            self.__class__.__name__, self.name, self.extras, self.specs)
+
+
+class RequirementSet(object):
+    """ Ordered set of requirements, with index options from requirement files
+    """
+
+    def __init__(self):
+        self.requirements = OrderedDict()
+        self.find_links = []
+        self.index_url = None
+        self.extra_index_urls = []
+        self.no_index = False
+
+    def add_requirement(self, req):
+        """ Add requirement `req`, raise InstallationError for duplicates
+        """
+        key = canonical_name(req.name)
+        if key in self.requirements:
+            raise InstallationError(
+                'Double requirement given: {0} (already in {1})'.format(
+                    req.name, self.requirements[key].name))
+        self.requirements[key] = req
+
+
+def _read_source(source):
+    """ Return text contents of file or URL `source` """
+    if urlparse(source).scheme in ('http', 'https', 'file', 'ftp'):
+        return urlopen(source).read().decode('utf-8')
+    if not exists(source):
+        raise InstallationError(
+            'Could not open requirements file "{0}"'.format(source))
+    with open(source, 'rt') as fobj:
+        return fobj.read()
+
+
+def _relative_to(path, source):
+    """ Return `path` relative to directory of file or URL `source`
+
+    Leave `path` unchanged if it is absolute, or a URL.
+    """
+    if urlparse(path).scheme != '' or isabs(path):
+        return path
+    if urlparse(source).scheme != '':
+        return urljoin(source, path)
+    return pjoin(dirname(abspath(source)), path)
+
+
+def _logical_lines(text):
+    """ Generate (line number, line) pairs, joining continuations, no comments
+    """
+    parts = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if line.lstrip().startswith('#'):
+            line = ''
+        elif ' #' in line or '\t#' in line:
+            line = re.sub(r'\s+#.*$', '', line)
+        if line.endswith('\\'):
+            parts.append(line[:-1])
+            continue
+        line = ''.join(parts) + line
+        parts = []
+        line = line.strip()
+        if line:
+            yield line_no, line
+    if parts:
+        line = ''.join(parts).strip()
+        if line:
+            yield line_no, line
+
+
+def _split_option(line):
+    """ Split option `line` into option name and argument, or None, None
+    """
+    if '=' in line.split()[0]:
+        opt, arg = line.split('=', 1)
+    else:
+        split = line.split(None, 1)
+        opt, arg = split if len(split) == 2 else (split[0], None)
+    if opt in ARG_OPTIONS:
+        return ARG_OPTIONS[opt], None if arg is None else arg.strip()
+    if opt == '--no-index':
+        return 'no_index', None
+    # Short option with argument attached, e.g. -rfile.txt
+    if opt[:2] in ARG_OPTIONS and len(opt) > 2:
+        return ARG_OPTIONS[opt[:2]], line[2:].strip()
+    return None, None
+
+
+def parse_requirements(source, req_set, _parents=()):
+    """ Parse requirements file or URL `source`, add to `req_set`
+
+    Handles comments, line continuations, ``-r`` includes (relative to the
+    including file), ``-e`` editable URLs, and index options (``-f``, ``-i``,
+    ``--extra-index-url``, ``--no-index``), which we store in `req_set`.  We
+    ignore other options.
+
+    Parameters
+    ----------
+    source : str
+        Filename or URL of requirements file
+    req_set : :class:`RequirementSet` instance
+        Requirement set to which to add requirements and options
+    """
+    if source in _parents:
+        raise InstallationError(
+            'Requirements file "{0}" includes itself'.format(source))
+    parents = _parents + (source,)
+    for line_no, line in _logical_lines(_read_source(source)):
+        comes_from = '{0} (line {1})'.format(source, line_no)
+        if not line.startswith('-'):
+            req_set.add_requirement(Requirement.from_line(line, comes_from))
+            continue
+        opt, arg = _split_option(line)
+        if opt is None:
+            continue
+        if opt == 'no_index':
+            req_set.no_index = True
+            continue
+        if arg is None:
+            raise InstallationError(
+                'Option needs argument at {0}'.format(comes_from))
+        if opt in ('requirement', 'constraint'):
+            if opt == 'requirement':
+                parse_requirements(_relative_to(arg, source), req_set,
+                                   parents)
+        elif opt == 'editable':
+            req_set.add_requirement(Requirement.from_line(
+                _relative_to(arg, source), comes_from))
+        elif opt == 'find_links':
+            req_set.find_links.append(_relative_to(arg, source))
+        elif opt == 'index_url':
+            req_set.index_url = arg
+        elif opt == 'extra_index_url':
+            req_set.extra_index_urls.append(arg)
 
 
 def make_pip_parser(parser = None):
@@ -91,37 +440,41 @@ def get_requirements(req_specs, requirement_files=None):
 
     Returns
     -------
-    requirement_set : RequiremenSet instance
-        Pip requirements set
+    requirement_set : :class:`RequirementSet` instance
+        Requirements set
+
+    Raises
+    ------
+    InstallationError
+        For invalid requirements, and requirements given more than once
     """
     if requirement_files is None:
         requirement_files = []
-    session = PipSession()
-    requirement_set = RequirementSet(
-        build_dir=None,
-        src_dir=None,
-        download_dir=None,
-        session=session,
-    )
+    requirement_set = RequirementSet()
     for name in req_specs:
-        requirement_set.add_requirement(
-            InstallRequirement.from_line(name))
+        requirement_set.add_requirement(Requirement.from_line(name))
     for filename in requirement_files:
-        for req in parse_requirements(filename, session=session):
-            requirement_set.add_requirement(req)
+        parse_requirements(filename, requirement_set)
     return requirement_set
 
 
-def get_req_strings(req_set, extras=True, versions=True):
+def get_req_strings(req_set, extras=True, versions=True, environment=None):
     """ Get requirement strings from a RequirementSet
 
+    Omit requirements with environment markers that do not match
+    `environment`.
+
     Parameters
     ----------
-    req_set : RequirementSet instance
+    req_set : :class:`RequirementSet` instance
     extras : bool, optional
         If True, append extras specifications to requirement name
     versions : bool, optional
         If True, append version specifications to requirement name
+    environment : None or dict, optional
+        Marker variables for the target environment (see
+        :func:`marker_environment`).  None means the result of
+        :func:`marker_environment` for the running Python version.
 
     Returns
     -------
@@ -129,13 +482,13 @@ def get_req_strings(req_set, extras=True, versions=True):
         list of string corresponding to the requirements in `req_set`
     """
     req_strings = []
-    reqs = req_set.requirements
-    for name in reqs.keys():
-        req = reqs[name]
+    for req in req_set.requirements.values():
+        if not req.applies(environment):
+            continue
         req_str = req.name
         if extras and req.extras:
             req_str += '[{0}]'.format(','.join(req.extras))
-        if versions and req.req.specs:
-            req_str += ','.join([''.join(s) for s in req.req.specs])
+        if versions and req.specs:
+            req_str += ','.join([''.join(s) for s in req.specs])
         req_strings.append(req_str)
     return req_strings
@@ -4,9 +4,8 @@ from __future__ import division, print_function
 
 import os
 from os.path import (exists, join as pjoin, abspath, expanduser, dirname,
-                     realpath)
+                     basename, getsize)
 import shutil
-from subprocess import check_call
 try:
     from urllib2 import urlopen # Python 2
     from urlparse import urlparse
@@ -14,21 +13,69 @@ except ImportError:
     from urllib.request import urlopen # Python 3
     from urllib.parse import urlparse
 from tempfile import mkdtemp
+import atexit
 import re
+import time
+import hashlib
+import json
+import zipfile
+import threading
+import platform
+import tarfile
+import sys
+import shlex
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
 from glob import glob
+from collections import OrderedDict
+from contextlib import contextmanager
 from warnings import catch_warnings, simplefilter
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 
-from delocate.delocating import delocate_wheel
-from delocate.wheeltools import add_platforms
+import delocate
 
 from .piputils import (make_pip_parser, recon_pip_args, get_requirements,
-                       get_req_strings)
+                       get_req_strings, canonical_name,
+                       marker_environment)
+from .wheelcache import WheelCache, file_sha256, make_key
+from .runner import CommandRunner
+from .catalog import WheelCatalog, read_top_level
+from .history import BuildHistory
+from .macho import (thin_fat, thin_platform_tag, read_fat_archs,
+                    MachOError)
+from .envpool import BuildEnvPool
+from .planner import SDIST_FNAME_RE, parse_wheel_fname
+from .scheduler import run_builds, sdist_build_depends
+from .ccache import CompilerCache
+from .wheeltools import (unpacked_wheel, copy_member, retag_wheel,
+                         delocate_wheel)
+from .dedup import find_duplicates, duplicate_report, consolidate_libs
+from .verify import verify_wheels
+from .tmpdirs import (TemporaryDirectory, ScratchPool, REAPER, BUILD_PREFIX,
+                      write_owner)
+from .events import (EventEmitter, STAGE_START, STAGE_END, WHEEL_FETCHED,
+                     WHEEL_PROCESSED, BYTES_WRITTEN, BUILD_END)
+from .sizes import size_report, format_size_report, check_budget
+
+# Entries in scratch directories that later builds can reuse
+SCRATCH_KEEP = ('ccache-bin',)
+
+# Scratch directories shared by writers in this process
+SCRATCH_POOL = ScratchPool(keep=SCRATCH_KEEP)
+atexit.register(SCRATCH_POOL.close)
 
 JINJA_LOADER = FileSystemLoader(pjoin(dirname(__file__), 'templates'))
 JINJA_ENV = Environment(loader=JINJA_LOADER, trim_blocks=True)
 
+# Template environments by tuple of search paths, shared between PkgWriters
+_TEMPLATE_ENVS = {}
+_TEMPLATE_ENVS_LOCK = threading.Lock()
+
 # Installed location of Python.org Python
 PY_ORG_BASE='/Library/Frameworks/Python.framework/Versions'
 
@@ -39,6 +86,35 @@ PKG_ID_ROOT = 'com.github.MacPython'
 # Full Python version checker
 PY_VERSION_RE = re.compile(r'\d\.\d\.\d+')
 
+# Architectures that compiled wheels must have, after delocating
+REQUIRE_ARCHS = 'intel'
+# Platform tags to add to compiled wheels
+RETAG_PLATFORMS = ('macosx_10_9_intel', 'macosx_10_9_x86_64',
+                   'macosx_10_10_intel', 'macosx_10_10_x86_64')
+
+# Environment variables that can change wheels built from source
+SOURCE_KEY_ENV = ('MACOSX_DEPLOYMENT_TARGET', 'ARCHFLAGS', 'CC', 'CXX', 'FC',
+                  'CFLAGS', 'CXXFLAGS', 'FFLAGS', 'LDFLAGS', 'CPPFLAGS')
+
+# Zip compression type and level for wheel recompression policies.  "store"
+# leaves compression to the disk image, which can then compress across files;
+# "max-deflate" gives the smallest wheels for loose distribution.
+RECOMPRESS_POLICIES = {
+    'keep': None,
+    'store': (zipfile.ZIP_STORED, None),
+    'max-deflate': (zipfile.ZIP_DEFLATED, 9),
+}
+
+# Handling of libraries copied into more than one wheel (see ``dedup``)
+DEDUP_MODES = ('report', 'consolidate')
+
+# Output formats that ``write_dmg`` can write, and their filename suffixes.
+# "pkg" is the product archive alone, for management tools; "wheelhouse" is
+# an archive of the wheelhouse and README, for manual installs.
+OUTPUT_FORMATS = OrderedDict([('dmg', '.dmg'),
+                              ('pkg', '.pkg'),
+                              ('wheelhouse', '-wheelhouse.tar.gz')])
+
 
 def get_get_pip(get_pip_url, out_dir):
     """ Get ``get-pip.py`` from file or URL `get_pip_url`, write to `out_dir`
@@ -88,7 +164,7 @@ def get_python_path(pyv_m_m):
     return python_path
 
 
-def upgrade_pip(get_pip_path, pyv_m_m, pip_params):
+def upgrade_pip(get_pip_path, pyv_m_m, pip_params, runner=None):
     """ Upgrade pip with ``git-pip.py`` script, install ``wheel``
 
     Installs pip for Python.org Python if not present. Upgrades if necessary.
@@ -102,24 +178,204 @@ def upgrade_pip(get_pip_path, pyv_m_m, pip_params):
         Python version in major.minor format (e.g. "2.7")
     pip_params : sequence
         Parameters to pass to pip when installing
+    runner : None or :class:`CommandRunner` instance, optional
+        Runner with which to run commands.  If None, make a new runner.
 
     Returns
     -------
     pip_exe : str
         Path to ``pip`` executable
     """
+    runner = CommandRunner() if runner is None else runner
     python_path = get_python_path(pyv_m_m)
     # Upgrade pip
-    check_call([python_path, get_pip_path] + pip_params)
+    runner.check_call([python_path, get_pip_path] + pip_params)
     pip_exe = '{0}/{1}/bin/pip{1}'.format(PY_ORG_BASE, pyv_m_m, pyv_m_m)
     if not exists(pip_exe):
         raise RuntimeError('Expected to find pip at {0}, but not so'.format(
             pip_exe))
     # Install wheel
-    check_call([pip_exe, 'install', '--upgrade'] + pip_params + ['wheel'])
+    runner.check_call([pip_exe, 'install', '--upgrade'] + pip_params +
+                      ['wheel'])
     return pip_exe
 
 
+def compile_wheel(wheel_fname, python_path, runner=None, n_jobs=0):
+    """ Add byte-compiled ``.pyc`` files to wheel `wheel_fname` in-place
+
+    Compile with the Python that will import the installed files, using
+    unchecked hash-based ``.pyc`` files (PEP 552), so the compiled files stay
+    valid after pip writes the sources with new modification times.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of wheel to modify
+    python_path : str
+        Path to Python executable with which to compile.  Must be Python 3.7
+        or later.
+    runner : None or :class:`CommandRunner` instance, optional
+        Runner with which to run commands.  If None, make a new runner.
+    n_jobs : int, optional
+        Number of processes with which to compile files.  0 means use the
+        number of CPUs.
+    """
+    runner = CommandRunner() if runner is None else runner
+    with unpacked_wheel(wheel_fname, wheel_fname) as wheel_dir:
+        # Files in ``.data`` directories are installed elsewhere (scripts,
+        # headers), so do not compile these
+        runner.check_call([python_path, '-m', 'compileall', '-q',
+                           '-j', str(n_jobs),
+                           '--invalidation-mode', 'unchecked-hash',
+                           '-x', r'[.]data[/\\]',
+                           '.'],
+                          cwd=wheel_dir)
+
+
+def _unique(seq):
+    """ Return list of unique elements in `seq`, in order of first appearance
+    """
+    out = []
+    for item in seq:
+        if not item in out:
+            out.append(item)
+    return out
+
+
+def _has_fat_to_thin(wheel_fname, archs):
+    """ True if wheel has fat binaries with architectures not in `archs`
+
+    Reads only the start of each member.
+    """
+    archs = set(archs)
+    with zipfile.ZipFile(wheel_fname) as zf:
+        for info in zf.infolist():
+            if info.filename.endswith('/'):
+                continue
+            with zf.open(info) as fobj:
+                fat_archs = read_fat_archs(fobj)
+            if fat_archs is None:
+                continue
+            if set(a.name for a in fat_archs) - archs:
+                return True
+    return False
+
+
+def thin_wheel(wheel_fname, archs):
+    """ Remove architectures other than `archs` from fat binaries in wheel
+
+    Update the wheel platform tags to match, and write the wheel with the new
+    platform tags in its filename, deleting `wheel_fname` if the name
+    changes.  If the platform tags do not change, and there are no fat
+    binaries to thin, leave the wheel as it is.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of wheel
+    archs : sequence
+        Names of architectures to keep, e.g. ``['x86_64']``
+
+    Returns
+    -------
+    out_fname : str
+        Filename of thinned wheel
+    n_removed : int
+        Number of bytes removed from binaries in wheel
+
+    Raises
+    ------
+    MachOError
+        If the wheel platform tags are for none of the architectures in
+        `archs`
+    """
+    wheel_fname = abspath(wheel_fname)
+    parts = basename(wheel_fname)[:-len('.whl')].split('-')
+    platforms = _unique(thin_platform_tag(tag, archs)
+                        for tag in parts[-1].split('.'))
+    platforms = [tag for tag in platforms if not tag is None]
+    if len(platforms) == 0:
+        raise MachOError('{0} has no platform for architectures {1}'.format(
+            wheel_fname, ', '.join(sorted(archs))))
+    if ('.'.join(platforms) == parts[-1] and
+        not _has_fat_to_thin(wheel_fname, archs)):
+        return wheel_fname, 0
+    out_fname = pjoin(dirname(wheel_fname),
+                      '-'.join(parts[:-1] + ['.'.join(platforms)]) + '.whl')
+    n_removed = 0
+    with unpacked_wheel(wheel_fname, out_fname) as wheel_dir:
+        for root, dirs, files in os.walk(wheel_dir):
+            for fname in files:
+                path = pjoin(root, fname)
+                size = getsize(path)
+                if thin_fat(path, path, archs):
+                    n_removed += size - getsize(path)
+        info_wheel = glob(pjoin(wheel_dir, '*.dist-info', 'WHEEL'))[0]
+        with open(info_wheel, 'rt') as fobj:
+            lines = fobj.read().splitlines()
+        out_lines = []
+        for line in lines:
+            if line.startswith('Tag:'):
+                impl, abi, plat = line.split(':', 1)[1].strip().split('-')
+                new_plat = thin_platform_tag(plat, archs)
+                if new_plat is None:
+                    continue
+                line = 'Tag: {0}-{1}-{2}'.format(impl, abi, new_plat)
+            out_lines.append(line)
+        with open(info_wheel, 'wt') as fobj:
+            fobj.write('\n'.join(_unique(out_lines)) + '\n')
+    if out_fname != wheel_fname:
+        os.unlink(wheel_fname)
+    return out_fname, n_removed
+
+
+def recompress_wheel(wheel_fname, policy):
+    """ Rewrite wheel `wheel_fname` in-place with compression `policy`
+
+    Member contents, order, dates and permissions do not change, so the wheel
+    ``RECORD`` stays valid.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of wheel
+    policy : str
+        Key into ``RECOMPRESS_POLICIES``, e.g. "store"
+
+    Returns
+    -------
+    size_before : int
+        Size of wheel file before recompression
+    size_after : int
+        Size of wheel file after recompression
+    """
+    if not policy in RECOMPRESS_POLICIES:
+        raise ValueError('Unknown recompression policy "{0}"'.format(policy))
+    size_before = getsize(wheel_fname)
+    if RECOMPRESS_POLICIES[policy] is None:
+        return size_before, size_before
+    compression, level = RECOMPRESS_POLICIES[policy]
+    tmp_fname = wheel_fname + '.recompress'
+    with zipfile.ZipFile(wheel_fname) as zin:
+        with zipfile.ZipFile(tmp_fname, 'w', compression) as zout:
+            for info in zin.infolist():
+                copy_member(zin, info, zout, compression, level)
+    os.rename(tmp_fname, wheel_fname)
+    return size_before, getsize(wheel_fname)
+
+
+def peak_rss():
+    """ Return peak resident memory of this process in bytes, or None
+
+    None if we cannot get the resident memory on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on OSX, kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
 def _safe_mkdirs(path):
     if not exists(path):
         os.makedirs(path)
@@ -132,6 +388,7 @@ class PkgWriter(object):
     py_org_base = PY_ORG_BASE
     pip_parser = make_pip_parser()
     chatty_names = ('welcome.html', 'readme.html', 'license.html')
+    benchmark_name = 'import-benchmark.py'
 
     def __init__(self,
                  pkg_name,
@@ -144,7 +401,23 @@ class PkgWriter(object):
                  pkg_id_root = None,
                  wheel_sdir = 'wheels',
                  wheel_component_name = 'wheel-installer',
-                 delocate_wheels = True
+                 delocate_wheels = True,
+                 compile_wheels = False,
+                 delocate_cache_dir = None,
+                 command_log = None,
+                 catalog_db = None,
+                 history_db = None,
+                 thin_archs = None,
+                 recompress = 'keep',
+                 template_dirs = None,
+                 build_env_dir = None,
+                 build_jobs = None,
+                 compiler_cache_dir = None,
+                 source_cache_dir = None,
+                 dedup_libs = None,
+                 verify_wheels = True,
+                 size_budget = None,
+                 temp_root = None
                 ):
         """ Initialize PkgWriter class
 
@@ -164,10 +437,13 @@ class PkgWriter(object):
             the canonical pip URL
         dmg_build_dir : None or str, optional
             Directory in which to compile contents of disk image. Created if it
-            does not exist.  If None, use temporary directory.
+            does not exist.  If None, use temporary directory, removed by
+            :meth:`close`.
         scratch_dir : None or str, optional
             Directory in which to write files to construct installer packages.
-            Created if it does not exist.  If None, use temporary directory.
+            Created if it does not exist.  If None, use a scratch directory
+            from the pool for this process, that we return to the pool for
+            later writers in :meth:`close`.
         pkg_id_root : None or str, optional
             Root of 'identifier' used to identify package, in database of
             package receipts (given by ``pkgutil --pkgs``). The installer does
@@ -180,6 +456,78 @@ class PkgWriter(object):
             If True, run ``delocate_wheel`` on all wheels in wheelhouse, to
             detect and maybe fix wheels built as part of the ``pip wheel``
             procedure to compile the wheelhouse.
+        compile_wheels : bool, optional
+            If True, add byte-compiled ``.pyc`` files to the wheels in the
+            wheelhouse, and tell pip not to compile at install time.  Needs
+            Python 3.7 or later.
+        delocate_cache_dir : None or str, optional
+            If not None, directory in which to cache the results of
+            delocating and retagging compiled wheels, so we can reuse these
+            for identical input wheels in later builds.
+        command_log : None or str, optional
+            If not None, filename to which to append a JSON line recording
+            time and resource use for each external command we run.
+        catalog_db : None or str, optional
+            If not None, filename of SQLite wheel catalog (see
+            :class:`WheelCatalog`) to update with the wheels in the
+            wheelhouse, and to use for wheel metadata.
+        history_db : None or str, optional
+            If not None, filename of SQLite build history database (see
+            :class:`BuildHistory`) in which to record each ``write_dmg``
+            build.
+        thin_archs : None or sequence, optional
+            If not None, names of architectures to keep in fat binaries in
+            compiled wheels, e.g. ``['x86_64']``.  We remove other
+            architectures and fix the wheel platform tags to match.
+        recompress : str, optional
+            Zip compression policy for wheels in the wheelhouse, one of
+            "keep" (leave wheels as built), "store" (no compression, so the
+            compressed disk image can compress across wheels) or
+            "max-deflate" (maximum deflate compression, for distributing the
+            wheels outside the disk image).
+        template_dirs : None or sequence, optional
+            Directories to search for templates for installer files, before
+            the template search path in effect when creating this object (see
+            :func:`insert_template_path`).  Writers with different template
+            directories can run at the same time in different threads.
+        build_env_dir : None or str, optional
+            If not None, directory for pool of build virtualenvs (see
+            :class:`BuildEnvPool`).  We build wheels in a virtualenv leased
+            from the pool, instead of installing pip and wheel into the
+            Python.org Python.  Needs Python >= 3.4.
+        build_jobs : None or int, optional
+            If not None, build wheels from source in parallel, using up to
+            this many CPUs.  We download wheels and sdists first, then build
+            the sdists in parallel, each in its own ``pip wheel`` process,
+            after the packages they need at build time (see
+            :func:`scheduler.build_order`).  None means build wheels with a
+            single ``pip wheel`` command.
+        compiler_cache_dir : None or str, optional
+            If not None, directory for ``ccache`` compiler caches (see
+            :class:`CompilerCache`).  Builds from source then compile via
+            ``ccache``, with a cache for each Python version and architecture.
+        source_cache_dir : None or str, optional
+            If not None, directory in which to cache wheels built from source
+            between builds, keyed by sdist hash, Python version, compiler and
+            build environment (see :meth:`source_key`).  With a source cache,
+            we download wheels and sdists and build the sdists as for
+            `build_jobs`.
+        dedup_libs : None or str, optional
+            If not None, how to handle copies of the same library bundled
+            into more than one wheel; "report" reports the duplicated bytes,
+            "consolidate" also moves the libraries into a support wheel that
+            the other wheels depend on (see :func:`consolidate_libs`).
+        verify_wheels : bool, optional
+            If True, check the zip CRCs and ``RECORD`` hashes and sizes of
+            all wheels before writing the installer, and fail if any wheel
+            is corrupt.
+        size_budget : None or int, optional
+            If not None, maximum bytes for the disk image contents (before
+            disk image compression).  We raise :class:`SizeBudgetError` after
+            writing the size report, if the contents are larger.
+        temp_root : None or str, optional
+            Directory in which to make temporary directories.  None means the
+            default directory for temporary files.
 
         Notes
         -----
@@ -202,19 +550,58 @@ class PkgWriter(object):
         self.full_py_version = full_py_version
         self.pip_params = pip_params
         self.get_pip_url = GET_PIP_URL if get_pip_url is None else get_pip_url
+        self.temp_root = temp_root
         self.dmg_build_dir = self._working_dir(dmg_build_dir)
-        self.scratch_dir = self._working_dir(scratch_dir)
+        self.scratch_dir = self._working_dir(scratch_dir, scratch=True)
         self.pkg_id_root = PKG_ID_ROOT if pkg_id_root is None else pkg_id_root
         self.wheel_sdir = wheel_sdir
         self.wheel_component_name = wheel_component_name
         self.delocate_wheels = delocate_wheels
+        if compile_wheels and self.pyv_tuple < (3, 7):
+            raise ValueError('Need Python >= 3.7 to byte-compile wheels')
+        self.compile_wheels = compile_wheels
+        self.delocate_cache = (None if delocate_cache_dir is None
+                               else WheelCache(delocate_cache_dir))
+        self.runner = CommandRunner(command_log, events=self.events)
+        self.catalog = (None if catalog_db is None
+                        else WheelCatalog(catalog_db))
+        self.history = (None if history_db is None
+                        else BuildHistory(history_db))
+        self.thin_archs = thin_archs
+        if not recompress in RECOMPRESS_POLICIES:
+            raise ValueError('recompress should be one of ' +
+                             ', '.join(sorted(RECOMPRESS_POLICIES)))
+        self.recompress = recompress
+        self.template_path = (tuple(template_dirs or ()) +
+                              tuple(JINJA_LOADER.searchpath))
+        if not build_env_dir is None and self.pyv_tuple < (3, 4):
+            raise ValueError('Need Python >= 3.4 for build environments')
+        self.env_pool = (None if build_env_dir is None
+                         else BuildEnvPool(build_env_dir, self.runner))
+        self.build_jobs = build_jobs
+        self.compiler_cache = (None if compiler_cache_dir is None
+                               else CompilerCache(compiler_cache_dir))
+        self.source_cache = (None if source_cache_dir is None
+                             else WheelCache(source_cache_dir))
+        if not dedup_libs is None and not dedup_libs in DEDUP_MODES:
+            raise ValueError('dedup_libs should be None or one of ' +
+                             ', '.join(DEDUP_MODES))
+        self.dedup_libs = dedup_libs
+        self.verify_wheels = verify_wheels
+        self.size_budget = size_budget
 
     def do_init(self):
         """ Extra initialization for object
         """
-        self._to_delete = []
-
-    def _working_dir(self, work_dir):
+        self._temp_dirs = []
+        self._scratch = None
+        self._wheel_hashes = {}
+        self.build_report = {}
+        self.stage_times = OrderedDict()
+        self.outputs = OrderedDict()
+        self.events = EventEmitter()
+
+    def _working_dir(self, work_dir, scratch=False):
         """ Make working directory `work_dir`, return absolute path
 
         Parameters
@@ -223,22 +610,53 @@ class PkgWriter(object):
             If str, directory to create if it doesn't exist. If None, make a
             temporary directory and return that, noting that we have to delete
             when we've finished.
+        scratch : bool, optional
+            If True, and `work_dir` is None, use a scratch directory from
+            ``SCRATCH_POOL``.
 
         Returns
         -------
         abs_work_dir : str
             Absolute path to working directory
         """
-        if work_dir is None:
-            work_dir  = mkdtemp()
-            self._to_delete.append(work_dir)
-        else:
-            _safe_mkdirs(work_dir)
-        return abspath(work_dir)
+        if not work_dir is None:
+            return abspath(_safe_mkdirs(work_dir))
+        if scratch:
+            self._scratch = SCRATCH_POOL.acquire(self.temp_root)
+            return abspath(self._scratch.name)
+        # Owner file for orphan cleanup goes outside the disk image contents
+        tmp_dir = TemporaryDirectory(prefix=BUILD_PREFIX + 'build-',
+                                     dir=self.temp_root, reaper=REAPER)
+        self._temp_dirs.append(tmp_dir)
+        write_owner(tmp_dir.name)
+        return abspath(_safe_mkdirs(pjoin(tmp_dir.name, 'dmg')))
+
+    def close(self):
+        """ Remove temporary directories, return scratch directory to pool
+
+        We rename the temporary directories, and delete them in a background
+        thread.  Safe to call more than once.
+        """
+        temp_dirs, self._temp_dirs = self._temp_dirs, []
+        for tmp_dir in temp_dirs:
+            tmp_dir.cleanup()
+        scratch, self._scratch = self._scratch, None
+        if not scratch is None:
+            SCRATCH_POOL.release(scratch, self.temp_root)
 
     def __del__(self):
-        for pth in self._to_delete:
-            shutil.rmtree(pth)
+        # Safety net for writers not closed; ``clean_orphans`` removes
+        # directories from processes that exited without closing
+        if getattr(self, '_temp_dirs', None) or getattr(self, '_scratch',
+                                                        None):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+        return False
 
     # Versions of the python version string
     @property
@@ -261,6 +679,11 @@ class PkgWriter(object):
         """ Major version e.g "3" """
         return self.full_py_version[0]
 
+    @property
+    def pyv_tuple(self):
+        """ Major, minor version as tuple of ints e.g (3, 4) """
+        return tuple(int(v) for v in self.pyv_m_m.split('.'))
+
     @property
     def pkg_name_version(self):
         return '{0}-{1}'.format(self.pkg_name, self.pkg_version)
@@ -281,18 +704,76 @@ class PkgWriter(object):
     def wheel_build_dir(self):
         return pjoin(self.dmg_build_dir, self.wheel_sdir)
 
+    def get_template(self, name):
+        """ Return template `name` from writer template path, or None
+        """
+        try:
+            return template_env(self.template_path).get_template(name)
+        except TemplateNotFound:
+            return None
+
     @property
     def existing_chatty_names(self):
         return tuple(name for name in self.chatty_names
-                     if not get_template(name) is None)
+                     if not self.get_template(name) is None)
 
     @property
     def identifier(self):
         return '{0}.{1}'.format(self.pkg_id_root, self.pkg_name_pyv)
 
+    @contextmanager
+    def stage(self, name):
+        """ Context manager to record time for build stage `name`
+
+        Emit events for the start and end of the stage.  Raise
+        :class:`BuildCancelled` before starting if someone cancelled the
+        build.
+        """
+        self.events.check()
+        self.events.emit(STAGE_START, name=name)
+        start = time.time()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.stage_times[name] = time.time() - start
+            self.events.emit(STAGE_END, name=name,
+                             time=self.stage_times[name], error=error)
+
+    def inputs_digest(self):
+        """ Return hex digest identifying the inputs to the build
+
+        The digest covers the pip parameters, the contents of local
+        requirement files, the Python version and the build options.
+        """
+        sha = hashlib.sha256()
+        args = self.pip_parser.parse_args(self.pip_params)
+        for param in (self.pip_params +
+                      [self.full_py_version, self.get_pip_url,
+                       self.pkg_id_root, self.wheel_sdir,
+                       str(self.delocate_wheels), str(self.compile_wheels),
+                       ','.join(self.thin_archs or []), self.recompress,
+                       self.dedup_libs or '']):
+            sha.update(param.encode('utf-8') + b'\0')
+        for requirement in args.requirement or []:
+            if exists(requirement):
+                with open(requirement, 'rb') as fobj:
+                    sha.update(fobj.read())
+        return sha.hexdigest()
+
+    def wheel_sizes(self):
+        """ Return list of (filename, size) for wheels in wheelhouse """
+        return [(os.path.basename(wheel), os.path.getsize(wheel))
+                for wheel in sorted(glob(pjoin(self.wheel_build_dir,
+                                               '*.whl')))]
+
     def get_requirement_strings(self, extras=True, versions=True):
         """ Return list of requirement strings for requirements in `self`
 
+        Omit requirements with environment markers that do not match the
+        target Python (see :attr:`marker_environment`).
+
         Parameters
         ----------
         extras : bool, optional
@@ -307,43 +788,427 @@ class PkgWriter(object):
         """
         args = self.pip_parser.parse_args(self.pip_params)
         req_set = get_requirements(args.req_specs, args.requirement)
-        return get_req_strings(req_set, extras, versions)
+        return get_req_strings(req_set, extras, versions,
+                               self.marker_environment)
+
+    @property
+    def marker_environment(self):
+        """ Environment marker variables for target Python.org Python
 
-    def get_wheels(self):
+        Use the architecture of this machine, as for builds from source.
+        """
+        return marker_environment(self.full_py_version, self.build_arch)
+
+    def get_wheels(self, req_params=None):
         """ Upgrade pip and get wheels for this install
+
+        Use a leased build environment if we have a build environment pool.
+
+        Parameters
+        ----------
+        req_params : None or sequence, optional
+            pip parameters giving requirements to fetch.  None means fetch
+            all requirements for this install.  If not None, pip also looks
+            for wheels already in the wheelhouse.
         """
         wheelhouse = _safe_mkdirs(self.wheel_build_dir)
+        before = self._wheel_stats()
+        self._get_wheels(wheelhouse, req_params)
+        for wheel, stat in sorted(self._wheel_stats().items()):
+            if before.get(wheel) != stat:
+                self.events.emit(WHEEL_FETCHED,
+                                 filename=basename(wheel),
+                                 size=stat[0])
+
+    def _wheel_stats(self):
+        """ Return dict of (size, mtime) by filename for wheels in wheelhouse
+        """
+        stats = {}
+        for wheel in glob(pjoin(self.wheel_build_dir, '*.whl')):
+            stat = os.stat(wheel)
+            stats[wheel] = (stat.st_size, stat.st_mtime)
+        return stats
+
+    def _get_wheels(self, wheelhouse, req_params):
+        """ Fetch wheels into `wheelhouse`; see :meth:`get_wheels` """
         # Get get-pip.py
         get_pip_path = get_get_pip(self.get_pip_url, wheelhouse)
         # Get pip arguments
         pip_args = self.pip_parser.parse_args(self.pip_params)
-        req_params, fetch_params = recon_pip_args(pip_args)
-        # Find or install pip, install wheel, for given Python.org Python
-        pip_exe = upgrade_pip(get_pip_path, self.pyv_m_m, fetch_params)
-        # Fetch the wheels we need
-        check_call([pip_exe, 'wheel',
-                    '-w', wheelhouse,
-                    'pip', 'setuptools'] +
-                   req_params + fetch_params)
+        all_req_params, fetch_params = recon_pip_args(pip_args)
+        if req_params is None:
+            req_params = all_req_params
+        else:
+            fetch_params = fetch_params + ['--find-links=' + wheelhouse]
+        if self.env_pool is None:
+            # Find or install pip, install wheel, for given Python.org Python
+            pip_exe = upgrade_pip(get_pip_path, self.pyv_m_m, fetch_params,
+                                  self.runner)
+            self.fetch_wheels([pip_exe], req_params, fetch_params)
+            return
+        with self.env_pool.lease(get_python_path(self.pyv_m_m),
+                                 get_pip_path, fetch_params) as env:
+            self.build_report['build_env'] = dict(path=env.env_dir,
+                                                  created=env.created)
+            self.fetch_wheels(env.pip_cmd, req_params, fetch_params)
+
+    def fetch_wheels(self, pip_cmd, req_params, fetch_params):
+        """ Download or build wheels into wheelhouse with pip
+
+        Parameters
+        ----------
+        pip_cmd : sequence
+            Command to run pip
+        req_params : sequence
+            Requirement parameters for pip
+        fetch_params : sequence
+            Other parameters for pip, such as index and find-links options
+        """
+        wheelhouse = _safe_mkdirs(self.wheel_build_dir)
+        cache = self.compiler_cache
+        if not cache is None:
+            stats_before = cache.stats(self.pyv_mm, self.build_arch)
+        if self.build_jobs is None and self.source_cache is None:
+            self.runner.check_call(pip_cmd +
+                                   ['wheel', '-w', wheelhouse,
+                                    'pip', 'setuptools'] +
+                                   req_params + fetch_params,
+                                   env=self.build_environ())
+        else:
+            self._download_build(pip_cmd, req_params, fetch_params)
+        if not cache is None:
+            stats = cache.stats(self.pyv_mm, self.build_arch)
+            self.build_report['compiler_cache'] = dict(
+                (key, stats[key] - stats_before[key]) for key in stats)
+
+    def _download_build(self, pip_cmd, req_params, fetch_params):
+        """ Download wheels and sdists, build sdists in parallel
+
+        Download into a new directory for each fetch, so we only use the
+        files from this download, not those from earlier fetches.
+        """
+        wheelhouse = self.wheel_build_dir
+        with TemporaryDirectory(prefix='downloads-', dir=self.scratch_dir,
+                                reaper=REAPER) as download_dir:
+            self.runner.check_call(pip_cmd +
+                                   ['download', '-d', download_dir,
+                                    'pip', 'setuptools'] +
+                                   req_params + fetch_params)
+            sdists = {}
+            for fname in sorted(os.listdir(download_dir)):
+                path = pjoin(download_dir, fname)
+                if fname.endswith('.whl'):
+                    shutil.copy2(path, wheelhouse)
+                    continue
+                match = SDIST_FNAME_RE.match(fname)
+                if match:
+                    sdists[canonical_name(match.group('name'))] = path
+            self.build_sdists(pip_cmd, sdists, fetch_params)
+
+    @property
+    def build_arch(self):
+        """ Architecture of builds from source on this machine """
+        return platform.machine()
+
+    def build_environ(self):
+        """ Return environment for builds from source
+
+        Returns
+        -------
+        env : None or dict
+            Environment with compiler cache settings, or None if we have no
+            compiler cache, meaning use our own environment.
+        """
+        if self.compiler_cache is None:
+            return None
+        return self.compiler_cache.build_env(
+            self.pyv_mm, self.build_arch,
+            pjoin(self.scratch_dir, 'ccache-bin'))
+
+    def compiler_identity(self):
+        """ Return first line of C compiler version output, or ''
+
+        ``CC`` can include arguments, as in ``CC="gcc -arch x86_64"``.
+        """
+        compiler = shlex.split(os.environ.get('CC', '')) or ['cc']
+        try:
+            record = self.runner.run(compiler + ['--version'])
+        except OSError: # No compiler
+            return ''
+        if record.returncode != 0:
+            return ''
+        return (record.output_tail.splitlines() or [''])[0]
+
+    def source_key(self, sdist, compiler_id):
+        """ Return source cache key for building wheel from `sdist`
+
+        The key depends on the sdist contents, the target Python version, the
+        machine architecture, compiler `compiler_id` (see
+        :meth:`compiler_identity`), and the environment variables in
+        ``SOURCE_KEY_ENV``.
+        """
+        return make_key(file_sha256(sdist),
+                        self.pyv_m_m,
+                        self.build_arch,
+                        compiler_id,
+                        *['{0}={1}'.format(var, os.environ.get(var, ''))
+                          for var in SOURCE_KEY_ENV])
+
+    def build_sdists(self, pip_cmd, sdists, fetch_params):
+        """ Build wheels from `sdists` in parallel into wheelhouse
+
+        Run up to ``self.build_jobs`` builds at a time (default number of
+        CPUs), sharing the CPUs between them, and build each package after
+        those it needs at build time (see
+        :func:`scheduler.sdist_build_depends`), so the build can use their
+        wheels from the wheelhouse.  We write the output of each build to
+        ``build-logs/<name>.log`` in the scratch directory.  If we have a
+        source cache, use cached wheels where possible, and cache new wheels.
+
+        Parameters
+        ----------
+        pip_cmd : sequence
+            Command to run pip
+        sdists : dict
+            Mapping of canonical package name to sdist filename
+        fetch_params : sequence
+            Other parameters for pip, such as index and find-links options
+        """
+        if len(sdists) == 0:
+            return
+        wheelhouse = self.wheel_build_dir
+        cpu_budget = cpu_count() if self.build_jobs is None else self.build_jobs
+        n_workers = max(1, min(len(sdists), cpu_budget))
+        jobs_per_build = max(1, cpu_budget // n_workers)
+        env = dict(self.build_environ() or os.environ,
+                   MAKEFLAGS='-j{0}'.format(jobs_per_build),
+                   NPY_NUM_BUILD_JOBS=str(jobs_per_build))
+        log_dir = _safe_mkdirs(pjoin(self.scratch_dir, 'build-logs'))
+        cache = self.source_cache
+        compiler_id = None if cache is None else self.compiler_identity()
+
+        def run_build(name, sdist):
+            if not cache is None:
+                key = self.source_key(sdist, compiler_id)
+                if not cache.get(key, wheelhouse) is None:
+                    return None
+            out_dir = mkdtemp(dir=self.scratch_dir)
+            try:
+                record = self.runner.check_call(
+                    pip_cmd + ['wheel', '--no-deps', '-w', out_dir,
+                               '--find-links', wheelhouse, sdist] +
+                    fetch_params,
+                    env=env,
+                    output_fname=pjoin(log_dir, name + '.log'))
+                wheels = glob(pjoin(out_dir, '*.whl'))
+                for wheel in wheels:
+                    shutil.copy2(wheel, wheelhouse)
+                if not cache is None:
+                    cache.put(key, wheels)
+            finally:
+                REAPER.reap(out_dir)
+            return record.wall_time
+
+        self.build_report['source_builds'] = dict(workers=n_workers,
+                                                  jobs_per_build=jobs_per_build,
+                                                  log_dir=log_dir)
+        times = run_builds(sdists, run_build, n_workers,
+                           sdist_build_depends(sdists))
+        self.build_report['source_builds']['times'] = dict(
+            (name, t) for name, t in times.items() if not t is None)
+        if not cache is None:
+            self.build_report['source_cache'] = cache.stats
+
+    def delocate_key(self, wheel):
+        """ Return cache key for processing compiled wheel `wheel`
+
+        The key depends on the wheel contents and all the settings that can
+        change the processed wheel.
+        """
+        return make_key(file_sha256(wheel),
+                        delocate.__version__,
+                        str(self.delocate_wheels),
+                        REQUIRE_ARCHS,
+                        ','.join(RETAG_PLATFORMS))
+
+    def process_wheel(self, wheel):
+        """ Delocate compiled wheel `wheel`, check archs, add platform tags
+
+        Parameters
+        ----------
+        wheel : str
+            Filename of compiled wheel in wheelhouse
+
+        Returns
+        -------
+        out_wheel : str
+            Filename of processed wheel.  We delete `wheel` if `out_wheel` is
+            a different file.
+        """
+        if self.delocate_wheels:
+            with catch_warnings():
+                simplefilter('ignore')
+                delocate_wheel(wheel, require_archs=REQUIRE_ARCHS)
+        return retag_wheel(wheel, RETAG_PLATFORMS)
 
     def process_wheels(self):
         """ Delocate built wheels, check archs, add platform tags
+
+        If we have a delocate cache, use cached results for wheels we have
+        processed before, and store results for new wheels.
         """
+        cache = self.delocate_cache
+        action = 'delocated' if self.delocate_wheels else 'retagged'
         for wheel in glob(pjoin(self.wheel_build_dir, '*.whl')):
             if not '-macosx_10_6_intel' in wheel: # Pure wheel
                 continue
-            if self.delocate_wheels:
-                with catch_warnings():
-                    simplefilter('ignore')
-                    delocate_wheel(wheel, require_archs='intel')
-            new_wheel = add_platforms(
-                wheel,
-                ('macosx_10_9_intel', 'macosx_10_9_x86_64',
-                 'macosx_10_10_intel', 'macosx_10_10_x86_64'),
-                clobber=True)
-            # returned new_wheel is None or absolute path
-            if new_wheel and realpath(new_wheel) != realpath(wheel):
-                os.unlink(wheel)
+            self.events.check()
+            if cache is None:
+                out_wheels = [self.process_wheel(wheel)]
+                self.events.emit(WHEEL_PROCESSED,
+                                 filename=basename(out_wheels[0]),
+                                 action=action)
+                continue
+            key = self.delocate_key(wheel)
+            cached = cache.get(key, self.wheel_build_dir)
+            if cached is None:
+                out_wheels = [self.process_wheel(wheel)]
+                cache.put(key, out_wheels)
+            else:
+                out_wheels = cached
+                if not wheel in cached:
+                    os.unlink(wheel)
+            for out_wheel in out_wheels:
+                self.events.emit(WHEEL_PROCESSED,
+                                 filename=basename(out_wheel),
+                                 action=action if cached is None
+                                 else 'cached')
+        if not cache is None:
+            self.build_report['delocate_cache'] = cache.stats
+
+    def thin_wheels(self, n_jobs=None):
+        """ Thin fat binaries in compiled wheels to ``self.thin_archs``
+
+        Parameters
+        ----------
+        n_jobs : None or int, optional
+            Number of wheels to thin at the same time.  None means use the
+            number of CPUs.
+        """
+        wheels = [wheel for wheel in glob(pjoin(self.wheel_build_dir, '*.whl'))
+                  if not wheel.endswith('-any.whl')]
+        if len(wheels) == 0:
+            return
+        n_jobs = cpu_count() if n_jobs is None else n_jobs
+        pool = ThreadPool(min(n_jobs, len(wheels)))
+        try:
+            results = pool.map(lambda wheel : thin_wheel(wheel,
+                                                         self.thin_archs),
+                               wheels)
+        finally:
+            pool.close()
+            pool.join()
+        self.build_report['thinning'] = dict(
+            wheels=len(wheels),
+            bytes_removed=sum(n_removed for fname, n_removed in results))
+
+    def compile_wheel_files(self, n_jobs=None):
+        """ Add ``.pyc`` files for target Python to wheels in wheelhouse
+
+        Parameters
+        ----------
+        n_jobs : None or int, optional
+            Number of compiling processes.  None means use the number of
+            CPUs.
+
+        Notes
+        -----
+        We compile wheels in parallel, each in a single process, so we run at
+        most `n_jobs` processes.  A single wheel compiles in parallel across
+        files.  We start with the largest wheels, so these do not finish
+        last.
+        """
+        python_path = get_python_path(self.pyv_m_m)
+        wheels = sorted(glob(pjoin(self.wheel_build_dir, '*.whl')),
+                        key=getsize, reverse=True)
+        if len(wheels) == 0:
+            return
+        n_jobs = cpu_count() if n_jobs is None else n_jobs
+        if len(wheels) == 1:
+            compile_wheel(wheels[0], python_path, self.runner, n_jobs)
+            return
+        pool = ThreadPool(min(n_jobs, len(wheels)))
+        try:
+            pool.map(lambda wheel : compile_wheel(wheel, python_path,
+                                                  self.runner, 1),
+                     wheels)
+        finally:
+            pool.close()
+            pool.join()
+
+    @property
+    def support_name(self):
+        """ Name of support wheel for libraries shared between wheels """
+        return self.pkg_name + '-dylibs'
+
+    def dedup_wheels(self):
+        """ Find libraries copied into more than one wheel in wheelhouse
+
+        Report the duplicated bytes.  If ``self.dedup_libs`` is
+        "consolidate", move the copies into a support wheel.
+        """
+        wheels = sorted(glob(pjoin(self.wheel_build_dir, '*.whl')))
+        report = duplicate_report(find_duplicates(wheels))
+        if self.dedup_libs == 'consolidate':
+            support_fname, moved = consolidate_libs(wheels,
+                                                    self.support_name,
+                                                    self.pkg_version,
+                                                    self.wheel_build_dir)
+            report['support_wheel'] = (None if support_fname is None
+                                       else basename(support_fname))
+            report['consolidated'] = sorted(moved)
+            report['bytes_saved'] = sum(size * (n_copies - 1)
+                                        for size, n_copies in moved.values())
+        self.build_report['dedup'] = report
+
+    def recompress_wheels(self, n_jobs=None):
+        """ Rewrite wheels in wheelhouse with ``self.recompress`` policy
+
+        Parameters
+        ----------
+        n_jobs : None or int, optional
+            Number of wheels to recompress at the same time.  None means use
+            the number of CPUs.
+        """
+        wheels = glob(pjoin(self.wheel_build_dir, '*.whl'))
+        if len(wheels) == 0:
+            return
+        start = time.time()
+        n_jobs = cpu_count() if n_jobs is None else n_jobs
+        pool = ThreadPool(min(n_jobs, len(wheels)))
+        try:
+            sizes = pool.map(lambda wheel : recompress_wheel(wheel,
+                                                             self.recompress),
+                             wheels)
+        finally:
+            pool.close()
+            pool.join()
+        self.build_report['recompress'] = dict(
+            policy=self.recompress,
+            wheels=len(wheels),
+            size_before=sum(before for before, after in sizes),
+            size_after=sum(after for before, after in sizes),
+            time=time.time() - start)
+
+    def update_catalog(self):
+        """ Update wheel catalog, if present, for wheels in wheelhouse
+        """
+        if self.catalog is None:
+            return
+        n_read, n_removed = self.catalog.update(self.wheel_build_dir)
+        self.build_report['catalog'] = dict(
+            read=n_read, removed=n_removed,
+            bad=sorted(basename(path) for path in self.catalog.bad_wheels))
 
     def write_requires(self):
         """ Write a pip requirements file with given requirements
@@ -355,17 +1220,249 @@ class PkgWriter(object):
         """
         requires_fname = pjoin(_safe_mkdirs(self.wheel_build_dir),
                                self.pkg_name_version + '.txt')
-        template = get_template('requirements.txt')
+        template = self.get_template('requirements.txt')
         with open(requires_fname, 'wt') as fobj:
             fobj.write(template.render(info = self))
         return requires_fname
 
-    def write_wheelhouse(self):
+    @property
+    def manifest_name(self):
+        return self.pkg_name_version + '-manifest.json'
+
+    def wheel_hashes(self, n_jobs=None):
+        """ Return sha256 hex digests for wheels in wheelhouse
+
+        We keep the digests, and only hash wheels again if they change, so
+        the manifest and all the outputs share one hashing pass.
+
+        Parameters
+        ----------
+        n_jobs : None or int, optional
+            Number of wheels to hash at the same time.  None means use the
+            number of CPUs.
+
+        Returns
+        -------
+        hashes : dict
+            Mapping of wheel filename to sha256 hex digest
+        """
+        wheels = sorted(glob(pjoin(self.wheel_build_dir, '*.whl')))
+        stats = {}
+        for wheel in wheels:
+            stat = os.stat(wheel)
+            stats[wheel] = (stat.st_size, stat.st_mtime)
+        to_hash = [wheel for wheel in wheels
+                   if self._wheel_hashes.get(wheel, (None,))[0] !=
+                   stats[wheel]]
+        if len(to_hash) != 0:
+            n_jobs = cpu_count() if n_jobs is None else n_jobs
+            pool = ThreadPool(min(n_jobs, len(to_hash)))
+            try:
+                digests = pool.map(file_sha256, to_hash)
+            finally:
+                pool.close()
+                pool.join()
+            for wheel, digest in zip(to_hash, digests):
+                self._wheel_hashes[wheel] = (stats[wheel], digest)
+        return dict((wheel, self._wheel_hashes[wheel][1]) for wheel in wheels)
+
+    def get_manifest(self):
+        """ Return manifest of wheels in wheelhouse
+
+        Returns
+        -------
+        manifest : dict
+            Dictionary with keys ``pkg_name``, ``pkg_version``, ``python``
+            (Python major.minor version) and ``wheels``, a dict mapping
+            canonical distribution name to dict with ``version``,
+            ``filename``, ``sha256``, ``size`` and ``top_level`` (list of
+            top-level module names) of the wheel.
+        """
+        wheels = {}
+        for wheel, sha256 in sorted(self.wheel_hashes().items()):
+            parts = parse_wheel_fname(wheel)
+            wheels[canonical_name(parts['name'])] = dict(
+                version=parts['version'],
+                filename=basename(wheel),
+                sha256=sha256,
+                size=getsize(wheel),
+                top_level=read_top_level(wheel))
+        return dict(pkg_name=self.pkg_name,
+                    pkg_version=self.pkg_version,
+                    python=self.pyv_m_m,
+                    wheels=wheels)
+
+    def write_manifest(self):
+        """ Write JSON manifest of wheels into wheelhouse
+
+        The install script compares the manifest to the installed
+        distributions, to install only wheels for distributions that are
+        missing or older.
+
+        Returns
+        -------
+        manifest_fname : str
+            Filename of written manifest
+        """
+        manifest_fname = pjoin(self.wheel_build_dir, self.manifest_name)
+        with open(manifest_fname, 'wt') as fobj:
+            json.dump(self.get_manifest(), fobj, indent=2, sort_keys=True)
+        return manifest_fname
+
+    def prune_wheelhouse(self, base_manifest):
+        """ Remove wheels that are the same as in `base_manifest`
+
+        Wheels are the same if they have the same filename, and so the same
+        version.  The install script uses the installed distributions from
+        the base release for the wheels we remove.
+
+        Parameters
+        ----------
+        base_manifest : str
+            Filename of manifest from previous release (see
+            :meth:`write_manifest`)
+        """
+        with open(base_manifest, 'rt') as fobj:
+            base = json.load(fobj)
+        if base['python'] != self.pyv_m_m:
+            raise ValueError('Base manifest is for Python {0}, not {1}'.format(
+                base['python'], self.pyv_m_m))
+        base_wheels = base['wheels']
+        kept, removed, removed_size = 0, 0, 0
+        for name, info in self.get_manifest()['wheels'].items():
+            if base_wheels.get(name, {}).get('filename') != info['filename']:
+                kept += 1
+                continue
+            os.unlink(pjoin(self.wheel_build_dir, info['filename']))
+            removed += 1
+            removed_size += info['size']
+        self.build_report['update'] = dict(base_version=base['pkg_version'],
+                                           wheels_kept=kept,
+                                           wheels_removed=removed,
+                                           bytes_removed=removed_size)
+
+    def write_wheelhouse(self, base_manifest=None):
         """ Write wheels, requirements into wheelhouse directory
+
+        Parameters
+        ----------
+        base_manifest : None or str, optional
+            If not None, filename of manifest from previous release.  Write
+            the full requirements and manifest, but only keep the wheels that
+            are new or changed since the previous release.
         """
-        self.get_wheels()
-        self.process_wheels()
-        self.write_requires()
+        with self.stage('get_wheels'):
+            self.get_wheels()
+        self.finish_wheelhouse(base_manifest)
+
+    def finish_wheelhouse(self, base_manifest=None):
+        """ Process fetched wheels, write requirements and manifest
+
+        Parameters
+        ----------
+        base_manifest : None or str, optional
+            See :meth:`write_wheelhouse`
+        """
+        with self.stage('process_wheels'):
+            self.process_wheels()
+        if self.thin_archs:
+            with self.stage('thin_wheels'):
+                self.thin_wheels()
+        if not self.dedup_libs is None:
+            with self.stage('dedup_libs'):
+                self.dedup_wheels()
+        if self.compile_wheels:
+            with self.stage('compile_wheels'):
+                self.compile_wheel_files()
+        if self.recompress != 'keep':
+            with self.stage('recompress_wheels'):
+                self.recompress_wheels()
+        with self.stage('catalog'):
+            self.update_catalog()
+        with self.stage('requires'):
+            self.write_requires()
+            self.write_manifest()
+        if not base_manifest is None:
+            with self.stage('prune_wheels'):
+                self.prune_wheelhouse(base_manifest)
+
+    def update_wheels(self, names, base_manifest=None):
+        """ Fetch wheels again for distributions `names`, process wheelhouse
+
+        Remove wheels for distributions `names` from the wheelhouse, then
+        fetch wheels for the current requirements with these names, reusing
+        wheels for their dependencies from the wheelhouse.  Wheels for
+        dependencies of removed requirements stay until a full rebuild.
+
+        We fetch all wheels again for update images (`base_manifest` not
+        None), because we have pruned the unchanged wheels, and for
+        consolidated libraries (``dedup_libs`` of "consolidate"), because
+        the support wheel comes from all the other wheels.
+
+        Parameters
+        ----------
+        names : iterable
+            Canonical names of distributions to fetch again
+        base_manifest : None or str, optional
+            See :meth:`write_wheelhouse`
+        """
+        names = set(names)
+        refetch_all = (self.dedup_libs == 'consolidate' or
+                       not base_manifest is None)
+        for wheel in glob(pjoin(self.wheel_build_dir, '*.whl')):
+            if (refetch_all or
+                canonical_name(parse_wheel_fname(wheel)['name']) in names):
+                os.unlink(wheel)
+        req_strings = [
+            req for name, req in zip(
+                self.get_requirement_strings(extras=False, versions=False),
+                self.get_requirement_strings())
+            if refetch_all or canonical_name(name) in names]
+        if len(req_strings) != 0:
+            with self.stage('get_wheels'):
+                self.get_wheels(req_strings)
+        self.finish_wheelhouse(base_manifest)
+
+    def verify_wheelhouse(self):
+        """ Check integrity of wheels in wheelhouse
+
+        Raises
+        ------
+        WheelVerifyError
+            If any wheel fails verification
+        """
+        wheels = sorted(glob(pjoin(self.wheel_build_dir, '*.whl')))
+        start = time.time()
+        verify_wheels(wheels)
+        self.build_report['verify'] = dict(
+            wheels=len(wheels),
+            size=sum(getsize(wheel) for wheel in wheels),
+            time=time.time() - start)
+
+    def write_size_report(self, out_dir, volname):
+        """ Write size breakdown of disk image contents to `out_dir`
+
+        Write JSON report and text summary as ``<volname>-sizes.json`` and
+        ``<volname>-sizes.txt``.  Check against ``self.size_budget``.
+
+        Raises
+        ------
+        SizeBudgetError
+            If the disk image contents are over ``self.size_budget`` bytes
+        """
+        report = size_report(self.dmg_build_dir)
+        json_fname = pjoin(out_dir, volname + '-sizes.json')
+        with open(json_fname, 'wt') as fobj:
+            json.dump(report, fobj, indent=2, sort_keys=True)
+        text_fname = pjoin(out_dir, volname + '-sizes.txt')
+        with open(text_fname, 'wt') as fobj:
+            fobj.write(format_size_report(report))
+        self.build_report['sizes'] = dict(
+            total=report['total'],
+            budget=self.size_budget,
+            summary=text_fname)
+        if not self.size_budget is None:
+            check_budget(report, self.size_budget)
 
     def write_post(self, out_dir):
         """ Write ``postinstall`` file
@@ -381,31 +1478,82 @@ class PkgWriter(object):
             Filename of written file
         """
         post_fname = pjoin(out_dir, 'postinstall')
-        template = get_template('postinstall')
+        template = self.get_template('postinstall')
         with open(post_fname, 'wt') as fobj:
             fobj.write(template.render(info = self))
-        check_call(['chmod', 'a+x', post_fname])
+        self.runner.check_call(['chmod', 'a+x', post_fname])
         return post_fname
 
     def write_webloc(self):
         """ Write webloc link to Python installer
         """
-        template = get_template('first_install_python.webloc')
+        template = self.get_template('first_install_python.webloc')
         froot = 'Install Python {0}.webloc'.format(self.pyv_m_m)
         webloc_fname = pjoin(self.dmg_build_dir, froot)
         with open(webloc_fname, 'wt') as fobj:
             fobj.write(template.render(info = self))
-        check_call(['SetFile', '-a', 'E', webloc_fname])
+        self.runner.check_call(['SetFile', '-a', 'E', webloc_fname])
         return webloc_fname
 
     def write_readme(self):
         """ Write README.txt file """
-        template = get_template('README.txt')
+        template = self.get_template('README.txt')
         readme_fname = pjoin(self.dmg_build_dir, 'README.txt')
         with open(readme_fname, 'wt') as fobj:
             fobj.write(template.render(info = self))
         return readme_fname
 
+    def import_names(self):
+        """ Return top-level module names for requirements in `self`
+
+        Find the modules from the wheel in the wheelhouse for each
+        requirement.  The wheelhouse for an update image only has the changed
+        wheels, so we also use the module names from the wheelhouse manifest,
+        which lists all the wheels.  If there is no wheel for a requirement,
+        guess the module name from the requirement name.
+
+        Returns
+        -------
+        names : list
+            Importable public top-level names, in order of requirements
+        """
+        top_levels = {}
+        manifest_fname = pjoin(self.wheel_build_dir, self.manifest_name)
+        if exists(manifest_fname):
+            with open(manifest_fname, 'rt') as fobj:
+                for key, info in json.load(fobj)['wheels'].items():
+                    if 'top_level' in info:
+                        top_levels[key] = info['top_level']
+        for wheel in glob(pjoin(self.wheel_build_dir, '*.whl')):
+            key = canonical_name(parse_wheel_fname(wheel)['name'])
+            top_levels[key] = read_top_level(wheel)
+        names = []
+        for req in self.get_requirement_strings(extras=False, versions=False):
+            modules = top_levels.get(canonical_name(req),
+                                     [re.sub(r'\W', '_', req)])
+            names += [name for name in modules
+                      if not name.startswith('_') and not name in names]
+        return names
+
+    def write_import_benchmark(self):
+        """ Write script to time imports of installed packages to disk image
+
+        The script imports each module from :meth:`import_names` in a fresh
+        Python process, and writes a JSON report of cold and warm import
+        times.
+
+        Returns
+        -------
+        benchmark_fname : str
+            Filename of written script
+        """
+        benchmark_fname = pjoin(self.dmg_build_dir, self.benchmark_name)
+        template = self.get_template(self.benchmark_name)
+        with open(benchmark_fname, 'wt') as fobj:
+            fobj.write(template.render(info = self))
+        self.runner.check_call(['chmod', 'a+x', benchmark_fname])
+        return benchmark_fname
+
     def write_component_pkg(self):
         """ Write component package to install wheels
 
@@ -418,18 +1566,18 @@ class PkgWriter(object):
         scripts = pjoin(self.scratch_dir, 'scripts')
         _safe_mkdirs(scripts)
         self.write_post(scripts)
-        check_call(['pkgbuild',
-                    '--nopayload',
-                    '--scripts', scripts,
-                    '--identifier', self.identifier,
-                    '--version', self.pkg_version,
-                    pkg_fname])
+        self.runner.check_call(['pkgbuild',
+                                '--nopayload',
+                                '--scripts', scripts,
+                                '--identifier', self.identifier,
+                                '--version', self.pkg_version,
+                                pkg_fname])
         return pkg_fname
 
     def write_distribution(self):
         """ Write Distribution XML for product archive
         """
-        template = get_template('Distribution')
+        template = self.get_template('Distribution')
         out_fname = pjoin(self.scratch_dir, 'Distribution')
         with open(out_fname, 'wt') as fobj:
             fobj.write(template.render(info = self))
@@ -449,50 +1597,229 @@ class PkgWriter(object):
         for name in self.existing_chatty_names:
             out_fname = pjoin(en_resources, name)
             with open(out_fname, 'wt') as fobj:
-                fobj.write(get_template(name).render(info = self))
+                fobj.write(self.get_template(name).render(info = self))
         return resources
 
+    @property
+    def product_archive_fname(self):
+        return pjoin(self.dmg_build_dir, self.pkg_name_pyv_version + '.pkg')
+
     def write_product_archive(self):
         """ Write product archive ``.pkg`` file
         """
         distribution = self.write_distribution()
         self.write_component_pkg()
         resources = self.write_resources()
-        product_fname = pjoin(self.dmg_build_dir,
-                              self.pkg_name_pyv_version + '.pkg')
-        check_call(['productbuild',
-                    '--distribution', distribution,
-                    '--resources', resources,
-                    '--package-path', self.scratch_dir,
-                    product_fname])
+        product_fname = self.product_archive_fname
+        if exists(product_fname):
+            os.unlink(product_fname)
+        self.runner.check_call(['productbuild',
+                                '--distribution', distribution,
+                                '--resources', resources,
+                                '--package-path', self.scratch_dir,
+                                product_fname])
+
+    def write_image(self, dmg_fname, volname):
+        """ Write disk image `dmg_fname` from disk image build directory
+        """
+        self.runner.check_call(['hdiutil', 'create',
+                                '-srcfolder', self.dmg_build_dir,
+                                '-volname', volname,
+                                dmg_fname])
+
+    def copy_product_archive(self, pkg_fname):
+        """ Copy product archive to `pkg_fname`
+        """
+        shutil.copyfile(self.product_archive_fname, pkg_fname)
 
-    def write_dmg(self, out_dir, clobber=False):
-        """ Write disk image ``.dmg`` file
+    def write_wheelhouse_archive(self, archive_fname, root):
+        """ Write gzipped tar archive of wheelhouse and README
+
+        The archive has the README and the wheelhouse directory in directory
+        `root`, laid out as on the disk image, so the manual install
+        instructions in the README apply.
+
+        Parameters
+        ----------
+        archive_fname : str
+            Filename of archive to write
+        root : str
+            Name of directory containing files in archive
+        """
+        tmp_fname = archive_fname + '.part'
+        # Wheels are usually compressed already, so higher compression
+        # levels gain little
+        with tarfile.open(tmp_fname, 'w:gz', compresslevel=6) as tf:
+            tf.add(pjoin(self.dmg_build_dir, 'README.txt'),
+                   root + '/README.txt')
+            tf.add(self.wheel_build_dir, root + '/' + self.wheel_sdir)
+        os.rename(tmp_fname, archive_fname)
+
+    def write_outputs(self, out_fnames, volname):
+        """ Write outputs in `out_fnames` at the same time
+
+        Parameters
+        ----------
+        out_fnames : dict
+            Mapping of output format (key of ``OUTPUT_FORMATS``) to filename
+        volname : str
+            Volume name for disk image, and root directory name for
+            wheelhouse archive
+        """
+        sinks = dict(dmg=lambda fname : self.write_image(fname, volname),
+                     pkg=self.copy_product_archive,
+                     wheelhouse=lambda fname : self.write_wheelhouse_archive(
+                         fname, volname))
+
+        def write_output(fmt):
+            with self.stage('output_' + fmt):
+                sinks[fmt](out_fnames[fmt])
+            self.events.emit(BYTES_WRITTEN, format=fmt,
+                             filename=out_fnames[fmt],
+                             size=getsize(out_fnames[fmt]))
+
+        pool = ThreadPool(len(out_fnames))
+        try:
+            pool.map(write_output, list(out_fnames))
+        finally:
+            pool.close()
+            pool.join()
+        self.outputs = OrderedDict(out_fnames)
+        self.build_report['outputs'] = dict(
+            (fmt, dict(filename=basename(fname), size=getsize(fname)))
+            for fmt, fname in out_fnames.items())
+
+    def write_dmg(self, out_dir, clobber=False, base_manifest=None,
+                  wheelhouse=True, formats=('dmg',)):
+        """ Write disk image ``.dmg`` file, and any other output formats
+
+        All outputs come from the same wheelhouse, and we write them at the
+        same time.  Also write the wheel manifest next to the outputs, as
+        ``<volume name>-manifest.json``, for use as a later `base_manifest`,
+        and the size breakdown of the image contents (see
+        :meth:`write_size_report`).
+        Set ``self.outputs`` to the mapping of format to output filename.
+        We do not clear any cancellation of an earlier build; callers
+        starting a new build do that with ``self.events.reset()``.
 
         Parameters
         ----------
         out_dir : str
-            Directory in which to write ``.dmg`` file
+            Directory in which to write outputs
         clobber : bool, optional
-            If True, overwrite existing file.  If False, raise IOError if file
-            exists.
-        """
-        dmg_fname = pjoin(out_dir, self.pkg_name_pyv_version + '.dmg')
-        if exists(dmg_fname):
-            if not clobber:
-                raise IOError(
-                    '{0} exists, declining to overwrite'.format(dmg_fname))
-            os.unlink(dmg_fname)
-        self.write_webloc()
-        self.write_readme()
-        self.write_wheelhouse()
-        self.write_product_archive()
-        check_call(['hdiutil', 'create',
-                    '-srcfolder', self.dmg_build_dir,
-                    '-volname', self.pkg_name_pyv_version,
-                    dmg_fname])
+            If True, overwrite existing files.  If False, raise IOError if an
+            output file exists.
+        base_manifest : None or str, optional
+            If not None, filename of manifest from previous release.  Write an
+            update image with only the wheels that are new or changed since
+            that release; it installs over the previous release.
+        wheelhouse : bool, optional
+            If False, use the wheelhouse from an earlier build, and only write
+            the installer files and the outputs.
+        formats : sequence, optional
+            Output formats to write, from "dmg" (disk image), "pkg" (product
+            archive) and "wheelhouse" (gzipped tar archive of wheelhouse).
+
+        Returns
+        -------
+        dmg_fname : None or str
+            Filename of disk image, or None if `formats` does not include
+            "dmg"
+        """
+        formats = _unique(formats)
+        for fmt in formats:
+            if not fmt in OUTPUT_FORMATS:
+                raise ValueError('Output format should be one of ' +
+                                 ', '.join(OUTPUT_FORMATS))
+        volname = self.pkg_name_pyv_version
+        if not base_manifest is None:
+            with open(base_manifest, 'rt') as fobj:
+                volname += '-update-from-' + json.load(fobj)['pkg_version']
+        out_fnames = OrderedDict(
+            (fmt, pjoin(out_dir, volname + OUTPUT_FORMATS[fmt]))
+            for fmt in formats)
+        for out_fname in out_fnames.values():
+            if exists(out_fname):
+                if not clobber:
+                    raise IOError(
+                        '{0} exists, declining to overwrite'.format(out_fname))
+                os.unlink(out_fname)
+        dmg_fname = out_fnames.get('dmg')
+        self.outputs = OrderedDict()
+        self.stage_times.clear()
+        start = time.time()
+        error = None
+        try:
+            if 'dmg' in formats:
+                with self.stage('webloc'):
+                    self.write_webloc()
+            with self.stage('readme'):
+                self.write_readme()
+            if wheelhouse:
+                self.write_wheelhouse(base_manifest)
+            if self.verify_wheels:
+                with self.stage('verify_wheels'):
+                    self.verify_wheelhouse()
+            with self.stage('import_benchmark'):
+                self.write_import_benchmark()
+            if 'dmg' in formats or 'pkg' in formats:
+                with self.stage('product_archive'):
+                    self.write_product_archive()
+            with self.stage('sizes'):
+                self.write_size_report(out_dir, volname)
+            self.write_outputs(out_fnames, volname)
+            shutil.copyfile(pjoin(self.wheel_build_dir, self.manifest_name),
+                            pjoin(out_dir, volname + '-manifest.json'))
+        except BaseException as err:
+            error = '{0}: {1}'.format(type(err).__name__, err)
+            raise
+        finally:
+            self.build_report['commands'] = self.runner.summary()
+            self.build_report['stages'] = dict(self.stage_times)
+            self.build_report['peak_rss'] = peak_rss()
+            try:
+                if not self.history is None:
+                    self.record_build(start, dmg_fname, error)
+            finally:
+                self.events.emit(BUILD_END, outputs=dict(self.outputs),
+                                 error=error)
         return dmg_fname
 
+    def record_build(self, start, dmg_fname, error=None):
+        """ Record build in build history database
+
+        Parameters
+        ----------
+        start : float
+            Time at which build started, in seconds since the epoch
+        dmg_fname : None or str
+            Filename of disk image, None if we did not write a disk image
+        error : None or str, optional
+            Error message if build failed
+
+        Returns
+        -------
+        build_id : int
+            Identifier of build in history database
+        """
+        wheels = (self.wheel_sizes() if exists(self.wheel_build_dir)
+                  else [])
+        build_id = self.history.record(
+            self.pkg_name,
+            self.pkg_version,
+            self.pyv_mm,
+            start,
+            self.inputs_digest(),
+            'ok' if error is None else 'failed',
+            time.time() - start,
+            dict(self.stage_times),
+            wheels,
+            (os.path.getsize(dmg_fname)
+             if not dmg_fname is None and exists(dmg_fname) else None),
+            error)
+        self.build_report['build_id'] = build_id
+        return build_id
+
 
 def insert_template_path(path):
     """ Insert new path into jinja environment global
@@ -515,6 +1842,30 @@ def pop_template_path():
     JINJA_ENV.cache.clear()
 
 
+def template_env(search_path):
+    """ Return jinja environment for templates in `search_path`
+
+    Environments, and so their compiled templates, are shared between all
+    callers asking for the same search path.
+
+    Parameters
+    ----------
+    search_path : sequence
+        Directories in which to search for templates, in search order
+
+    Returns
+    -------
+    env : jinja2 ``Environment`` instance
+    """
+    search_path = tuple(search_path)
+    with _TEMPLATE_ENVS_LOCK:
+        if not search_path in _TEMPLATE_ENVS:
+            _TEMPLATE_ENVS[search_path] = Environment(
+                loader=FileSystemLoader(list(search_path)),
+                trim_blocks=True)
+        return _TEMPLATE_ENVS[search_path]
+
+
 def get_template(*args, **kwargs):
     """ Get template from jinja environment global
 
@@ -0,0 +1,475 @@
+""" Plan a build without running pip, delocate or OSX tools
+
+The plan lists the wheels we expect the build to need, where we expect to get
+them, and estimates of the size of the wheelhouse and the disk image.  We work
+this out from the requirements, the local wheel and source caches (find-links
+directories, an existing wheelhouse, the delocate cache), and index metadata
+from the PyPI JSON API.  If the writer has a build history, we estimate build
+times from recent builds.  Planning reads the wheel catalog and build history,
+but does not write to them.
+
+We resolve dependencies from ``Requires-Dist`` metadata, ignoring environment
+markers other than extras, so the plan is an estimate of what pip will do, not
+a replacement.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import (join as pjoin, isdir, basename, getsize)
+import re
+import json
+import zipfile
+try:
+    from urllib2 import urlopen, HTTPError # Python 2
+    from urlparse import urlparse
+except ImportError:
+    from urllib.request import urlopen # Python 3
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse
+
+from .piputils import (get_requirements, canonical_name, parse_specs,
+                       InstallationError)
+
+# URL template for PyPI JSON metadata
+PYPI_JSON_URL = 'https://pypi.org/pypi/{name}/json'
+
+# Requirements that "pip wheel" always fetches for the installer
+INSTALLER_REQS = ('pip', 'setuptools')
+
+# Rough ratio of compressed disk image size to size of files in image.  The
+# files are mostly wheels, which are already compressed.
+DMG_RATIO = 0.98
+
+WHEEL_FNAME_RE = re.compile(
+    r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?'
+    r'-(?P<pyver>[^-]+)-(?P<abi>[^-]+)-(?P<plat>[^-]+)\.whl$')
+
+SDIST_FNAME_RE = re.compile(
+    r'^(?P<name>.+)-(?P<version>[^-]+)\.(tar\.gz|tar\.bz2|tgz|zip)$')
+
+REQUIRES_DIST_RE = re.compile(
+    r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*'
+    r'(\[(?P<extras>[^\]]*)\])?\s*'
+    r'\(?(?P<specs>[^;)]*)\)?\s*'
+    r'(;(?P<marker>.*))?$')
+
+EXTRA_MARKER_RE = re.compile(r'''^\s*extra\s*==\s*['"]([^'"]+)['"]\s*$''')
+
+# Order of pre-release labels (PEP 440).  Other labels sort after these, but
+# before the release.
+PRE_LABELS = {'dev': 0, 'a': 1, 'alpha': 1, 'b': 2, 'beta': 2,
+              'c': 3, 'rc': 3, 'pre': 3, 'preview': 3}
+
+# Post-release labels; these sort after the release
+POST_LABELS = ('post', 'rev', 'r')
+
+
+def version_key(version):
+    """ Return sort key for version string `version`
+
+    A loose ordering good enough for choosing between release versions;
+    development and pre-release suffixes sort before the release, and
+    post-release suffixes sort after the release, but before the next
+    release.
+    """
+    key = []
+    for part in re.findall(r'\d+|[a-zA-Z]+', version):
+        if part.isdigit():
+            key.append((3, int(part), ''))
+        elif part.lower() in POST_LABELS:
+            key.append((2, 0, ''))
+        else:
+            part = part.lower()
+            key.append((0, PRE_LABELS.get(part, len(PRE_LABELS)), part))
+    # Release (no suffix) sorts after pre-releases, before post-releases
+    key.append((1, 0, ''))
+    return tuple(key)
+
+
+def is_prerelease(version):
+    """ True if `version` is a development or pre-release version """
+    return any(part.lower() in PRE_LABELS
+               for part in re.findall(r'[a-zA-Z]+', version))
+
+
+def _trim_zeros(version):
+    """ Return key for `version` ignoring trailing ``.0`` elements """
+    key = list(version_key(version)[:-1])
+    while key and key[-1] == (3, 0, ''):
+        key.pop()
+    return key
+
+
+def version_matches(version, specs):
+    """ True if `version` satisfies all version specifiers in `specs`
+
+    Parameters
+    ----------
+    version : str
+        Version string
+    specs : sequence
+        Sequence of (operator, version) pairs, e.g. ``[('>=', '1.6')]``
+
+    Returns
+    -------
+    tf : bool
+        True if `version` satisfies `specs`
+    """
+    key = version_key(version)
+    for op, spec_version in specs:
+        spec_key = version_key(spec_version)
+        if op in ('==', '==='):
+            if spec_version.endswith('.*'):
+                if not (version + '.').startswith(spec_version[:-1]):
+                    return False
+            elif _trim_zeros(version) != _trim_zeros(spec_version):
+                return False
+        elif op == '!=':
+            if _trim_zeros(version) == _trim_zeros(spec_version):
+                return False
+        elif op == '>=' and not key >= spec_key:
+            return False
+        elif op == '<=' and not key <= spec_key:
+            return False
+        elif op == '>' and not key > spec_key:
+            return False
+        elif op == '<' and not key < spec_key:
+            return False
+        elif op == '~=':
+            prefix = spec_version.split('.')[:-1]
+            if not key >= spec_key or (
+                _trim_zeros(version)[:len(prefix)] !=
+                _trim_zeros('.'.join(prefix))[:len(prefix)]):
+                return False
+    return True
+
+
+def parse_requires_dist(value, extras=()):
+    """ Parse ``Requires-Dist`` value, return name, extras, specs or None
+
+    Parameters
+    ----------
+    value : str
+        ``Requires-Dist`` metadata value
+    extras : sequence, optional
+        Extras requested for the distribution declaring `value`
+
+    Returns
+    -------
+    parsed : None or tuple
+        None if requirement does not apply (the environment marker is
+        anything other than one of the requested `extras`), otherwise tuple
+        of (name, extras, specs)
+    """
+    match = REQUIRES_DIST_RE.match(value)
+    if match is None:
+        return None
+    marker = match.group('marker')
+    if marker is not None:
+        extra_match = EXTRA_MARKER_RE.match(marker)
+        if extra_match is None or not extra_match.group(1) in extras:
+            return None
+    req_extras = match.group('extras')
+    req_extras = ([] if req_extras is None else
+                  [e.strip() for e in req_extras.split(',') if e.strip()])
+    try:
+        specs = parse_specs(match.group('specs'))
+    except InstallationError:
+        return None
+    return match.group('name'), req_extras, specs
+
+
+def parse_wheel_fname(fname):
+    """ Return dict of wheel filename parts, or None if not wheel filename
+    """
+    match = WHEEL_FNAME_RE.match(basename(fname))
+    return None if match is None else match.groupdict()
+
+
+def wheel_compatible(fname, pyv_mm):
+    """ True if wheel `fname` can install into Python.org Python `pyv_mm`
+
+    Parameters
+    ----------
+    fname : str
+        Wheel filename
+    pyv_mm : str
+        Major, minor Python version without dot, e.g "34"
+
+    Returns
+    -------
+    tf : bool
+        True if wheel is compatible
+    """
+    parts = parse_wheel_fname(fname)
+    if parts is None:
+        return False
+    py_ok = ('py' + pyv_mm[0], 'py' + pyv_mm, 'cp' + pyv_mm)
+    if not any(tag in py_ok for tag in parts['pyver'].split('.')):
+        return False
+    if not any(tag in ('none', 'abi3') or tag.startswith('cp' + pyv_mm)
+               for tag in parts['abi'].split('.')):
+        return False
+    return any(tag == 'any' or tag.startswith('macosx')
+               for tag in parts['plat'].split('.'))
+
+
+def wheel_requires(wheel_fname):
+    """ Return ``Requires-Dist`` values from wheel metadata """
+    with zipfile.ZipFile(wheel_fname) as zf:
+        for name in zf.namelist():
+            if name.endswith('.dist-info/METADATA'):
+                metadata = zf.read(name).decode('utf-8', 'replace')
+                break
+        else:
+            return []
+    requires = []
+    for line in metadata.splitlines():
+        if line == '':
+            break
+        if line.startswith('Requires-Dist:'):
+            requires.append(line.split(':', 1)[1].strip())
+    return requires
+
+
+def local_dirs(find_links):
+    """ Return local directories from sequence of find-links `find_links` """
+    dirs = []
+    for link in find_links:
+        parsed = urlparse(link)
+        if parsed.scheme in ('', 'file'):
+            path = parsed.path if parsed.scheme == 'file' else link
+            if isdir(path):
+                dirs.append(path)
+    return dirs
+
+
+def scan_local(dirs):
+    """ Return mapping of canonical name to local wheels, sdists in `dirs`
+
+    Returns
+    -------
+    local : dict
+        Mapping of canonical distribution name to list of (version, kind,
+        filename) tuples, where `kind` is one of "wheel" or "sdist"
+    """
+    local = {}
+    for dir_path in dirs:
+        for fname in sorted(os.listdir(dir_path)):
+            path = pjoin(dir_path, fname)
+            parts = parse_wheel_fname(fname)
+            if parts is not None:
+                kind = 'wheel'
+            else:
+                parts = SDIST_FNAME_RE.match(fname)
+                if parts is None:
+                    continue
+                parts = parts.groupdict()
+                kind = 'sdist'
+            local.setdefault(canonical_name(parts['name']), []).append(
+                (parts['version'], kind, path))
+    return local
+
+
+def fetch_pypi_json(name, version=None):
+    """ Return PyPI JSON metadata for `name`, or None if not on PyPI """
+    url = PYPI_JSON_URL.format(name=name)
+    if version is not None:
+        url = url[:-len('json')] + version + '/json'
+    try:
+        url_obj = urlopen(url)
+    except HTTPError:
+        return None
+    return json.loads(url_obj.read().decode('utf-8'))
+
+
+class BuildPlanner(object):
+    """ Work out what a build of a :class:`PkgWriter` will need
+    """
+
+    def __init__(self, pkg_writer, fetch_json=None):
+        """ Initialize planner
+
+        Parameters
+        ----------
+        pkg_writer : :class:`PkgWriter` instance
+            Writer for build we are planning
+        fetch_json : None or callable, optional
+            Callable accepting a distribution name and optional version,
+            returning PyPI-style JSON metadata dictionary, or None if the
+            index does not have the distribution.  If None, use
+            :func:`fetch_pypi_json`, unless the build does not use an index,
+            or uses an index other than PyPI.
+        """
+        self.pkg_writer = pkg_writer
+        args = pkg_writer.pip_parser.parse_args(pkg_writer.pip_params)
+        self.args = args
+        if fetch_json is None and not args.no_index and args.index_url is None:
+            fetch_json = fetch_pypi_json
+        self.fetch_json = fetch_json
+        find_links = [] if args.find_links is None else args.find_links
+        dirs = local_dirs(find_links)
+        self.cache_dirs = [d for d in dirs + [pkg_writer.wheel_build_dir]
+                           if isdir(d)]
+        self.local = scan_local(self.cache_dirs)
+        # Read the catalog, but do not update it; planning writes nothing
+        self.catalog = pkg_writer.catalog
+        self.history = pkg_writer.history
+
+    def _wheel_requires(self, wheel_fname):
+        """ Return ``Requires-Dist`` values for local wheel `wheel_fname`
+        """
+        if not self.catalog is None:
+            record = self.catalog.get(wheel_fname, current=True)
+            if not record is None:
+                return record['requires']
+        return wheel_requires(wheel_fname)
+
+    def _from_local(self, key, specs):
+        """ Return best local (version, kind, path) for `key`, or None """
+        pyv_mm = self.pkg_writer.pyv_mm
+        candidates = [(version_key(version), kind == 'wheel', version, kind,
+                       path)
+                      for version, kind, path in self.local.get(key, [])
+                      if version_matches(version, specs) and
+                      (kind == 'sdist' or wheel_compatible(path, pyv_mm))]
+        if len(candidates) == 0:
+            return None
+        return max(candidates)[2:]
+
+    def _from_index(self, name, specs):
+        """ Return (version, kind, url, size, requires) from index, or None
+
+        As for pip, we only choose a pre-release if a specifier names a
+        pre-release, or no other release matches.  We skip yanked files
+        unless a specifier pins their version with ``==`` or ``===``.
+        """
+        if self.fetch_json is None:
+            return None
+        info = self.fetch_json(name)
+        if info is None:
+            return None
+        pyv_mm = self.pkg_writer.pyv_mm
+        releases = info.get('releases', {})
+        versions = sorted(releases, key=version_key, reverse=True)
+        if not any(is_prerelease(v) for op, v in specs):
+            versions = ([v for v in versions if not is_prerelease(v)] +
+                        [v for v in versions if is_prerelease(v)])
+        pinned = any(op in ('==', '===') and not v.endswith('.*')
+                     for op, v in specs)
+        for version in versions:
+            if not version_matches(version, specs):
+                continue
+            files = [f for f in releases[version]
+                     if pinned or not f.get('yanked', False)]
+            wheels = [f for f in files
+                      if f['packagetype'] == 'bdist_wheel' and
+                      wheel_compatible(f['filename'], pyv_mm)]
+            sdists = [f for f in files if f['packagetype'] == 'sdist']
+            if wheels:
+                kind, chosen = 'wheel', wheels[0]
+            elif sdists:
+                kind, chosen = 'sdist', sdists[0]
+            else:
+                continue
+            if version != info['info']['version']:
+                version_info = self.fetch_json(name, version)
+                if not version_info is None:
+                    info = version_info
+            requires = info['info'].get('requires_dist') or []
+            return version, kind, chosen['url'], chosen['size'], requires
+        return None
+
+    def plan_requirement(self, name, extras, specs):
+        """ Return plan for one requirement, and its dependencies
+
+        Returns
+        -------
+        entry : dict
+            Plan for requirement
+        requires : list
+            ``Requires-Dist`` values for chosen distribution
+        """
+        writer = self.pkg_writer
+        entry = dict(name=name, extras=sorted(extras),
+                     specs=[''.join(s) for s in specs])
+        local = self._from_local(canonical_name(name), specs)
+        if local is not None:
+            version, kind, path = local
+            entry.update(version=version, source=path,
+                         size=getsize(path), cached=True)
+            requires = self._wheel_requires(path) if kind == 'wheel' else []
+        else:
+            remote = self._from_index(name, specs)
+            if remote is None:
+                entry.update(version=None, source=None, size=None,
+                             cached=False, action='unknown',
+                             needs_delocate=False)
+                return entry, []
+            version, kind, url, size, requires = remote
+            entry.update(version=version, source=url, size=size,
+                         cached=False)
+        entry['action'] = 'compile' if kind == 'sdist' else 'download'
+        # Compiled wheels, and downloaded wheels with the 10.6 intel platform
+        # tag, go through the delocate / retag post-processing
+        platform_wheel = kind == 'wheel' and '-macosx_10_6_intel' in (
+            entry['source'])
+        entry['needs_delocate'] = writer.delocate_wheels and (
+            kind == 'sdist' or platform_wheel)
+        if (platform_wheel and local is not None and
+            writer.delocate_cache is not None):
+            key = writer.delocate_key(entry['source'])
+            entry['delocate_cached'] = isdir(writer.delocate_cache.key_path(
+                key))
+        return entry, requires
+
+    def plan(self):
+        """ Return plan for build as dictionary
+        """
+        writer = self.pkg_writer
+        args = self.args
+        req_set = get_requirements(args.req_specs, args.requirement)
+        todo = [(name, [], []) for name in INSTALLER_REQS]
+        for req in req_set.requirements.values():
+            if req.applies(writer.marker_environment):
+                todo.append((req.name, list(req.extras), list(req.specs)))
+        wheels = []
+        seen = set()
+        while todo:
+            name, extras, specs = todo.pop(0)
+            key = canonical_name(name)
+            if key in seen:
+                continue
+            seen.add(key)
+            entry, requires = self.plan_requirement(name, extras, specs)
+            wheels.append(entry)
+            for value in requires:
+                parsed = parse_requires_dist(value, extras)
+                if not parsed is None:
+                    todo.append(parsed)
+        sizes = [w['size'] for w in wheels if w['size'] is not None]
+        wheelhouse_size = sum(sizes)
+        n_cached = sum(w['cached'] for w in wheels)
+        times = (None if self.history is None else
+                 self.history.estimate(writer.pkg_name, writer.pyv_mm))
+        return dict(
+            pkg_name=writer.pkg_name,
+            pkg_version=writer.pkg_version,
+            python_version=writer.pyv_m_m_e,
+            wheels=wheels,
+            n_download=sum(w['action'] == 'download' for w in wheels),
+            n_compile=sum(w['action'] == 'compile' for w in wheels),
+            n_unknown=sum(w['action'] == 'unknown' for w in wheels),
+            n_delocate=sum(w['needs_delocate'] for w in wheels),
+            cache_hit_ratio=(n_cached / len(wheels) if wheels else 0.),
+            wheelhouse_size=wheelhouse_size,
+            dmg_size=int(wheelhouse_size * DMG_RATIO),
+            time_estimate=times)
+
+
+def plan_build(pkg_writer, fetch_json=None):
+    """ Return plan for build of `pkg_writer` as dictionary
+
+    See :class:`BuildPlanner` for parameters.
+    """
+    return BuildPlanner(pkg_writer, fetch_json).plan()
@@ -0,0 +1,234 @@
+""" Run external commands, recording time and resource use
+"""
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from subprocess import Popen, PIPE, STDOUT, CalledProcessError
+
+from .events import COMMAND_START, COMMAND_END
+
+# Number of lines of command output to keep in each record
+TAIL_LINES = 20
+
+
+def _exit_code(status):
+    """ Return Popen-style return code from ``wait`` `status` """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _rss_bytes(max_rss):
+    """ Return ``ru_maxrss`` value `max_rss` in bytes
+
+    Darwin reports bytes, other unices report kilobytes.
+    """
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class CommandRecord(object):
+    """ Record of one external command run
+    """
+
+    def __init__(self, cmd, returncode, start_time, wall_time,
+                 user_time, sys_time, max_rss, output_tail):
+        """ Initialize command record
+
+        Parameters
+        ----------
+        cmd : list
+            Command and arguments
+        returncode : int
+            Exit code of command; negative for termination by signal
+        start_time : float
+            Time at which command started, in seconds since the epoch
+        wall_time : float
+            Elapsed wall clock time in seconds
+        user_time : float
+            User CPU time in seconds
+        sys_time : float
+            System CPU time in seconds
+        max_rss : int
+            Maximum resident set size of command in bytes
+        output_tail : str
+            Last lines of combined stdout and stderr from command
+        """
+        self.cmd = list(cmd)
+        self.returncode = returncode
+        self.start_time = start_time
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.sys_time = sys_time
+        self.max_rss = max_rss
+        self.output_tail = output_tail
+
+    @property
+    def name(self):
+        """ Base name of command executable """
+        return os.path.basename(self.cmd[0])
+
+    def as_dict(self):
+        """ Return record as dictionary, for JSON serialization """
+        return dict(cmd=self.cmd,
+                    returncode=self.returncode,
+                    start_time=self.start_time,
+                    wall_time=self.wall_time,
+                    user_time=self.user_time,
+                    sys_time=self.sys_time,
+                    max_rss=self.max_rss,
+                    output_tail=self.output_tail)
+
+
+class CommandRunner(object):
+    """ Run external commands, keeping a record of each run
+
+    Each run gives a :class:`CommandRecord` with the wall time, CPU time and
+    maximum resident memory of the command, from the ``rusage`` of the child
+    process.  We pass the command output through to our own stdout, and keep
+    the last few lines of output in the record.
+    """
+
+    def __init__(self, log_fname=None, echo=True, tail_lines=TAIL_LINES,
+                 events=None):
+        """ Initialize command runner
+
+        Parameters
+        ----------
+        log_fname : None or str, optional
+            If not None, filename to which to append one JSON line per command
+            record
+        echo : bool, optional
+            If True, write command output to our stdout as it arrives
+        tail_lines : int, optional
+            Number of lines of command output to keep in each record
+        events : None or :class:`EventEmitter` instance, optional
+            If not None, emit events for the start and end of each command.
+            Cancelling the events stops running commands, and raises
+            :class:`BuildCancelled` from :meth:`check_call`.
+        """
+        self.log_fname = log_fname
+        self.echo = echo
+        self.tail_lines = tail_lines
+        self.events = events
+        self.records = []
+        self._lock = threading.Lock()
+
+    def run(self, cmd, cwd=None, env=None, output_fname=None):
+        """ Run command `cmd`, return record of run
+
+        Parameters
+        ----------
+        cmd : sequence
+            Command and arguments
+        cwd : None or str, optional
+            Directory in which to run command
+        env : None or dict, optional
+            Environment for command.  None means use our environment.
+        output_fname : None or str, optional
+            If not None, filename to which to write all command output.  We
+            don't echo the output to stdout in this case.
+
+        Returns
+        -------
+        record : :class:`CommandRecord` instance
+            Record of command run
+        """
+        events = self.events
+        if not events is None:
+            events.check()
+            events.emit(COMMAND_START, cmd=list(cmd))
+        tail = deque(maxlen=self.tail_lines)
+        start = time.time()
+        proc = Popen(cmd, cwd=cwd, env=env, stdout=PIPE, stderr=STDOUT)
+        if not events is None:
+            events.add_on_cancel(proc.terminate)
+        out_fobj = (None if output_fname is None
+                    else open(output_fname, 'wt'))
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                line = line.decode('utf-8', 'replace')
+                tail.append(line)
+                if not out_fobj is None:
+                    out_fobj.write(line)
+                elif self.echo:
+                    with self._lock:
+                        sys.stdout.write(line)
+                        sys.stdout.flush()
+        finally:
+            if not out_fobj is None:
+                out_fobj.close()
+            # Before we reap the process, so we cannot signal a new process
+            # with the same pid
+            if not events is None:
+                events.remove_on_cancel(proc.terminate)
+        proc.stdout.close()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = _exit_code(status)
+        record = CommandRecord(cmd,
+                               proc.returncode,
+                               start,
+                               time.time() - start,
+                               rusage.ru_utime,
+                               rusage.ru_stime,
+                               _rss_bytes(rusage.ru_maxrss),
+                               ''.join(tail))
+        with self._lock:
+            self.records.append(record)
+            if not self.log_fname is None:
+                with open(self.log_fname, 'at') as fobj:
+                    fobj.write(json.dumps(record.as_dict()) + '\n')
+        if not events is None:
+            events.emit(COMMAND_END, cmd=record.cmd,
+                        returncode=record.returncode,
+                        wall_time=record.wall_time)
+        return record
+
+    def check_call(self, cmd, cwd=None, env=None, output_fname=None):
+        """ Run command `cmd`, raise error for non-zero exit code
+
+        Parameters as for :meth:`run`.
+
+        Returns
+        -------
+        record : :class:`CommandRecord` instance
+            Record of command run
+
+        Raises
+        ------
+        CalledProcessError
+            If command exits with non-zero exit code
+        BuildCancelled
+            If someone cancelled our ``events`` while the command ran
+        """
+        record = self.run(cmd, cwd, env, output_fname)
+        if not self.events is None:
+            self.events.check()
+        if record.returncode != 0:
+            raise CalledProcessError(record.returncode, cmd,
+                                     record.output_tail)
+        return record
+
+    def summary(self):
+        """ Return totals of command resource use by command name
+
+        Returns
+        -------
+        summary : dict
+            Mapping of command name to dict with number of ``calls``, total
+            ``wall_time``, ``user_time``, ``sys_time`` and largest ``max_rss``
+        """
+        summary = {}
+        for record in self.records:
+            totals = summary.setdefault(record.name, dict(
+                calls=0, wall_time=0., user_time=0., sys_time=0., max_rss=0))
+            totals['calls'] += 1
+            totals['wall_time'] += record.wall_time
+            totals['user_time'] += record.user_time
+            totals['sys_time'] += record.sys_time
+            totals['max_rss'] = max(totals['max_rss'], record.max_rss)
+        return summary
@@ -0,0 +1,314 @@
+""" Run builds in parallel, in order of build-time dependencies
+"""
+from __future__ import division, print_function
+
+import re
+import tarfile
+import zipfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .piputils import canonical_name
+
+# Packages that need other packages installed to build from source, by
+# canonical name.  We build the dependencies first, so the build can use the
+# dependency wheels.  We only use these for sdists that do not declare their
+# build requirements (see :func:`sdist_build_requires`).
+BUILD_DEPENDS = {
+    'scipy': ('numpy',),
+    'pandas': ('numpy',),
+    'matplotlib': ('numpy',),
+    'h5py': ('numpy',),
+    'numexpr': ('numpy',),
+    'tables': ('numpy', 'numexpr'),
+    'astropy': ('numpy',),
+    'scikit-learn': ('numpy', 'scipy'),
+    'scikit-image': ('numpy', 'scipy'),
+    'statsmodels': ('numpy', 'scipy', 'pandas'),
+}
+
+
+# Files in the sdist top-level directory declaring build requirements
+BUILD_REQ_FILES = ('pyproject.toml', 'setup.cfg', 'setup.py')
+
+# Requirement list in ``[build-system]`` of ``pyproject.toml``, and
+# ``setup_requires`` list in ``setup.py``
+PYPROJECT_REQUIRES_RE = re.compile(r'^requires\s*=\s*\[(.*?)\]',
+                                   re.DOTALL | re.MULTILINE)
+SETUP_PY_REQUIRES_RE = re.compile(r'\bsetup_requires\s*=\s*[\[(](.*?)[\])]',
+                                  re.DOTALL)
+QUOTED_RE = re.compile(r'''(['"])(.*?)\1''')
+REQ_NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+
+class BuildError(Exception):
+    """ Error for one or more failed builds
+
+    Attribute ``errors`` is a dict mapping name of failed build to the
+    error it raised; ``skipped`` is a list of names of builds we did not run
+    because a build they depend on failed.
+    """
+
+    def __init__(self, errors, skipped):
+        self.errors = errors
+        self.skipped = skipped
+        msg = 'Failed builds: ' + ', '.join(sorted(errors))
+        if skipped:
+            msg += '; not built: ' + ', '.join(sorted(skipped))
+        super(BuildError, self).__init__(msg)
+
+
+def _section(text, name):
+    """ Return lines of section `name` from TOML or INI file `text` """
+    lines, in_section = [], False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('['):
+            in_section = stripped == '[{0}]'.format(name)
+            continue
+        if in_section:
+            lines.append(line)
+    return lines
+
+
+def _req_names(req_strs):
+    """ Return canonical names from requirement strings `req_strs` """
+    names = []
+    for req_str in req_strs:
+        match = REQ_NAME_RE.match(req_str)
+        if not match is None:
+            names.append(canonical_name(match.group(1)))
+    return names
+
+
+def _pyproject_requires(text):
+    lines = [line.split('#')[0] for line in _section(text, 'build-system')]
+    match = PYPROJECT_REQUIRES_RE.search('\n'.join(lines))
+    if match is None:
+        return None
+    return _req_names(q[1] for q in QUOTED_RE.findall(match.group(1)))
+
+
+def _setup_cfg_requires(text):
+    lines = _section(text, 'options')
+    for i, line in enumerate(lines):
+        key, sep, value = line.partition('=')
+        if not sep or key.strip() != 'setup_requires':
+            continue
+        values = [value]
+        for line in lines[i + 1:]:
+            if not line[:1].isspace():
+                break
+            values.append(line)
+        return _req_names(v for value in values
+                          for v in value.split(';') if v.strip())
+    return None
+
+
+def _setup_py_requires(text):
+    match = SETUP_PY_REQUIRES_RE.search(text)
+    if match is None:
+        return None
+    return _req_names(q[1] for q in QUOTED_RE.findall(match.group(1)))
+
+
+def _read_sdist_files(sdist_fname, names):
+    """ Return dict of contents for files `names` in sdist top directory """
+    contents = {}
+    if sdist_fname.endswith('.zip'):
+        with zipfile.ZipFile(sdist_fname) as zf:
+            for path in zf.namelist():
+                parts = path.split('/')
+                if len(parts) == 2 and parts[1] in names:
+                    contents[parts[1]] = zf.read(path)
+    else:
+        with tarfile.open(sdist_fname) as tf:
+            for info in tf:
+                parts = info.name.split('/')
+                if len(parts) == 2 and parts[1] in names and info.isfile():
+                    contents[parts[1]] = tf.extractfile(info).read()
+    return dict((name, value.decode('utf-8', 'replace'))
+                for name, value in contents.items())
+
+
+def sdist_build_requires(sdist_fname):
+    """ Return names of packages that sdist `sdist_fname` needs to build
+
+    Read ``build-system.requires`` from ``pyproject.toml``, and
+    ``setup_requires`` from ``setup.cfg`` and from literal lists in
+    ``setup.py``.
+
+    Parameters
+    ----------
+    sdist_fname : str
+        Filename of sdist (``.tar.gz``, ``.tar.bz2``, ``.tgz`` or ``.zip``)
+
+    Returns
+    -------
+    names : None or list
+        Sorted canonical names of packages needed at build time, or None if
+        the sdist does not declare its build requirements
+    """
+    try:
+        files = _read_sdist_files(sdist_fname, BUILD_REQ_FILES)
+    except (tarfile.TarError, zipfile.BadZipfile, IOError):
+        return None
+    found = [parse(files[fname]) for fname, parse in (
+        ('pyproject.toml', _pyproject_requires),
+        ('setup.cfg', _setup_cfg_requires),
+        ('setup.py', _setup_py_requires)) if fname in files]
+    found = [names for names in found if not names is None]
+    if len(found) == 0:
+        return None
+    return sorted(set(name for names in found for name in names))
+
+
+def sdist_build_depends(sdists, depends=None):
+    """ Return build dependencies for `sdists`, from the sdists themselves
+
+    Parameters
+    ----------
+    sdists : dict
+        Mapping of canonical package name to sdist filename
+    depends : None or dict, optional
+        Mapping of package name to names of packages needed at build time,
+        for sdists that do not declare their build requirements, and for
+        dependencies that are not in `sdists`.  None means use
+        ``BUILD_DEPENDS``.
+
+    Returns
+    -------
+    all_depends : dict
+        `depends`, updated with build requirements read from `sdists`
+    """
+    all_depends = dict(BUILD_DEPENDS if depends is None else depends)
+    for name, sdist_fname in sdists.items():
+        requires = sdist_build_requires(sdist_fname)
+        if not requires is None:
+            all_depends[name] = tuple(req for req in requires if req != name)
+    return all_depends
+
+
+def build_depends(names, depends=None):
+    """ Return dependencies within `names` for each name in `names`
+
+    Parameters
+    ----------
+    names : sequence
+        Names of packages to build
+    depends : None or dict, optional
+        Mapping of package name to sequence of names of packages needed at
+        build time.  None means use ``BUILD_DEPENDS``.
+
+    Returns
+    -------
+    name_depends : dict
+        Mapping of each name in `names` to set of names from `names` that it
+        depends on, directly or via packages not in `names`.
+
+    Raises
+    ------
+    ValueError
+        If the dependencies have a cycle
+    """
+    depends = BUILD_DEPENDS if depends is None else depends
+    names = set(names)
+
+    def all_depends(name, path):
+        found = set()
+        for dep in depends.get(name, ()):
+            if dep in path:
+                raise ValueError('Build dependency cycle: ' +
+                                 ' -> '.join(path + (dep,)))
+            found.add(dep)
+            found |= all_depends(dep, path + (dep,))
+        return found
+
+    return dict((name, all_depends(name, (name,)) & names) for name in names)
+
+
+def build_order(names, depends=None):
+    """ Return `names` sorted so each name comes after its dependencies
+
+    Names with no dependency relationship stay in sorted order.  Parameters
+    as for :func:`build_depends`.
+    """
+    name_depends = build_depends(names, depends)
+    ordered = []
+    while len(ordered) < len(name_depends):
+        ordered += sorted(name for name, deps in name_depends.items()
+                          if not name in ordered and deps <= set(ordered))
+    return ordered
+
+
+def run_builds(builds, run_build, n_workers, depends=None):
+    """ Run builds in parallel, each after the builds it depends on
+
+    Parameters
+    ----------
+    builds : dict
+        Mapping of package name to argument for `run_build`
+    run_build : callable
+        Function called as ``run_build(name, arg)`` to run one build
+    n_workers : int
+        Maximum number of builds to run at the same time
+    depends : None or dict, optional
+        Mapping of package name to names of packages needed at build time.
+        None means use ``BUILD_DEPENDS``.
+
+    Returns
+    -------
+    results : dict
+        Mapping of package name to return value from `run_build`
+
+    Raises
+    ------
+    BuildError
+        If any build raised an error.  We run all builds that do not depend
+        on a failed build before raising.
+    """
+    # Dependencies are transitive, so builds after a failed build are skipped
+    # on the first pass after the failure
+    waiting = build_depends(builds, depends)
+    results, errors, skipped = {}, {}, []
+    finished = threading.Condition()
+    n_running = [0]
+
+    def run_one(name):
+        try:
+            result = run_build(name, builds[name])
+        except Exception as err:
+            result, error = None, err
+        else:
+            error = None
+        with finished:
+            if error is None:
+                results[name] = result
+            else:
+                errors[name] = error
+            n_running[0] -= 1
+            finished.notify()
+
+    pool = ThreadPool(max(1, min(n_workers, len(builds))))
+    try:
+        with finished:
+            while waiting or n_running[0]:
+                done = set(results)
+                failed = set(errors) | set(skipped)
+                for name in sorted(waiting):
+                    deps = waiting[name]
+                    if deps & failed:
+                        skipped.append(name)
+                        del waiting[name]
+                    elif deps <= done:
+                        del waiting[name]
+                        n_running[0] += 1
+                        pool.apply_async(run_one, (name,))
+                if n_running[0]:
+                    finished.wait()
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise BuildError(errors, skipped)
+    return results
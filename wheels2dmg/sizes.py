@@ -0,0 +1,247 @@
+""" Break down the size of the disk image contents
+
+We read the sizes of wheel members from the zip central directory of each
+wheel, so we do not need to extract or decompress anything.  We attribute
+the compressed and uncompressed bytes of each member to its wheel, its
+top-level package and its file type.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import join as pjoin, relpath, getsize, basename
+import re
+import zipfile
+from collections import defaultdict
+
+from .dedup import LIB_SDIR
+
+# File types, in the order we check them.  "grafted" are libraries that
+# delocate copied into the wheel; "tests" are files in test directories.
+FILE_TYPES = ('grafted', 'metadata', 'tests', 'so', 'dylib', 'py', 'data')
+
+# Directory names for test files
+TEST_DIRS = ('test', 'tests', 'testing')
+
+# Sizes as <number><suffix>, with optional suffix in powers of 1024
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)([KMGT]?)B?$', re.IGNORECASE)
+SIZE_SUFFIXES = {'': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4}
+
+
+class SizeBudgetError(Exception):
+    """ Error for disk image contents over size budget """
+
+
+def parse_size(size_str):
+    """ Return number of bytes from string such as "600M" or "1.5G"
+
+    Suffixes K, M, G, T are powers of 1024.
+
+    Raises
+    ------
+    ValueError
+        If `size_str` is not a valid size
+    """
+    match = SIZE_RE.match(size_str.strip())
+    if match is None:
+        raise ValueError('Invalid size "{0}"'.format(size_str))
+    number, suffix = match.groups()
+    return int(float(number) * 1024 ** SIZE_SUFFIXES[suffix.upper()])
+
+
+def file_type(path):
+    """ Return file type from ``FILE_TYPES`` for path `path` in wheel """
+    parts = path.split('/')
+    if LIB_SDIR in parts[:-1]:
+        return 'grafted'
+    if parts[0].endswith('.dist-info'):
+        return 'metadata'
+    if any(part in TEST_DIRS for part in parts[:-1]):
+        return 'tests'
+    ext = os.path.splitext(parts[-1])[1]
+    if ext in ('.so', '.pyd'):
+        return 'so'
+    if ext == '.dylib':
+        return 'dylib'
+    if ext in ('.py', '.pyc', '.pyo'):
+        return 'py'
+    return 'data'
+
+
+def top_level(path):
+    """ Return top-level package or module for path `path` in wheel
+
+    Files in ``.data`` directories belong to the package under the install
+    scheme (e.g. ``purelib``), or to the scheme itself (e.g. ``scripts``).
+    """
+    parts = path.split('/')
+    if parts[0].endswith('.data') and len(parts) > 2:
+        if parts[1] in ('purelib', 'platlib') and len(parts) > 3:
+            parts = parts[2:]
+        else:
+            return parts[0] + '/' + parts[1]
+    return parts[0] if len(parts) > 1 else os.path.splitext(parts[0])[0]
+
+
+def _sizes():
+    return dict(compressed=0, uncompressed=0)
+
+
+def _add(sizes, info):
+    sizes['compressed'] += info.compress_size
+    sizes['uncompressed'] += info.file_size
+
+
+def wheel_sizes(wheel_fname):
+    """ Return size breakdown for wheel `wheel_fname`
+
+    Returns
+    -------
+    sizes : dict
+        Dictionary with ``size`` (bytes on disk), ``compressed`` and
+        ``uncompressed`` (total of member sizes), ``packages`` and ``types``
+        (dicts mapping top-level package and file type to dict of
+        ``compressed``, ``uncompressed`` sizes), and ``grafted`` (dict mapping
+        library name to ``compressed``, ``uncompressed`` dict).
+    """
+    totals = _sizes()
+    packages = defaultdict(_sizes)
+    types = defaultdict(_sizes)
+    grafted = defaultdict(_sizes)
+    with zipfile.ZipFile(wheel_fname) as zf:
+        for info in zf.infolist():
+            if info.filename.endswith('/'):
+                continue
+            kind = file_type(info.filename)
+            _add(totals, info)
+            _add(packages[top_level(info.filename)], info)
+            _add(types[kind], info)
+            if kind == 'grafted':
+                _add(grafted[basename(info.filename)], info)
+    totals.update(size=getsize(wheel_fname),
+                  packages=dict(packages),
+                  types=dict(types),
+                  grafted=dict(grafted))
+    return totals
+
+
+def size_report(root_dir):
+    """ Return size breakdown for files in directory `root_dir`
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory containing disk image contents
+
+    Returns
+    -------
+    report : dict
+        Dictionary with ``total`` (bytes of all files), ``wheels`` (dict
+        mapping wheel path relative to `root_dir` to :func:`wheel_sizes`
+        output), ``types`` (dict mapping file type to ``compressed``,
+        ``uncompressed`` dict, for all wheels), ``grafted`` (dict mapping
+        grafted library name to dict with ``compressed``, ``uncompressed``
+        and number of ``copies``), and ``other`` (dict mapping path of each
+        file that is not a wheel to its size).
+    """
+    total = 0
+    wheels = {}
+    other = {}
+    types = defaultdict(_sizes)
+    grafted = defaultdict(lambda: dict(_sizes(), copies=0))
+    for root, dirs, files in os.walk(root_dir):
+        for fname in files:
+            path = pjoin(root, fname)
+            rel_path = relpath(path, root_dir)
+            size = getsize(path)
+            total += size
+            if not fname.endswith('.whl'):
+                other[rel_path] = size
+                continue
+            sizes = wheels[rel_path] = wheel_sizes(path)
+            for kind, kind_sizes in sizes['types'].items():
+                for key in ('compressed', 'uncompressed'):
+                    types[kind][key] += kind_sizes[key]
+            for name, lib_sizes in sizes['grafted'].items():
+                for key in ('compressed', 'uncompressed'):
+                    grafted[name][key] += lib_sizes[key]
+                grafted[name]['copies'] += 1
+    return dict(total=total,
+                wheels=wheels,
+                types=dict(types),
+                grafted=dict(grafted),
+                other=other)
+
+
+def format_bytes(n_bytes):
+    """ Return human-readable string for `n_bytes`, e.g. "1.5 MB" """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n_bytes) < 1024 or unit == 'GB':
+            break
+        n_bytes /= 1024
+    return ('{0:.0f} {1}' if unit == 'B' else '{0:.1f} {1}').format(
+        n_bytes, unit)
+
+
+def format_size_report(report, n_top=10):
+    """ Return text summary of `report` from :func:`size_report`
+
+    Parameters
+    ----------
+    report : dict
+        Output from :func:`size_report`
+    n_top : int, optional
+        Number of largest wheels and packages to list
+
+    Returns
+    -------
+    summary : str
+        Text summary
+    """
+    lines = ['Total: ' + format_bytes(report['total']), '']
+
+    def table(title, rows):
+        lines.append('{0:<40} {1:>12} {2:>12}'.format(
+            title, 'compressed', 'uncompressed'))
+        for name, sizes in rows:
+            lines.append('{0:<40} {1:>12} {2:>12}'.format(
+                name, format_bytes(sizes['compressed']),
+                format_bytes(sizes['uncompressed'])))
+        lines.append('')
+
+    def largest(items):
+        return sorted(items, key=lambda item: (-item[1]['compressed'],
+                                               item[0]))[:n_top]
+
+    table('Wheels', largest(report['wheels'].items()))
+    packages = defaultdict(_sizes)
+    for sizes in report['wheels'].values():
+        for name, package_sizes in sizes['packages'].items():
+            for key in ('compressed', 'uncompressed'):
+                packages[name][key] += package_sizes[key]
+    table('Packages', largest(packages.items()))
+    table('File types', largest(report['types'].items()))
+    if report['grafted']:
+        table('Grafted libraries',
+              [('{0} (x{1})'.format(name, sizes['copies']), sizes)
+               for name, sizes in largest(report['grafted'].items())])
+    if report['other']:
+        lines.append('Other files')
+        lines += ['{0:<40} {1:>12}'.format(path, format_bytes(size))
+                  for path, size in sorted(report['other'].items())]
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def check_budget(report, budget):
+    """ Raise SizeBudgetError if `report` total is over `budget` bytes
+    """
+    if report['total'] <= budget:
+        return
+    raise SizeBudgetError(
+        'Disk image contents {0} over budget of {1}; largest wheels:\n'
+        '{2}'.format(format_bytes(report['total']), format_bytes(budget),
+                     '\n'.join(
+                         '{0}: {1}'.format(path, format_bytes(sizes['size']))
+                         for path, sizes in sorted(
+                             report['wheels'].items(),
+                             key=lambda item: -item[1]['size'])[:5])))
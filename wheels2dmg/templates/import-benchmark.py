@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Time imports of {{ info.pkg_name }} packages after install
+# vim ft:python
+""" Time imports of installed {{ info.pkg_name }} packages
+
+Import each top-level module in a fresh Python process.  The first import
+after install is "cold" (Python may write ``.pyc`` files, and the files may
+not be in the disk cache); we then import again several times, and record
+the fastest as the "warm" time.  We also time the start of Python itself,
+which includes running any ``.pth`` files in ``site-packages``.
+
+Write a JSON report.  With ``--baseline``, compare warm times to a report
+from a previous install, and exit with an error if any got slower by more
+than ``--tolerance``.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import json
+import platform
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+
+PKG_NAME_VERSION = '{{ info.pkg_name_version }}'
+DEFAULT_PYTHON = ('{{ info.py_org_base }}/{{ info.pyv_m_m }}/bin/'
+                  'python{{ info.pyv_m_m }}')
+MODULES = {{ info.import_names() }}
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Timer code to run in fresh Python process
+TIME_CODE = """\
+import time
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+{0}
+print(repr(timer() - start))
+"""
+
+
+def time_code(python, code):
+    """ Return seconds to run `code` in new process, or error message """
+    proc = Popen([python, '-c', TIME_CODE.format(code)],
+                 stdout=PIPE, stderr=PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        lines = err.decode('utf-8', 'replace').strip().splitlines()
+        return None, lines[-1] if lines else 'exit code {0}'.format(
+            proc.returncode)
+    return float(out.decode('ascii').strip().splitlines()[-1]), None
+
+
+def time_command(python, code, repeat):
+    """ Return dict with cold and warm times for `code`, and any error """
+    cold, error = time_code(python, code)
+    if not error is None:
+        return dict(cold=None, warm=None, error=error)
+    warm = None
+    for i in range(repeat):
+        seconds, error = time_code(python, code)
+        if not error is None:
+            return dict(cold=cold, warm=None, error=error)
+        warm = seconds if warm is None else min(warm, seconds)
+    return dict(cold=cold, warm=warm, error=None)
+
+
+def time_start(python, repeat):
+    """ Return cold and warm times for Python start, in seconds """
+    times = []
+    for i in range(repeat + 1):
+        start = timer()
+        proc = Popen([python, '-c', 'pass'], stdout=PIPE, stderr=PIPE)
+        proc.communicate()
+        times.append(timer() - start)
+    return dict(cold=times[0], warm=min(times[1:]), error=None)
+
+
+def regressions(report, baseline, tolerance):
+    """ Return list of messages for warm times slower than `baseline` """
+    messages = []
+    items = [('python start', report['start'], baseline.get('start'))]
+    items += [(name, times, baseline.get('modules', {}).get(name))
+              for name, times in sorted(report['modules'].items())]
+    for name, times, base in items:
+        if base is None or base.get('warm') is None:
+            continue
+        if times['warm'] is None:
+            messages.append('{0}: import failed: {1}'.format(
+                name, times['error']))
+        elif times['warm'] > base['warm'] * tolerance:
+            messages.append('{0}: {1:.3f}s, was {2:.3f}s'.format(
+                name, times['warm'], base['warm']))
+    return messages
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--python', default=DEFAULT_PYTHON,
+                        help='Python to test (default {0})'.format(
+                            DEFAULT_PYTHON))
+    parser.add_argument('--out', default='import-benchmark.json',
+                        help='Filename for JSON report (default '
+                        '"import-benchmark.json")')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of warm imports to time (default 5)')
+    parser.add_argument('--baseline',
+                        help='JSON report from previous install to compare')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Fail if warm times are more than this many '
+                        'times the baseline (default 1.5)')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    report = dict(bundle=PKG_NAME_VERSION,
+                  python=args.python,
+                  platform=platform.platform(),
+                  start=time_start(args.python, args.repeat),
+                  modules={})
+    for name in MODULES:
+        report['modules'][name] = times = time_command(
+            args.python, 'import ' + name, args.repeat)
+        if times['error'] is None:
+            print('{0}: cold {1:.3f}s, warm {2:.3f}s'.format(
+                name, times['cold'], times['warm']))
+        else:
+            print('{0}: {1}'.format(name, times['error']))
+    with open(args.out, 'wt') as fobj:
+        json.dump(report, fobj, indent=2, sort_keys=True)
+    failed = [name for name, times in report['modules'].items()
+              if not times['error'] is None]
+    if not args.baseline is None:
+        with open(args.baseline, 'rt') as fobj:
+            slower = regressions(report, json.load(fobj), args.tolerance)
+        if slower:
+            print('Slower than baseline:\n' + '\n'.join(slower))
+            sys.exit(2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+""" Testing catalog module
+"""
+
+import os
+import json
+import zipfile
+from os.path import join as pjoin, abspath
+
+from ..catalog import (WheelCatalog, read_wheel_info, read_top_level,
+                       WheelInfoError)
+from ..tmpdirs import InTemporaryDirectory
+from .wheelmaker import make_wheel
+from .scriptrunner import ScriptRunner
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+run_cmd = ScriptRunner().run_command
+
+
+def test_read_wheel_info():
+    with InTemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'foo', '1.0',
+                           {'foo/__init__.py': b'a = 1\n',
+                            'foo/_ext.so': b'\0' * 100},
+                           platform='macosx_10_6_intel',
+                           requires=['bar>=1.0'])
+        info = read_wheel_info(wheel)
+    assert_equal(info['name'], 'foo')
+    assert_equal(info['version'], '1.0')
+    assert_equal(info['tags'], ['cp34-none-macosx_10_6_intel'])
+    assert_equal(info['requires'], ['bar>=1.0'])
+    # Two files, WHEEL, METADATA, RECORD
+    assert_equal(info['n_files'], 5)
+    assert_true(info['has_binaries'])
+    assert_true(info['uncompressed_size'] > 106)
+    assert_true(info['size'] < info['uncompressed_size'])
+
+
+def write_bad_wheels(wheel_dir):
+    """ Write wheel without METADATA, and a wheel that is not a zip file """
+    no_meta = pjoin(wheel_dir, 'nometa-1.0-py2.py3-none-any.whl')
+    with zipfile.ZipFile(no_meta, 'w') as zf:
+        zf.writestr('nometa-1.0.dist-info/WHEEL', 'Tag: py2-none-any\n')
+    not_zip = pjoin(wheel_dir, 'notzip-1.0-py2.py3-none-any.whl')
+    with open(not_zip, 'wb') as fobj:
+        fobj.write(b'not a zip file')
+    return no_meta, not_zip
+
+
+def test_read_wheel_info_errors():
+    with InTemporaryDirectory() as tmpdir:
+        for bad_wheel in write_bad_wheels(tmpdir):
+            assert_raises(WheelInfoError, read_wheel_info, bad_wheel)
+        # No Version in METADATA
+        no_version = pjoin(tmpdir, 'nover-1.0-py2.py3-none-any.whl')
+        with zipfile.ZipFile(no_version, 'w') as zf:
+            zf.writestr('nover-1.0.dist-info/WHEEL', 'Tag: py2-none-any\n')
+            zf.writestr('nover-1.0.dist-info/METADATA', 'Name: nover\n')
+        assert_raises(WheelInfoError, read_wheel_info, no_version)
+
+
+def test_read_top_level():
+    with InTemporaryDirectory() as tmpdir:
+        # Packages and modules at root of wheel
+        wheel = make_wheel(tmpdir, 'foo', '1.0',
+                           {'foo/__init__.py': b'',
+                            'foo/sub/__init__.py': b'',
+                            'bar.py': b'',
+                            '_speedups.so': b'',
+                            'foo-1.0.data/scripts/foo-run': b'',
+                            'notpkg/data.txt': b''})
+        assert_equal(read_top_level(wheel), ['_speedups', 'bar', 'foo'])
+        # top_level.txt overrides
+        wheel = make_wheel(tmpdir, 'ipython', '1.0',
+                           {'IPython/__init__.py': b'',
+                            'ipython-1.0.dist-info/top_level.txt':
+                            b'IPython\n\n'})
+        assert_equal(read_top_level(wheel), ['IPython'])
+
+
+def test_catalog():
+    with InTemporaryDirectory() as tmpdir:
+        os.mkdir('wheels')
+        foo = make_wheel('wheels', 'foo', '1.0', {'foo/_ext.so': b'x'},
+                         platform='macosx_10_6_intel')
+        make_wheel('wheels', 'bar', '2.0', {'bar/__init__.py': b''})
+        catalog = WheelCatalog('catalog.db')
+        assert_equal(catalog.update('wheels'), (2, 0))
+        # Nothing changed, nothing read
+        assert_equal(catalog.update('wheels'), (0, 0))
+        records = catalog.query('wheels')
+        assert_equal([r['name'] for r in records], ['bar', 'foo'])
+        assert_equal(records[0]['path'], abspath(pjoin('wheels',
+            'bar-2.0-py2.py3-none-any.whl')))
+        assert_equal([r['name'] for r in catalog.query(has_binaries=True)],
+                     ['foo'])
+        assert_equal([r['name'] for r in catalog.query(name='BAR')], ['bar'])
+        assert_equal(catalog.get(foo)['version'], '1.0')
+        assert_equal(catalog.get('wheels/nothere.whl'), None)
+        # Changed wheel gets read again
+        make_wheel('wheels', 'foo', '1.0', {'foo/_ext.so': b'xy'},
+                   platform='macosx_10_6_intel')
+        os.utime(foo, (0, 0))
+        assert_equal(catalog.get(foo)['version'], '1.0')
+        assert_equal(catalog.get(foo, current=True), None)
+        assert_equal(catalog.update('wheels'), (1, 0))
+        assert_equal(catalog.get(foo, current=True)['has_binaries'], True)
+        # Removed wheel gets forgotten
+        os.unlink(foo)
+        assert_equal(catalog.update('wheels'), (0, 1))
+        assert_equal(catalog.query(name='foo'), [])
+        catalog.close()
+        # Catalog persists
+        catalog = WheelCatalog('catalog.db')
+        assert_equal(len(catalog.query()), 1)
+        catalog.close()
+        # Query from command line
+        code, stdout, stderr = run_cmd(['wheels2dmg-catalog', 'catalog.db',
+                                        'wheels', '--json'])
+        records = json.loads(stdout.decode('utf-8'))
+        assert_equal([r['name'] for r in records], ['bar'])
+
+
+def test_catalog_bad_wheels():
+    with InTemporaryDirectory() as tmpdir:
+        os.mkdir('wheels')
+        make_wheel('wheels', 'bar', '2.0', {'bar/__init__.py': b''})
+        no_meta, not_zip = [abspath(p) for p in write_bad_wheels('wheels')]
+        catalog = WheelCatalog('catalog.db')
+        # Bad wheels skipped and reported
+        assert_equal(catalog.update('wheels'), (1, 0))
+        assert_equal(sorted(catalog.bad_wheels), [no_meta, not_zip])
+        assert_equal([r['name'] for r in catalog.query('wheels')], ['bar'])
+        assert_equal(catalog.get(no_meta), None)
+        # Still bad next time
+        assert_equal(catalog.update('wheels'), (0, 0))
+        assert_equal(sorted(catalog.bad_wheels), [no_meta, not_zip])
+        # Good wheel going bad gets forgotten
+        bar = abspath(pjoin('wheels', 'bar-2.0-py2.py3-none-any.whl'))
+        with open(bar, 'wb') as fobj:
+            fobj.write(b'broken')
+        assert_equal(catalog.update('wheels'), (0, 1))
+        assert_equal(catalog.query('wheels'), [])
+        assert_equal(len(catalog.bad_wheels), 3)
+        catalog.close()
+        code, stdout, stderr = run_cmd(['wheels2dmg-catalog', 'catalog.db',
+                                        'wheels', '--json'])
+        assert_equal(json.loads(stdout.decode('utf-8')), [])
+        assert_true(b'Skipping unreadable wheel' in stderr)
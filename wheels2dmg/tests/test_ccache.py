@@ -0,0 +1,111 @@
+""" Testing ccache module
+"""
+
+import os
+import sys
+from os.path import join as pjoin
+from subprocess import check_call
+
+from ..ccache import CompilerCache, find_executable
+from ..runner import CommandRunner
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_sdist
+
+from nose import SkipTest
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+# Stand-in for ccache; logs compiler calls and prints fixed statistics
+FAKE_CCACHE = """#!/bin/sh
+if [ "$1" = "--print-stats" ]; then
+    printf 'direct_cache_hit\\t3\\npreprocessed_cache_hit\\t1\\n'
+    printf 'cache_miss\\t2\\nfiles_in_cache\\t10\\n'
+    exit 0
+fi
+echo "$@" >> "$CCACHE_DIR/calls.log"
+exec "$@"
+"""
+
+EXT_SETUP = """from setuptools import setup, Extension
+setup(name='cext', version='1.0',
+      ext_modules=[Extension('cext', ['cext.c'])])
+"""
+
+EXT_SOURCE = b"""#include <Python.h>
+static struct PyModuleDef cext_module = {
+    PyModuleDef_HEAD_INIT, "cext", NULL, -1, NULL};
+PyMODINIT_FUNC PyInit_cext(void) { return PyModule_Create(&cext_module); }
+"""
+
+
+def test_find_executable():
+    with TemporaryDirectory() as tmpdir:
+        exe = pjoin(tmpdir, 'myexe')
+        with open(exe, 'wt') as fobj:
+            fobj.write('#!/bin/sh\n')
+        assert_equal(find_executable('myexe', tmpdir), None)
+        os.chmod(exe, 0o755)
+        assert_equal(find_executable('myexe', os.pathsep.join(['/nowhere',
+                                                               tmpdir])),
+                     exe)
+        assert_equal(find_executable('otherexe', tmpdir), None)
+        assert_raises(RuntimeError, CompilerCache, tmpdir,
+                      find_executable('ccache', tmpdir))
+
+
+def test_build_env():
+    with TemporaryDirectory() as tmpdir:
+        ccache = pjoin(tmpdir, 'ccache')
+        with open(ccache, 'wt') as fobj:
+            fobj.write(FAKE_CCACHE)
+        os.chmod(ccache, 0o755)
+        cache = CompilerCache(pjoin(tmpdir, 'caches'), ccache)
+        env = cache.build_env('37', 'x86_64', pjoin(tmpdir, 'wrappers'),
+                              dict(CC='/bin/echo', PATH=os.environ['PATH']))
+        cache_dir = pjoin(tmpdir, 'caches', 'py37-x86_64')
+        assert_equal(env['CCACHE_DIR'], cache_dir)
+        assert_not_equal(cache.cache_dir('37', 'x86_64'),
+                         cache.cache_dir('38', 'x86_64'))
+        assert_not_equal(cache.cache_dir('37', 'x86_64'),
+                         cache.cache_dir('37', 'arm64'))
+        for var, name in (('CC', 'cc'), ('CXX', 'c++'), ('FC', 'gfortran')):
+            assert_equal(env[var], pjoin(tmpdir, 'wrappers', name))
+        os.makedirs(cache_dir)
+        runner = CommandRunner(echo=False)
+        record = runner.check_call([env['CC'], '-c', 'foo.c'], env=env)
+        assert_equal(record.output_tail, '-c foo.c\n')
+        with open(pjoin(cache_dir, 'calls.log'), 'rt') as fobj:
+            assert_equal(fobj.read(), '/bin/echo -c foo.c\n')
+        assert_equal(cache.stats('37', 'x86_64'), dict(hits=4, misses=2))
+        # Compiler values with arguments, and quoted words
+        env = cache.build_env('37', 'x86_64', pjoin(tmpdir, 'wrappers'),
+                              dict(CC='/bin/echo -arch x86_64',
+                                   CXX='/bin/echo "it\'s a" `b`',
+                                   PATH=os.environ['PATH']))
+        record = runner.check_call([env['CC'], '-c', 'foo.c'], env=env)
+        assert_equal(record.output_tail, '-arch x86_64 -c foo.c\n')
+        record = runner.check_call([env['CXX'], '-c', 'foo.cpp'], env=env)
+        assert_equal(record.output_tail, "it's a `b` -c foo.cpp\n")
+
+
+def test_c_extension():
+    # Test repeated build of C extension hits cache
+    ccache = find_executable('ccache')
+    if ccache is None:
+        raise SkipTest('Need ccache for compiler cache test')
+    import pip
+    if int(pip.__version__.split('.')[0]) < 10:
+        raise SkipTest('Need pip >= 10 for --no-build-isolation')
+    with TemporaryDirectory() as tmpdir:
+        sdist = make_sdist(tmpdir, 'cext', '1.0', {'cext.c': EXT_SOURCE},
+                           setup_py=EXT_SETUP)
+        cache = CompilerCache(pjoin(tmpdir, 'caches'), ccache)
+        env = cache.build_env('37', 'x86_64', pjoin(tmpdir, 'wrappers'))
+        for i in range(2):
+            check_call([sys.executable, '-m', 'pip', 'wheel', '--no-deps',
+                        '--no-index', '--no-build-isolation', '--no-cache-dir',
+                        '-w', pjoin(tmpdir, 'wheels{0}'.format(i)), sdist],
+                       env=env)
+        stats = cache.stats('37', 'x86_64')
+        assert_true(stats['misses'] >= 1)
+        assert_true(stats['hits'] >= 1)
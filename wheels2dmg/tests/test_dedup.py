@@ -0,0 +1,124 @@
+""" Testing dedup module
+"""
+
+import zipfile
+from os.path import basename, join as pjoin
+
+from ..dedup import (find_libs, find_duplicates, duplicate_report,
+                     consolidate_libs)
+from ..macho import get_install_names
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel, make_macho
+
+from nose.tools import (assert_true, assert_false, assert_equal)
+
+PLAT = 'macosx_10_6_intel'
+LIBGFORTRAN = make_macho('/DLC/libgfortran.3.dylib',
+                         ['@loader_path/libquadmath.0.dylib'])
+LIBQUADMATH = make_macho('/DLC/libquadmath.0.dylib')
+GF_NAME = '@loader_path/.dylibs/libgfortran.3.dylib'
+
+
+def make_lib_wheel(out_dir, name, files, pad=64):
+    # Wheel with extension loading libgfortran, and copy of libgfortran
+    files = dict(files)
+    files[name + '/_ext.so'] = make_macho(depends=[GF_NAME], pad=pad)
+    files[name + '/.dylibs/libgfortran.3.dylib'] = LIBGFORTRAN
+    files[name + '/.dylibs/libquadmath.0.dylib'] = LIBQUADMATH
+    return make_wheel(out_dir, name, '1.0', files, platform=PLAT)
+
+
+def member_names(wheel_fname, member, tmpdir):
+    # Install names for member of wheel
+    fname = pjoin(tmpdir, 'member')
+    with zipfile.ZipFile(wheel_fname) as zf:
+        with open(fname, 'wb') as fobj:
+            fobj.write(zf.read(member))
+    return get_install_names(fname)
+
+
+def test_find_duplicates():
+    with TemporaryDirectory() as tmpdir:
+        pkga = make_lib_wheel(tmpdir, 'pkga', {})
+        pkgb = make_lib_wheel(tmpdir, 'pkgb',
+                              {'pkgb/.dylibs/libonly.dylib': b'only'})
+        assert_equal(sorted(path for path, sha, size in find_libs(pkgb)),
+                     ['pkgb/.dylibs/libgfortran.3.dylib',
+                      'pkgb/.dylibs/libonly.dylib',
+                      'pkgb/.dylibs/libquadmath.0.dylib'])
+        duplicates = find_duplicates([pkga, pkgb])
+        assert_equal(len(duplicates), 2)
+        report = duplicate_report(duplicates)
+        assert_equal(report['duplicated_bytes'],
+                     len(LIBGFORTRAN) + len(LIBQUADMATH))
+        libs = report['libraries']
+        # Most duplicated bytes first
+        assert_equal([lib['name'] for lib in libs],
+                     ['libgfortran.3.dylib', 'libquadmath.0.dylib'])
+        assert_equal(libs[0]['copies'],
+                     [basename(pkga) + ':pkga/.dylibs/libgfortran.3.dylib',
+                      basename(pkgb) + ':pkgb/.dylibs/libgfortran.3.dylib'])
+        assert_equal(find_duplicates([pkga]), {})
+        assert_equal(duplicate_report({}),
+                     dict(duplicated_bytes=0, libraries=[]))
+
+
+def test_consolidate_libs():
+    with TemporaryDirectory() as tmpdir:
+        # libbar loads a library that differs between wheels, so cannot move
+        libbar = make_macho('/DLC/libbar.dylib',
+                            ['@loader_path/libunique.dylib'])
+        pkga = make_lib_wheel(tmpdir, 'pkga',
+                              {'pkga/.dylibs/libbar.dylib': libbar,
+                               'pkga/.dylibs/libunique.dylib': b'a'})
+        pkgb = make_lib_wheel(tmpdir, 'pkgb',
+                              {'pkgb/sub/_ext2.so': make_macho(
+                                  depends=['@loader_path/../.dylibs/'
+                                           'libgfortran.3.dylib']),
+                               'pkgb/.dylibs/libbar.dylib': libbar,
+                               'pkgb/.dylibs/libunique.dylib': b'b'})
+        # No room in extension header for new names; wheel unchanged
+        pkgc = make_lib_wheel(tmpdir, 'pkgc', {}, pad=0)
+        with open(pkgc, 'rb') as fobj:
+            pkgc_before = fobj.read()
+        support_fname, moved = consolidate_libs([pkga, pkgb, pkgc],
+                                                'test-dylibs', '1.0', tmpdir)
+        assert_equal(basename(support_fname),
+                     'test_dylibs-1.0-py2.py3-none-{0}.whl'.format(PLAT))
+        assert_equal(moved,
+                     {'libgfortran.3.dylib': (len(LIBGFORTRAN), 2),
+                      'libquadmath.0.dylib': (len(LIBQUADMATH), 2)})
+        with zipfile.ZipFile(support_fname) as zf:
+            assert_equal(zf.read('test_dylibs/.dylibs/libgfortran.3.dylib'),
+                         LIBGFORTRAN)
+            assert_equal(zf.read('test_dylibs/.dylibs/libquadmath.0.dylib'),
+                         LIBQUADMATH)
+            info = 'test_dylibs-1.0.dist-info/'
+            assert_true('Name: test-dylibs' in
+                        zf.read(info + 'METADATA').decode('utf-8'))
+            assert_true('Tag: py3-none-' + PLAT in
+                        zf.read(info + 'WHEEL').decode('utf-8'))
+            assert_true('test_dylibs/.dylibs/libquadmath.0.dylib,sha256='
+                        in zf.read(info + 'RECORD').decode('utf-8'))
+        for wheel, name in ((pkga, 'pkga'), (pkgb, 'pkgb')):
+            with zipfile.ZipFile(wheel) as zf:
+                names = zf.namelist()
+                metadata = zf.read(name + '-1.0.dist-info/METADATA')
+                record = zf.read(name + '-1.0.dist-info/RECORD')
+            assert_false(name + '/.dylibs/libgfortran.3.dylib' in names)
+            assert_false(name + '/.dylibs/libquadmath.0.dylib' in names)
+            assert_true(name + '/.dylibs/libbar.dylib' in names)
+            assert_true(b'Requires-Dist: test-dylibs==1.0' in metadata)
+            assert_false(b'libgfortran' in record)
+            assert_equal(member_names(wheel, name + '/_ext.so', tmpdir),
+                         (None, ['@loader_path/../test_dylibs/.dylibs/'
+                                 'libgfortran.3.dylib']))
+        assert_equal(member_names(pkgb, 'pkgb/sub/_ext2.so', tmpdir),
+                     (None, ['@loader_path/../../test_dylibs/.dylibs/'
+                             'libgfortran.3.dylib']))
+        with open(pkgc, 'rb') as fobj:
+            assert_equal(fobj.read(), pkgc_before)
+        # Nothing left to consolidate
+        assert_equal(consolidate_libs([pkga, pkgb], 'test-dylibs', '1.0',
+                                      tmpdir),
+                     (None, {}))
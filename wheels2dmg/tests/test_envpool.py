@@ -0,0 +1,64 @@
+""" Testing envpool module
+"""
+
+import os
+import sys
+from os.path import join as pjoin, exists
+
+from ..envpool import BuildEnvPool, ENV_MARKER
+from ..runner import CommandRunner
+from ..tmpdirs import TemporaryDirectory
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+# Stand-in for get-pip.py; installs empty pip and wheel packages, so the pool
+# can make environments without network access
+FAKE_GET_PIP = """
+import os
+import sys
+import sysconfig
+site_packages = sysconfig.get_paths()['purelib']
+for pkg in ('pip', 'wheel'):
+    pkg_dir = os.path.join(site_packages, pkg)
+    if not os.path.isdir(pkg_dir):
+        os.makedirs(pkg_dir)
+    for fname in ('__init__.py', '__main__.py'):
+        open(os.path.join(pkg_dir, fname), 'wt').close()
+with open(os.path.join(sys.prefix, 'get-pip-args.txt'), 'wt') as fobj:
+    fobj.write(' '.join(sys.argv[1:]))
+"""
+
+
+def test_env_pool():
+    with TemporaryDirectory() as tmpdir:
+        get_pip = pjoin(tmpdir, 'get-pip.py')
+        with open(get_pip, 'wt') as fobj:
+            fobj.write(FAKE_GET_PIP)
+        pool = BuildEnvPool(pjoin(tmpdir, 'envs'), CommandRunner(echo=False))
+        with pool.lease(sys.executable, get_pip, ['--no-index']) as env:
+            assert_true(env.created)
+            first_dir = env.env_dir
+            assert_true(exists(env.python))
+            assert_true(exists(pjoin(first_dir, ENV_MARKER)))
+            with open(pjoin(first_dir, 'get-pip-args.txt'), 'rt') as fobj:
+                assert_equal(fobj.read(), '--no-index')
+            # Concurrent lease gets another environment
+            with pool.lease(sys.executable, get_pip) as env2:
+                assert_true(env2.created)
+                assert_not_equal(env2.env_dir, first_dir)
+        # Released environment is reused
+        with pool.lease(sys.executable, get_pip) as env:
+            assert_false(env.created)
+            assert_equal(env.env_dir, first_dir)
+        # Broken environment is made again
+        os.unlink(pjoin(first_dir, ENV_MARKER))
+        with pool.lease(sys.executable, get_pip) as env:
+            assert_true(env.created)
+            assert_equal(env.env_dir, first_dir)
+        # New get-pip.py gives new environment
+        with open(get_pip, 'at') as fobj:
+            fobj.write('\n# New version\n')
+        with pool.lease(sys.executable, get_pip) as env:
+            assert_true(env.created)
+            assert_not_equal(env.env_dir, first_dir)
@@ -0,0 +1,173 @@
+""" Testing events module
+"""
+
+import os
+import sys
+import time
+import threading
+from os.path import join as pjoin
+
+from ..events import (EventEmitter, BuildEvents, BuildCancelled,
+                      format_event, Event, STAGE_START, STAGE_END,
+                      WHEEL_PROCESSED, COMMAND_START, COMMAND_END,
+                      BYTES_WRITTEN, BUILD_END)
+from ..runner import CommandRunner
+from ..pkgbuilders import PkgWriter
+from ..history import BuildHistory
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel
+
+from nose.tools import (assert_true, assert_false, assert_equal,
+                        assert_raises)
+
+
+def test_emitter():
+    events = EventEmitter()
+    received = []
+    events.add_callback(received.append)
+    event = events.emit(STAGE_START, name='fetch')
+    assert_equal(received, [event])
+    assert_equal(event.kind, STAGE_START)
+    assert_equal(event.info, dict(name='fetch'))
+    events.remove_callback(received.append)
+    events.emit(STAGE_START, name='other')
+    assert_equal(len(received), 1)
+    # Cancellation
+    stopped = []
+    events.add_on_cancel(lambda : stopped.append(1))
+    events.check()
+    assert_false(events.cancelled)
+    events.cancel()
+    assert_true(events.cancelled)
+    assert_equal(stopped, [1])
+    assert_raises(BuildCancelled, events.check)
+    # Already cancelled; call at once
+    events.add_on_cancel(lambda : stopped.append(2))
+    assert_equal(stopped, [1, 2])
+    events.reset()
+    events.check()
+
+
+def test_format_event():
+    assert_equal(format_event(Event(STAGE_START, 0, dict(name='readme'))),
+                 'readme ...')
+    assert_equal(format_event(Event(STAGE_END, 0, dict(
+        name='readme', time=1.25, error=False))), 'readme done (1.2s)')
+    assert_equal(format_event(Event(WHEEL_PROCESSED, 0, dict(
+        filename='a.whl', action='cached'))), '  cached a.whl')
+    assert_equal(format_event(Event(COMMAND_START, 0, dict(cmd=['ls']))),
+                 None)
+    assert_equal(format_event(Event(COMMAND_END, 0, dict(
+        cmd=['/bin/false'], returncode=1, wall_time=0.1))),
+        '  false exited with code 1')
+    assert_equal(format_event(Event(BYTES_WRITTEN, 0, dict(
+        format='dmg', filename='a.dmg', size=2 ** 21))),
+        '  wrote a.dmg (2.0 MB)')
+
+
+def test_runner_cancel():
+    events = EventEmitter()
+    received = []
+    events.add_callback(received.append)
+    runner = CommandRunner(echo=False, events=events)
+    runner.check_call([sys.executable, '-c', 'pass'])
+    assert_equal([e.kind for e in received], [COMMAND_START, COMMAND_END])
+    assert_equal(received[1].info['returncode'], 0)
+    # Cancel long-running command from another thread
+    timer = threading.Timer(0.2, events.cancel)
+    timer.start()
+    start = time.time()
+    assert_raises(BuildCancelled, runner.check_call,
+                  [sys.executable, '-c', 'import time; time.sleep(30)'])
+    assert_true(time.time() - start < 10)
+    timer.join()
+    # No new commands after cancel
+    n_records = len(runner.records)
+    assert_raises(BuildCancelled, runner.check_call,
+                  [sys.executable, '-c', 'pass'])
+    assert_equal(len(runner.records), n_records)
+
+
+def make_writer(tmpdir, **kwargs):
+    pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['pkga'],
+                           dmg_build_dir = pjoin(tmpdir, 'build'), **kwargs)
+    pkg_writer.runner.echo = False
+    os.makedirs(pkg_writer.wheel_build_dir)
+    make_wheel(pkg_writer.wheel_build_dir, 'pkga', '1.0',
+               {'pkga/__init__.py': b'x = 1\n'})
+    pkg_writer.write_manifest()
+    return pkg_writer
+
+
+def test_build_events():
+    with TemporaryDirectory() as tmpdir:
+        pkg_writer = make_writer(tmpdir)
+        build = BuildEvents(pkg_writer, tmpdir, wheelhouse=False,
+                            formats=['wheelhouse'])
+        received = list(build)
+        assert_equal(build.error, None)
+        assert_equal(build.result, None)
+        kinds = [event.kind for event in received]
+        assert_equal(kinds[0], STAGE_START)
+        assert_equal(kinds[-1], BUILD_END)
+        assert_equal(received[-1].info['error'], None)
+        stages = [event.info['name'] for event in received
+                  if event.kind == STAGE_END]
+        assert_equal(stages, list(pkg_writer.stage_times))
+        assert_true(COMMAND_START in kinds)
+        written = [event.info for event in received
+                   if event.kind == BYTES_WRITTEN]
+        assert_equal(written, [dict(
+            format='wheelhouse',
+            filename=pkg_writer.outputs['wheelhouse'],
+            size=os.path.getsize(pkg_writer.outputs['wheelhouse']))])
+        assert_raises(RuntimeError, list, build)
+        # Cancel from iterating thread
+        build = BuildEvents(pkg_writer, tmpdir, clobber=True,
+                            wheelhouse=False, formats=['wheelhouse'])
+        received = []
+        try:
+            for event in build:
+                received.append(event)
+                if event.kind == STAGE_END:
+                    build.cancel()
+        except BuildCancelled:
+            pass
+        else:
+            raise AssertionError('Build should be cancelled')
+        assert_true(isinstance(build.error, BuildCancelled))
+        assert_equal(received[-1].kind, BUILD_END)
+        assert_true('BuildCancelled' in received[-1].info['error'])
+        # Build thread stops at the next stage after we cancel
+        started = [e.info['name'] for e in received if e.kind == STAGE_START]
+        assert_true(len(started) < len(stages))
+        assert_equal(started, stages[:len(started)])
+        # Cancel stays until a new build starts
+        assert_raises(BuildCancelled, pkg_writer.write_dmg, tmpdir,
+                      clobber=True, wheelhouse=False,
+                      formats=['wheelhouse'])
+        # Build again after cancel
+        build = BuildEvents(pkg_writer, tmpdir, clobber=True,
+                            wheelhouse=False, formats=['wheelhouse'])
+        received = list(build)
+        assert_equal(build.error, None)
+        assert_equal(received[-1].info['error'], None)
+        assert_equal(list(pkg_writer.stage_times), stages)
+
+
+def test_build_events_history():
+    # Build thread records build in history database
+    with TemporaryDirectory() as tmpdir:
+        db_fname = pjoin(tmpdir, 'history.db')
+        pkg_writer = make_writer(tmpdir, history_db=db_fname)
+        build = BuildEvents(pkg_writer, tmpdir, wheelhouse=False,
+                            formats=['wheelhouse'])
+        received = list(build)
+        assert_equal(build.error, None)
+        assert_equal(received[-1].kind, BUILD_END)
+        assert_equal(received[-1].info['error'], None)
+        pkg_writer.history.close()
+        history = BuildHistory(db_fname)
+        builds = history.builds('test')
+        history.close()
+        assert_equal([b['status'] for b in builds], ['ok'])
@@ -0,0 +1,87 @@
+""" Testing history module
+"""
+
+import json
+
+from ..history import BuildHistory
+from ..tmpdirs import InTemporaryDirectory
+from .scriptrunner import ScriptRunner
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+run_cmd = ScriptRunner().run_command
+
+
+def record_build(history, total_time, wheels, dmg_size, status='ok',
+                 pyv_mm='34'):
+    return history.record('test', '1.0', pyv_mm, 0., 'digest', status,
+                          total_time, {'get_wheels': total_time}, wheels,
+                          dmg_size)
+
+
+def test_record():
+    with InTemporaryDirectory():
+        history = BuildHistory('history.db')
+        build_id = record_build(history, 10., [('a.whl', 100),
+                                               ('b.whl', 50)], 160)
+        build = history.get(build_id)
+        assert_equal(build['pkg_name'], 'test')
+        assert_equal(build['wheelhouse_size'], 150)
+        assert_equal(build['dmg_size'], 160)
+        assert_equal(build['stage_times'], {'get_wheels': 10.})
+        assert_equal(build['wheels'], {'a.whl': 100, 'b.whl': 50})
+        assert_equal(history.get(build_id + 1), None)
+        other_id = record_build(history, 10., [], None, 'failed', '27')
+        assert_equal([b['id'] for b in history.builds('test')],
+                     [other_id, build_id])
+        assert_equal([b['id'] for b in history.builds('test', '34')],
+                     [build_id])
+        assert_equal([b['id'] for b in history.builds('test',
+                                                      status='failed')],
+                     [other_id])
+        assert_equal(history.builds('another'), [])
+        history.close()
+
+
+def test_compare():
+    with InTemporaryDirectory():
+        history = BuildHistory('history.db')
+        wheels = [('a.whl', 100), ('b.whl', 50)]
+        for total_time in (10., 12., 11.):
+            record_build(history, total_time, wheels, 160)
+        # Failed builds not in baseline
+        record_build(history, 1., [], None, 'failed')
+        # Builds for other Python versions not in baseline
+        record_build(history, 1., [], 10, 'ok', '27')
+        build_id = record_build(history, 11.5, wheels + [('c.whl', 200)],
+                                360)
+        comparison = history.compare(build_id)
+        assert_equal(comparison['baseline_ids'], [3, 2, 1])
+        assert_equal(comparison['measures']['total_time']['baseline'], 11.)
+        assert_false(comparison['measures']['total_time']['regression'])
+        assert_equal(comparison['regressions'],
+                     ['dmg_size', 'wheelhouse_size'])
+        assert_equal(comparison['added_wheels'], ['c.whl'])
+        assert_equal(comparison['removed_wheels'], [])
+        # Thresholds are configurable
+        comparison = history.compare(build_id, dict(dmg_size=2.))
+        assert_equal(comparison['regressions'], ['wheelhouse_size'])
+        # No baseline, no regression
+        comparison = history.compare(1)
+        assert_equal(comparison['measures'], {})
+        assert_raises(ValueError, history.compare, 100)
+        history.close()
+        # Check from command line
+        code, stdout, stderr = run_cmd(['wheels2dmg-history', 'history.db',
+                                        'test', '--python-version', '3.4',
+                                        '--json'], check_code=False)
+        assert_equal(code, 1)
+        assert_equal(json.loads(stdout.decode('utf-8'))['build']['id'],
+                     build_id)
+        code, stdout, stderr = run_cmd(['wheels2dmg-history', 'history.db',
+                                        'test', '--python-version', '3.4',
+                                        '--dmg-size-threshold', '2',
+                                        '--wheelhouse-size-threshold', '2'])
+        assert_equal(code, 0)
+        assert_true(b'Added wheel: c.whl' in stdout)
@@ -0,0 +1,134 @@
+""" Testing macho module
+"""
+
+from ..macho import (get_archs, thin_fat, thin_platform_tag, MachOError,
+                     get_install_names, set_install_names)
+from ..tmpdirs import InTemporaryDirectory
+from .wheelmaker import make_fat_binary, make_macho
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+
+I386 = b'i386 slice ' * 100
+X86_64 = b'x86_64 slice ' * 200
+PPC = b'ppc slice' * 50
+
+
+def write_bytes(fname, contents):
+    with open(fname, 'wb') as fobj:
+        fobj.write(contents)
+
+
+def read_bytes(fname):
+    with open(fname, 'rb') as fobj:
+        return fobj.read()
+
+
+def test_get_archs():
+    with InTemporaryDirectory():
+        write_bytes('fat', make_fat_binary([('i386', I386),
+                                            ('x86_64', X86_64)]))
+        assert_equal(get_archs('fat'), set(['i386', 'x86_64']))
+        write_bytes('not_fat', b'Some text')
+        assert_equal(get_archs('not_fat'), None)
+        write_bytes('empty', b'')
+        assert_equal(get_archs('empty'), None)
+        # Java class file; same magic, then version numbers
+        write_bytes('java.class', b'\xca\xfe\xba\xbe\x00\x00\x00\x32')
+        assert_equal(get_archs('java.class'), None)
+        # Truncated header
+        write_bytes('truncated', make_fat_binary([('i386', I386)])[:20])
+        assert_raises(MachOError, get_archs, 'truncated')
+
+
+def test_thin_fat():
+    with InTemporaryDirectory():
+        write_bytes('fat', make_fat_binary([('i386', I386),
+                                            ('x86_64', X86_64)]))
+        # Thin to one architecture gives thin binary
+        assert_equal(thin_fat('fat', 'thin', ['x86_64']), set(['i386']))
+        assert_equal(read_bytes('thin'), X86_64)
+        # Nothing to remove; nothing written
+        assert_equal(thin_fat('fat', 'other', ['i386', 'x86_64', 'ppc']),
+                     set())
+        # Thin binary is not fat; nothing to do
+        assert_equal(thin_fat('thin', 'other', ['x86_64']), set())
+        # Can't remove all architectures
+        assert_raises(MachOError, thin_fat, 'fat', 'other', ['ppc'])
+        # Thin to two of three architectures
+        write_bytes('fat3', make_fat_binary([('i386', I386),
+                                             ('ppc', PPC),
+                                             ('x86_64', X86_64)],
+                                            align=4))
+        assert_equal(thin_fat('fat3', 'fat3', ['i386', 'x86_64']),
+                     set(['ppc']))
+        assert_equal(read_bytes('fat3'),
+                     make_fat_binary([('i386', I386), ('x86_64', X86_64)],
+                                     align=4))
+        assert_equal(get_archs('fat3'), set(['i386', 'x86_64']))
+
+
+def test_thin_platform_tag():
+    assert_equal(thin_platform_tag('macosx_10_6_intel', ['x86_64']),
+                 'macosx_10_6_x86_64')
+    assert_equal(thin_platform_tag('macosx_10_6_intel', ['i386']),
+                 'macosx_10_6_i386')
+    assert_equal(thin_platform_tag('macosx_10_6_intel', ['i386', 'x86_64']),
+                 'macosx_10_6_intel')
+    assert_equal(thin_platform_tag('macosx_10_9_x86_64', ['x86_64']),
+                 'macosx_10_9_x86_64')
+    assert_equal(thin_platform_tag('macosx_10_9_x86_64', ['i386']), None)
+    assert_equal(thin_platform_tag('macosx_10_5_universal', ['x86_64',
+                                                             'ppc64']),
+                 'macosx_10_5_fat64')
+    assert_equal(thin_platform_tag('any', ['x86_64']), 'any')
+    assert_equal(thin_platform_tag('linux_x86_64', ['i386']), 'linux_x86_64')
+
+
+def test_install_names():
+    with InTemporaryDirectory():
+        write_bytes('libfoo.dylib',
+                    make_macho('/usr/local/lib/libfoo.dylib',
+                               ['@loader_path/libbar.dylib',
+                                '/usr/lib/libSystem.B.dylib']))
+        assert_equal(get_install_names('libfoo.dylib'),
+                     ('/usr/local/lib/libfoo.dylib',
+                      ['@loader_path/libbar.dylib',
+                       '/usr/lib/libSystem.B.dylib']))
+        write_bytes('ext.so', make_macho(depends=['libfoo.dylib']))
+        assert_equal(get_install_names('ext.so'), (None, ['libfoo.dylib']))
+        write_bytes('not_macho', b'Some text')
+        assert_equal(get_install_names('not_macho'), (None, None))
+        # Longer names grow into the header padding
+        set_install_names('libfoo.dylib',
+                          {'@loader_path/libbar.dylib':
+                           '@loader_path/../../other/.dylibs/libbar.dylib'},
+                          install_id='/DLC/libfoo.dylib')
+        assert_equal(get_install_names('libfoo.dylib'),
+                     ('/DLC/libfoo.dylib',
+                      ['@loader_path/../../other/.dylibs/libbar.dylib',
+                       '/usr/lib/libSystem.B.dylib']))
+        # Names for each slice of a fat binary
+        slice = make_macho(depends=['libfoo.dylib'])
+        write_bytes('fat.so', make_fat_binary([('i386', slice),
+                                               ('x86_64', slice)]))
+        set_install_names('fat.so', {'libfoo.dylib': '@rpath/libfoo.dylib'})
+        contents = read_bytes('fat.so')
+        assert_equal(contents.count(b'@rpath/libfoo.dylib'), 2)
+        assert_equal(get_install_names('fat.so'),
+                     (None, ['@rpath/libfoo.dylib']))
+        # No room for long name; file does not change, dry run or not
+        write_bytes('tight.so', make_macho(depends=['libfoo.dylib'], pad=0))
+        before = read_bytes('tight.so')
+        long_name = '@loader_path/' + 'x' * 100 + '/libfoo.dylib'
+        for dry_run in (True, False):
+            assert_raises(MachOError, set_install_names, 'tight.so',
+                          {'libfoo.dylib': long_name}, dry_run=dry_run)
+            assert_equal(read_bytes('tight.so'), before)
+        # Dry run checks, but does not change the file
+        set_install_names('ext.so',
+                          {'libfoo.dylib': '@loader_path/libfoo.dylib'},
+                          dry_run=True)
+        assert_equal(get_install_names('ext.so'), (None, ['libfoo.dylib']))
+        assert_raises(MachOError, set_install_names, 'not_macho', {})
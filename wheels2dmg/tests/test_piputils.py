@@ -1,12 +1,13 @@
 """ Testing piputils module
 """
 
+import os
+import time
 from os.path import join as pjoin, abspath, dirname
 
-from pip.exceptions import InstallationError
-
 from ..piputils import (make_pip_parser, recon_pip_args, get_requirements,
-                        get_req_strings)
+                        get_req_strings, parse_specs, Requirement,
+                        InstallationError, marker_environment)
 from ..wheels2dmg_cmd import get_parser
 from ..tmpdirs import InTemporaryDirectory
 
@@ -184,3 +185,112 @@ def test_get_req_strings():
                        ['one[an_extra]', 'two'], True, False)
     assert_names_equal(get_requirements(['one[an_extra]', 'two==1.2']),
                        ['one', 'two'], False, False)
+
+
+def test_markers():
+    # Test we drop requirements with markers for other environments
+    req_set = get_requirements(['one', 'two; sys_platform == "win32"',
+                                'three; python_version < "3.0"',
+                                'four>=1.0; sys_platform == "darwin"'])
+    assert_names_equal(req_set, ['one', 'four>=1.0'])
+    assert_names_equal(req_set, ['one', 'three', 'four'], True, False,
+                       marker_environment('2.7.8'))
+    env = marker_environment('3.4.1', 'i386')
+    assert_equal(env['python_version'], '3.4')
+    assert_equal(env['python_full_version'], '3.4.1')
+    assert_equal(env['platform_machine'], 'i386')
+    req = Requirement.from_line('five; platform_machine == "x86_64"')
+    assert_true(req.applies())
+    assert_false(req.applies(env))
+    assert_true(Requirement.from_line('six').applies(env))
+    assert_raises(InstallationError, Requirement.from_line,
+                  'seven; sys_platform = "win32"')
+
+
+def test_parse_specs():
+    assert_equal(parse_specs(''), [])
+    assert_equal(parse_specs('==1.2'), [('==', '1.2')])
+    assert_equal(parse_specs('>=1.2, <1.3'), [('>=', '1.2'), ('<', '1.3')])
+    assert_equal(parse_specs('~=2.0,!=2.0.1'), [('~=', '2.0'),
+                                                ('!=', '2.0.1')])
+    assert_raises(InstallationError, parse_specs, '=>1.2')
+    assert_raises(InstallationError, parse_specs, '1.2')
+
+
+def test_requirement_from_line():
+    req = Requirement.from_line('one[an_extra, another]>=1.2,<2 ; '
+                                'python_version < "3"')
+    assert_equal(req.name, 'one')
+    assert_equal(req.extras, ['an_extra', 'another'])
+    assert_equal(req.specs, [('>=', '1.2'), ('<', '2')])
+    assert_equal(req.marker, 'python_version < "3"')
+    req = Requirement.from_line('two (==1.0)')
+    assert_equal((req.name, req.specs), ('two', [('==', '1.0')]))
+    req = Requirement.from_line('three @ https://example.com/three.zip')
+    assert_equal((req.name, req.url),
+                 ('three', 'https://example.com/three.zip'))
+    req = Requirement.from_line('https://example.com/four.zip#egg=four')
+    assert_equal((req.name, req.url),
+                 ('four', 'https://example.com/four.zip#egg=four'))
+    assert_raises(InstallationError, Requirement.from_line,
+                  'https://example.com/four.zip')
+    assert_raises(InstallationError, Requirement.from_line, 'five==')
+    assert_raises(InstallationError, Requirement.from_line, '[six]')
+
+
+def test_requirement_files():
+    # Test parsing features of requirement files
+    with InTemporaryDirectory():
+        os.mkdir('subdir')
+        with open(pjoin('subdir', 'included.txt'), 'wt') as fobj:
+            fobj.write("""# Included file
+-f wheels
+--find-links=http://example.com/wheels
+nested>=1.0 # trailing comment
+""")
+        with open('required.txt', 'wt') as fobj:
+            fobj.write("""
+--index-url http://example.com/simple
+--extra-index-url=http://example.com/extra
+--no-index
+--pre
+-r subdir/included.txt
+continued\\
+[extra] \\
+  ==2.0
+marked; sys_platform == "darwin"
+-e git+https://example.com/repo.git#egg=edited
+""")
+        req_set = get_requirements(['first'], ['required.txt'])
+        assert_names_equal(req_set, ['first', 'nested>=1.0',
+                                     'continued[extra]==2.0', 'marked',
+                                     'edited'])
+        assert_equal(req_set.requirements['marked'].marker,
+                     'sys_platform == "darwin"')
+        assert_equal(req_set.find_links,
+                     [pjoin(abspath('subdir'), 'wheels'),
+                      'http://example.com/wheels'])
+        assert_equal(req_set.index_url, 'http://example.com/simple')
+        assert_equal(req_set.extra_index_urls, ['http://example.com/extra'])
+        assert_true(req_set.no_index)
+        # Missing and self-including files
+        assert_raises(InstallationError, get_requirements, [], ['nofile.txt'])
+        with open('loop.txt', 'wt') as fobj:
+            fobj.write('-r loop.txt\n')
+        assert_raises(InstallationError, get_requirements, [], ['loop.txt'])
+
+
+def test_parse_speed():
+    # Benchmark parsing a large requirements file
+    n_lines = 10000
+    with InTemporaryDirectory():
+        with open('large.txt', 'wt') as fobj:
+            for i in range(n_lines):
+                if i % 10 == 0:
+                    fobj.write('# Comment {0}\n'.format(i))
+                fobj.write('package-{0}[extra]>=1.{0},<2 # why\n'.format(i))
+        start = time.time()
+        req_set = get_requirements([], ['large.txt'])
+        duration = time.time() - start
+    assert_equal(len(req_set.requirements), n_lines)
+    assert_true(duration < 2, 'Parsing took {0:.2f}s'.format(duration))
@@ -1,20 +1,39 @@
 """ Testing pkgbuilders module
 """
 
+import os
+import sys
+import shutil
+import zipfile
+import json
+import tarfile
+import time
+import runpy
+from subprocess import check_call, call, Popen
 from os.path import (basename, dirname, abspath, expanduser, relpath,
                      join as pjoin)
+from glob import glob
 
 from ..pkgbuilders import (get_get_pip, insert_template_path,
-                           pop_template_path, get_template,
-                           PkgWriter)
+                           pop_template_path, get_template, compile_wheel,
+                           thin_wheel, recompress_wheel, PkgWriter)
+from ..macho import get_archs, MachOError
+from ..wheelcache import file_sha256
+from ..sizes import SizeBudgetError
 
-from ..tmpdirs import TemporaryDirectory
+from ..tmpdirs import TemporaryDirectory, REAPER
+from .wheelmaker import make_wheel, make_sdist, make_fat_binary, make_macho
 
+from nose import SkipTest
 from nose.tools import (assert_true, assert_false, assert_raises,
                         assert_equal, assert_not_equal)
 
 TEMPLATE_PATH = abspath(pjoin(dirname(__file__), '..', 'templates'))
 
+# Number of modules in wheel for install benchmark.  Set to a few thousand to
+# compare install times with and without byte-compiled wheels.
+BENCH_MODULES = int(os.environ.get('WHEELS2DMG_BENCH_MODULES', 20))
+
 
 def assert_file_equal(file1, file2):
     with open(file1, 'rb') as fobj:
@@ -75,6 +94,10 @@ def test_get_requirement_strings():
                           ['one[an_extra]', 'two'], True, False)
     assert_pkg_reqs_equal(['one[an_extra]', 'two==1.2'],
                           ['one', 'two'], False, False)
+    # Markers for target Python
+    assert_pkg_reqs_equal(['one; python_version < "3"',
+                           'two; python_version >= "3"',
+                           'three; sys_platform == "win32"'], ['one'])
 
 
 def test_write_requires():
@@ -121,6 +144,8 @@ def test_write_post():
 # vim ft:python
 import sys
 import os
+import re
+import json
 from os.path import exists, dirname
 from subprocess import check_call
 
@@ -135,19 +160,684 @@ python_bin = '/Library/Frameworks/Python.framework/Versions/3.4/bin'
 python_path = python_bin + '/python3.4'
 if not exists(python_path):
     sys.exit(20)
-# Install pip
-check_call([python_path,
-            wheelhouse + '/get-pip.py',
-            '-f', wheelhouse,
-            '--no-index'])
+# Find wheels for distributions that are not installed, or are older than the
+# wheel.  We leave distributions that the user has upgraded since.
+site_packages = ('/Library/Frameworks/Python.framework/Versions/3.4/lib/'
+                 'python3.4/site-packages')
+installed = {}
+if exists(site_packages):
+    for fname in os.listdir(site_packages):
+        if fname.endswith('.dist-info') and '-' in fname:
+            name, version = fname[:-len('.dist-info')].split('-', 1)
+            installed[re.sub(r'[-_.]+', '-', name).lower()] = version
+# Order of pre-release labels; post-release labels sort after the release
+PRE_LABELS = {'dev': 0, 'a': 1, 'alpha': 1, 'b': 2, 'beta': 2,
+              'c': 3, 'rc': 3, 'pre': 3, 'preview': 3}
+POST_LABELS = ('post', 'rev', 'r')
+
+
+def version_key(version):
+    key = []
+    for part in re.findall(r'\\d+|[a-zA-Z]+', version):
+        if part.isdigit():
+            key.append((3, int(part), ''))
+        elif part.lower() in POST_LABELS:
+            key.append((2, 0, ''))
+        else:
+            part = part.lower()
+            key.append((0, PRE_LABELS.get(part, len(PRE_LABELS)), part))
+    # Ignore trailing zeros in release number; 1.0 is the same as 1.0.0
+    n_release = 0
+    while n_release < len(key) and key[n_release][0] == 3:
+        n_release += 1
+    release = key[:n_release]
+    while release and release[-1] == (3, 0, ''):
+        release.pop()
+    return release + key[n_release:] + [(1, 0, '')]
+
+
+with open(wheelhouse + '/test-1-manifest.json', 'rt') as fobj:
+    manifest = json.load(fobj)
+to_install = [name for name in sorted(manifest['wheels'])
+              if not name in installed or
+              version_key(installed[name]) <
+              version_key(manifest['wheels'][name]['version'])]
+if len(to_install) == 0:
+    sys.exit(0)
+# Update images only have wheels that changed since the base release
+for name in to_install:
+    if not exists(wheelhouse + '/' + manifest['wheels'][name]['filename']):
+        sys.exit(40)
 # Find pip
 expected_pip = python_bin + '/pip3.4'
+if 'pip' in to_install or not exists(expected_pip):
+    # Install pip
+    check_call([python_path,
+                wheelhouse + '/get-pip.py',
+                '-f', wheelhouse,
+                '--no-index'])
 if not exists(expected_pip):
     sys.exit(30)
 check_call([expected_pip, 'install',
-            '--no-index', '--upgrade',
-            '--find-links', wheelhouse,
-            '-r', wheelhouse + '/test-1.txt'])""")
+            '--no-index', '--upgrade', '--no-deps',
+            '--find-links', wheelhouse] +
+           [wheelhouse + '/' + manifest['wheels'][name]['filename']
+            for name in to_install])""")
+
+
+def test_write_import_benchmark():
+    # Test writing and running import benchmark script
+    with TemporaryDirectory() as tmpdir:
+        pkg_writer = PkgWriter('test', '1', '3.4.1',
+                               ['json-mod', 'pkga', 'my.pkg'],
+                               dmg_build_dir = pjoin(tmpdir, 'build'))
+        os.makedirs(pkg_writer.wheel_build_dir)
+        make_wheel(pkg_writer.wheel_build_dir, 'json_mod', '1.0',
+                   {'json/__init__.py': b'',
+                    'json_mod-1.0.dist-info/top_level.txt': b'json\n'})
+        make_wheel(pkg_writer.wheel_build_dir, 'pkga', '1.0',
+                   {'pkga/__init__.py': b'', '_pkga_ext.so': b''})
+        # No wheel for my.pkg; guess module name
+        assert_equal(pkg_writer.import_names(), ['json', 'pkga', 'my_pkg'])
+        script = pkg_writer.write_import_benchmark()
+        assert_equal(script, pjoin(tmpdir, 'build', 'import-benchmark.py'))
+        assert_true(os.access(script, os.X_OK))
+        out_fname = pjoin(tmpdir, 'report.json')
+        cmd = [sys.executable, script, '--python', sys.executable,
+               '--repeat', '1', '--out', out_fname]
+        # pkga and my_pkg not installed
+        assert_equal(call(cmd), 1)
+        with open(out_fname, 'rt') as fobj:
+            report = json.load(fobj)
+        assert_equal(report['bundle'], 'test-1')
+        assert_equal(sorted(report['modules']), ['json', 'my_pkg', 'pkga'])
+        times = report['modules']['json']
+        assert_equal(times['error'], None)
+        assert_true(0 < times['warm'])
+        assert_true('pkga' in report['modules']['pkga']['error'])
+        assert_true(report['start']['warm'] > 0)
+        # Slower than baseline
+        baseline = pjoin(tmpdir, 'baseline.json')
+        with open(baseline, 'wt') as fobj:
+            json.dump(dict(modules=dict(json=dict(warm=times['warm'] / 1000))),
+                      fobj)
+        assert_equal(call(cmd + ['--baseline', baseline]), 2)
+        # Need at least one warm import
+        assert_equal(call(cmd[:-4] + ['--repeat', '0']), 2)
+        # Warm import fails
+        time_command = runpy.run_path(script)['time_command']
+        flag = pjoin(tmpdir, 'imported')
+        code = ('import os\n'
+                'if os.path.exists({0!r}): raise ImportError("again")\n'
+                'open({0!r}, "w").close()').format(flag)
+        times = time_command(sys.executable, code, 2)
+        assert_true(times['cold'] > 0)
+        assert_equal(times['warm'], None)
+        assert_true('again' in times['error'])
+
+
+def test_import_names_update():
+    # Module names for update image come from manifest, for pruned wheels
+    with TemporaryDirectory() as tmpdir:
+        writers = []
+        for version, pkga_version in (('1.0', '1.0'), ('1.1', '1.1')):
+            pkg_writer = PkgWriter('test', version, '3.4.1',
+                                   ['ipython', 'pkga'],
+                                   dmg_build_dir = pjoin(tmpdir, version))
+            os.makedirs(pkg_writer.wheel_build_dir)
+            make_wheel(pkg_writer.wheel_build_dir, 'ipython', '1.0',
+                       {'IPython/__init__.py': b''})
+            make_wheel(pkg_writer.wheel_build_dir, 'pkga', pkga_version,
+                       {'pkga/__init__.py': b''})
+            writers.append(pkg_writer)
+        base_manifest = writers[0].write_manifest()
+        new_writer = writers[1]
+        new_writer.write_manifest()
+        new_writer.prune_wheelhouse(base_manifest)
+        assert_equal(new_writer.build_report['update']['wheels_removed'], 1)
+        assert_equal(new_writer.import_names(), ['IPython', 'pkga'])
+
+
+def test_postinstall_delta():
+    # Test install script only installs wheels missing or newer than installed
+    with TemporaryDirectory() as tmpdir:
+        pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'],
+                               dmg_build_dir = pjoin(tmpdir, 'build'))
+        pkg_writer.py_org_base = pjoin(tmpdir, 'Versions')
+        wheelhouse = pkg_writer.wheel_build_dir
+        os.makedirs(wheelhouse)
+        for name, version in (('pip', '6.0'), ('my_pkg', '1.0'),
+                              ('other', '2.0')):
+            make_wheel(wheelhouse, name, version, {})
+        manifest_fname = pkg_writer.write_manifest()
+        assert_equal(basename(manifest_fname), 'test-1-manifest.json')
+        with open(manifest_fname, 'rt') as fobj:
+            manifest = json.load(fobj)
+        assert_equal(sorted(manifest['wheels']), ['my-pkg', 'other', 'pip'])
+        assert_equal(manifest['wheels']['my-pkg']['filename'],
+                     'my_pkg-1.0-py2.py3-none-any.whl')
+        assert_equal(manifest['wheels']['other']['version'], '2.0')
+        post = pkg_writer.write_post(tmpdir)
+        # Fake Python.org Python with pip that records its arguments
+        python_bin = pjoin(tmpdir, 'Versions', '3.4', 'bin')
+        site_packages = pjoin(tmpdir, 'Versions', '3.4', 'lib', 'python3.4',
+                              'site-packages')
+        os.makedirs(python_bin)
+        os.makedirs(site_packages)
+        pip_log = pjoin(tmpdir, 'pip.log')
+        with open(pjoin(python_bin, 'python3.4'), 'wt') as fobj:
+            fobj.write('#!/bin/sh\nexit 1\n')
+        with open(pjoin(python_bin, 'pip3.4'), 'wt') as fobj:
+            fobj.write('#!/bin/sh\necho "$@" > {0}\n'.format(pip_log))
+        os.chmod(pjoin(python_bin, 'pip3.4'), 0o755)
+        # Same version as my_pkg wheel
+        for dist_info in ('pip-6.0', 'My_Pkg-1.0.0', 'other-1.5'):
+            os.mkdir(pjoin(site_packages, dist_info + '.dist-info'))
+        env = dict(os.environ,
+                   PACKAGE_PATH=pjoin(pkg_writer.dmg_build_dir, 'test.pkg'))
+        check_call([sys.executable, post], env=env)
+        with open(pip_log, 'rt') as fobj:
+            args = fobj.read().split()
+        assert_equal(args[-1], pjoin(wheelhouse,
+                                     'other-2.0-py2.py3-none-any.whl'))
+        assert_true('--no-deps' in args)
+        # Up to date; we don't run pip
+        os.rename(pjoin(site_packages, 'other-1.5.dist-info'),
+                  pjoin(site_packages, 'other-2.0.dist-info'))
+        os.unlink(pip_log)
+        check_call([sys.executable, post], env=env)
+        assert_false(os.path.exists(pip_log))
+        # Newer than wheel; we don't downgrade
+        for version in ('2.0.post1', '2.1rc1', '10.0'):
+            os.rename(glob(pjoin(site_packages, 'other-*'))[0],
+                      pjoin(site_packages, 'other-{0}.dist-info'.format(
+                          version)))
+            check_call([sys.executable, post], env=env)
+            assert_false(os.path.exists(pip_log))
+        # Older pre-release, not installed
+        os.rename(pjoin(site_packages, 'other-10.0.dist-info'),
+                  pjoin(site_packages, 'other-2.0rc1.dist-info'))
+        os.rmdir(pjoin(site_packages, 'My_Pkg-1.0.0.dist-info'))
+        check_call([sys.executable, post], env=env)
+        with open(pip_log, 'rt') as fobj:
+            args = fobj.read().split()
+        assert_equal(args[-2:], [pjoin(wheelhouse, fname) for fname in
+                                 ('my_pkg-1.0-py2.py3-none-any.whl',
+                                  'other-2.0-py2.py3-none-any.whl')])
+        os.unlink(pip_log)
+        os.mkdir(pjoin(site_packages, 'My_Pkg-1.0.dist-info'))
+        # Changed wheel missing from update image; need base release
+        os.rename(pjoin(site_packages, 'other-2.0rc1.dist-info'),
+                  pjoin(site_packages, 'other-1.5.dist-info'))
+        os.unlink(pjoin(wheelhouse, 'other-2.0-py2.py3-none-any.whl'))
+        assert_equal(call([sys.executable, post], env=env), 40)
+        assert_false(os.path.exists(pip_log))
+
+
+def test_prune_wheelhouse():
+    # Test update wheelhouse has only new and changed wheels
+    with TemporaryDirectory() as tmpdir:
+        writers = []
+        for version, wheels in (('1.0', (('pkga', '1.0'), ('pkgb', '1.0'),
+                                          ('pkgc', '1.0'))),
+                                ('1.1', (('pkga', '1.0'), ('pkgb', '1.1'),
+                                         ('pkgd', '1.0')))):
+            pkg_writer = PkgWriter('test', version, '3.4.1', ['foo'],
+                                   dmg_build_dir = pjoin(tmpdir, version))
+            os.makedirs(pkg_writer.wheel_build_dir)
+            for name, wheel_version in wheels:
+                make_wheel(pkg_writer.wheel_build_dir, name, wheel_version,
+                           {name + '/__init__.py': b'x = 1\n' * 100})
+            writers.append(pkg_writer)
+        base_manifest = writers[0].write_manifest()
+        new_writer = writers[1]
+        manifest = new_writer.write_manifest()
+        new_writer.prune_wheelhouse(base_manifest)
+        assert_equal(sorted(os.listdir(new_writer.wheel_build_dir)),
+                     ['pkgb-1.1-py2.py3-none-any.whl',
+                      'pkgd-1.0-py2.py3-none-any.whl',
+                      'test-1.1-manifest.json'])
+        report = new_writer.build_report['update']
+        assert_equal(report['base_version'], '1.0')
+        assert_equal((report['wheels_kept'], report['wheels_removed']),
+                     (2, 1))
+        assert_true(report['bytes_removed'] > 0)
+        # Manifest still lists all wheels
+        with open(manifest, 'rt') as fobj:
+            assert_equal(sorted(json.load(fobj)['wheels']),
+                         ['pkga', 'pkgb', 'pkgd'])
+        # Update image name; base must be for same Python
+        exp_name = pjoin(tmpdir, 'test-py34-1.1-update-from-1.0.dmg')
+        with open(exp_name, 'wt') as fobj:
+            fobj.write('My essential data')
+        assert_raises(IOError, new_writer.write_dmg, tmpdir,
+                      base_manifest=base_manifest)
+        other_writer = PkgWriter('test', '1.1', '3.5.1', ['foo'],
+                                 dmg_build_dir = pjoin(tmpdir, '1.1'))
+        assert_raises(ValueError, other_writer.prune_wheelhouse,
+                      base_manifest)
+
+
+def test_write_post_compiled():
+    # Byte-compiled wheels tell pip not to compile on install
+    pkg_writer = PkgWriter('test', '1', '3.7.1', ['foo', 'bar'])
+    with TemporaryDirectory() as tmpdir:
+        with open(pkg_writer.write_post(tmpdir), 'rt') as fobj:
+            assert_false('--no-compile' in fobj.read())
+    pkg_writer = PkgWriter('test', '1', '3.7.1', ['foo', 'bar'],
+                           compile_wheels = True)
+    with TemporaryDirectory() as tmpdir:
+        with open(pkg_writer.write_post(tmpdir), 'rt') as fobj:
+            assert_true("            '--no-compile',\n" in fobj.read())
+    # Need Python >= 3.7 for hash-based pyc files
+    assert_raises(ValueError, PkgWriter, 'test', '1', '3.4.1', ['foo'],
+                  compile_wheels = True)
+
+
+def test_compile_wheel():
+    # Test adding compiled files to wheel
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'mypkg', '1.0',
+                           {'mypkg/__init__.py': b'x = 1\n',
+                            'mypkg/sub.py': b'y = 2\n',
+                            'mypkg-1.0.data/scripts/myscript.py':
+                            b'print(1)\n'})
+        compile_wheel(wheel, sys.executable)
+        with zipfile.ZipFile(wheel) as zf:
+            names = zf.namelist()
+            record = zf.read('mypkg-1.0.dist-info/RECORD').decode('utf-8')
+    pycs = [name for name in names if name.endswith('.pyc')]
+    assert_equal(len(pycs), 2)
+    for pyc in pycs:
+        assert_true(pyc.startswith('mypkg/__pycache__/'))
+        assert_true(pyc in record)
+
+
+def _pip_install_time(wheel, target, extra_args=()):
+    # Time pip install of `wheel` into `target`
+    start = time.time()
+    check_call([sys.executable, '-m', 'pip', 'install', '-q', '--no-deps',
+                '--no-index', '--target', target] + list(extra_args) +
+               [wheel])
+    return time.time() - start
+
+
+def test_install_benchmark():
+    # Install time for wheel with and without byte-compiled files
+    #
+    # Set WHEELS2DMG_BENCH_MODULES to a few thousand and run with ``-s`` to
+    # see the times; ``make benchmark`` does this.
+    if sys.version_info[:2] < (3, 7):
+        raise SkipTest('Need Python >= 3.7 for hash-based pyc files')
+    if call([sys.executable, '-m', 'pip', '--version']) != 0:
+        raise SkipTest('Need pip for install benchmark')
+    files = dict(('bench/mod{0}.py'.format(i),
+                  ('def f{0}(x):\n    return x + {0}\n'.format(i) * 50
+                  ).encode('ascii'))
+                 for i in range(BENCH_MODULES))
+    files['bench/__init__.py'] = b''
+    with TemporaryDirectory() as tmpdir:
+        os.mkdir(pjoin(tmpdir, 'plain'))
+        os.mkdir(pjoin(tmpdir, 'compiled'))
+        plain = make_wheel(pjoin(tmpdir, 'plain'), 'bench', '1.0', files)
+        compiled = pjoin(tmpdir, 'compiled', basename(plain))
+        shutil.copy(plain, compiled)
+        compile_wheel(compiled, sys.executable)
+        # pip compiles the plain wheel; the installer does not compile the
+        # byte-compiled wheel
+        before = _pip_install_time(plain, pjoin(tmpdir, 'before'))
+        after = _pip_install_time(compiled, pjoin(tmpdir, 'after'),
+                                  ['--no-compile'])
+        print('Install {0} modules; pip compiling {1:.2f}s, '
+              'byte-compiled wheel {2:.2f}s'.format(BENCH_MODULES, before,
+                                                     after))
+        # Same compiled files installed
+        for prefix in ('before', 'after'):
+            cache_dir = pjoin(tmpdir, prefix, 'bench', '__pycache__')
+            assert_equal(len([f for f in os.listdir(cache_dir)
+                              if f.endswith('.pyc')]), BENCH_MODULES + 1)
+
+
+def test_dedup_wheels():
+    # Test report and consolidation of libraries copied into several wheels
+    lib = make_macho('/DLC/libfoo.dylib')
+    assert_raises(ValueError, PkgWriter, 'test', '1.0', '3.4.1', ['foo'],
+                  dedup_libs = 'remove')
+    for mode in ('report', 'consolidate'):
+        with TemporaryDirectory() as tmpdir:
+            pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['foo'],
+                                   dmg_build_dir = tmpdir,
+                                   dedup_libs = mode)
+            os.makedirs(pkg_writer.wheel_build_dir)
+            for name in ('pkga', 'pkgb'):
+                make_wheel(pkg_writer.wheel_build_dir, name, '1.0',
+                           {name + '/_ext.so': make_macho(
+                               depends=['@loader_path/.dylibs/libfoo.dylib']),
+                            name + '/.dylibs/libfoo.dylib': lib},
+                           platform='macosx_10_6_intel')
+            pkg_writer.dedup_wheels()
+            report = pkg_writer.build_report['dedup']
+            assert_equal(report['duplicated_bytes'], len(lib))
+            wheels = sorted(os.listdir(pkg_writer.wheel_build_dir))
+            if mode == 'report':
+                assert_false('support_wheel' in report)
+                assert_equal(len(wheels), 2)
+                continue
+            support = 'test_dylibs-1.0-py2.py3-none-macosx_10_6_intel.whl'
+            assert_equal(report['support_wheel'], support)
+            assert_equal(report['consolidated'], ['libfoo.dylib'])
+            assert_equal(report['bytes_saved'], len(lib))
+            assert_true(support in wheels)
+
+
+def test_thin_wheel():
+    # Test removing architectures from binaries in wheel
+    i386, x86_64 = b'i386' * 1000, b'x86_64' * 1000
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'mypkg', '1.0',
+                           {'mypkg/__init__.py': b'x = 1\n',
+                            'mypkg/_ext.so': make_fat_binary(
+                                [('i386', i386), ('x86_64', x86_64)])},
+                           platform='macosx_10_6_intel')
+        out_fname, n_removed = thin_wheel(wheel, ['x86_64'])
+        assert_equal(basename(out_fname),
+                     'mypkg-1.0-cp34-none-macosx_10_6_x86_64.whl')
+        assert_false(os.path.exists(wheel))
+        assert_true(n_removed > len(i386))
+        with zipfile.ZipFile(out_fname) as zf:
+            assert_equal(zf.read('mypkg/_ext.so'), x86_64)
+            wheel_info = zf.read('mypkg-1.0.dist-info/WHEEL').decode('utf-8')
+            record = zf.read('mypkg-1.0.dist-info/RECORD').decode('utf-8')
+        assert_true('Tag: cp34-none-macosx_10_6_x86_64' in wheel_info)
+        assert_false('intel' in wheel_info)
+        assert_true('mypkg/_ext.so,sha256=' in record)
+        assert_true(',{0}'.format(len(x86_64)) in record)
+        # Already thin; same wheel, not written again
+        os.utime(out_fname, (0, 0))
+        assert_equal(thin_wheel(out_fname, ['x86_64']), (out_fname, 0))
+        assert_equal(os.stat(out_fname).st_mtime, 0)
+        # Keep both; nothing changes
+        wheel = make_wheel(tmpdir, 'other', '1.0',
+                           {'other/_ext.so': make_fat_binary(
+                               [('i386', i386), ('x86_64', x86_64)])},
+                           platform='macosx_10_6_intel')
+        os.utime(wheel, (0, 0))
+        assert_equal(thin_wheel(wheel, ['i386', 'x86_64']), (wheel, 0))
+        assert_equal(os.stat(wheel).st_mtime, 0)
+        # No platform for architectures; error, wheel left alone
+        assert_raises(MachOError, thin_wheel, wheel, ['arm64'])
+        assert_equal(os.stat(wheel).st_mtime, 0)
+        with zipfile.ZipFile(wheel) as zf:
+            zf.extract('other/_ext.so', tmpdir)
+        assert_equal(get_archs(pjoin(tmpdir, 'other', '_ext.so')),
+                     set(['i386', 'x86_64']))
+
+
+def test_recompress_wheel():
+    # Test rewriting wheel with different compression
+    files = {'mypkg/__init__.py': b'x = 1\n' * 1000,
+             'mypkg/data.txt': b'Some text\n' * 1000}
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'mypkg', '1.0', files)
+        with zipfile.ZipFile(wheel) as zf:
+            orig_infos = zf.infolist()
+            orig_contents = [zf.read(info) for info in orig_infos]
+        before, after = recompress_wheel(wheel, 'keep')
+        assert_equal(before, after)
+        for policy, compression in (('store', zipfile.ZIP_STORED),
+                                    ('max-deflate', zipfile.ZIP_DEFLATED)):
+            sizes = recompress_wheel(wheel, policy)
+            assert_equal(sizes[1], os.path.getsize(wheel))
+            with zipfile.ZipFile(wheel) as zf:
+                assert_equal(zf.testzip(), None)
+                infos = zf.infolist()
+                assert_equal([zf.read(info) for info in infos],
+                             orig_contents)
+            for info, orig_info in zip(infos, orig_infos):
+                assert_equal(info.filename, orig_info.filename)
+                assert_equal(info.date_time, orig_info.date_time)
+                assert_equal(info.external_attr, orig_info.external_attr)
+                assert_equal(info.compress_type, compression)
+            if policy == 'store':
+                assert_true(sizes[1] > sizes[0])
+            else:
+                assert_true(sizes[1] < sizes[0])
+        assert_raises(ValueError, recompress_wheel, wheel, 'squash')
+    assert_raises(ValueError, PkgWriter, 'test', '1', '3.4.1', ['foo'],
+                  recompress='squash')
+
+
+def test_build_sdists():
+    # Test parallel build of sdists
+    import pip
+    if int(pip.__version__.split('.')[0]) < 10:
+        raise SkipTest('Need pip >= 10 for --no-build-isolation')
+    with TemporaryDirectory() as tmpdir:
+        sdists = dict((name, make_sdist(tmpdir, name, '1.0'))
+                      for name in ('pkga', 'pkgb', 'pkgc'))
+        pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'],
+                               dmg_build_dir = pjoin(tmpdir, 'build'),
+                               scratch_dir = pjoin(tmpdir, 'scratch'),
+                               build_jobs = 4)
+        os.makedirs(pkg_writer.wheel_build_dir)
+        pkg_writer.build_sdists([sys.executable, '-m', 'pip'], sdists,
+                                ['--no-index', '--no-build-isolation'])
+        wheels = sorted(basename(w) for w in
+                        glob(pjoin(pkg_writer.wheel_build_dir, '*.whl')))
+        assert_equal(wheels, ['{0}-1.0-py3-none-any.whl'.format(name)
+                              for name in sorted(sdists)])
+        report = pkg_writer.build_report['source_builds']
+        assert_equal(report['workers'], 3)
+        assert_equal(report['jobs_per_build'], 1)
+        assert_equal(sorted(report['times']), sorted(sdists))
+        for name in sdists:
+            assert_true(os.path.isfile(pjoin(report['log_dir'],
+                                             name + '.log')))
+
+
+def test_download_build():
+    # Test we only use wheels and sdists from the current download
+    import pip
+    if int(pip.__version__.split('.')[0]) < 10:
+        raise SkipTest('Need pip >= 10 for --no-build-isolation')
+    with TemporaryDirectory() as tmpdir:
+        links = pjoin(tmpdir, 'links')
+        os.mkdir(links)
+        for name in ('pip', 'setuptools'):
+            make_wheel(links, name, '99.0', {name + '/__init__.py': b''})
+        pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'],
+                               dmg_build_dir = pjoin(tmpdir, 'build'),
+                               scratch_dir = pjoin(tmpdir, 'scratch'),
+                               build_jobs = 2)
+        pkg_writer.runner.echo = False
+        wheelhouse = pkg_writer.wheel_build_dir
+        fetch_params = ['--no-index', '--no-build-isolation', '-f', links]
+        for version in ('1.0', '2.0'):
+            make_wheel(links, 'pkga', version, {'pkga/__init__.py': b''})
+            make_sdist(links, 'pkgb', version)
+            if os.path.isdir(wheelhouse):
+                shutil.rmtree(wheelhouse)
+            os.makedirs(wheelhouse)
+            pkg_writer._download_build(
+                [sys.executable, '-m', 'pip'],
+                ['pkga==' + version, 'pkgb==' + version], fetch_params)
+            wheels = sorted(basename(w) for w in
+                            glob(pjoin(wheelhouse, '*.whl')))
+            assert_equal(wheels, [
+                'pip-99.0-py2.py3-none-any.whl',
+                'pkga-{0}-py2.py3-none-any.whl'.format(version),
+                'pkgb-{0}-py3-none-any.whl'.format(version),
+                'setuptools-99.0-py2.py3-none-any.whl'])
+        REAPER.wait()
+
+
+def test_source_cache():
+    # Test we reuse wheels built from source
+    import pip
+    if int(pip.__version__.split('.')[0]) < 10:
+        raise SkipTest('Need pip >= 10 for --no-build-isolation')
+    with TemporaryDirectory() as tmpdir:
+        sdists = dict((name, make_sdist(tmpdir, name, '1.0'))
+                      for name in ('pkga', 'pkgb'))
+        cache_dir = pjoin(tmpdir, 'cache')
+        for i, exp_stats in enumerate((dict(hits=0, misses=2),
+                                       dict(hits=2, misses=0))):
+            pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'],
+                                   dmg_build_dir = pjoin(tmpdir,
+                                                         'build{0}'.format(i)),
+                                   source_cache_dir = cache_dir)
+            os.makedirs(pkg_writer.wheel_build_dir)
+            pkg_writer.build_sdists([sys.executable, '-m', 'pip'], sdists,
+                                    ['--no-index', '--no-build-isolation'])
+            assert_equal(sorted(os.listdir(pkg_writer.wheel_build_dir)),
+                         ['pkga-1.0-py3-none-any.whl',
+                          'pkgb-1.0-py3-none-any.whl'])
+            assert_equal(pkg_writer.build_report['source_cache'], exp_stats)
+        assert_equal(pkg_writer.build_report['source_builds']['times'], {})
+        # Key depends on sdist, Python version, environment
+        compiler_id = pkg_writer.compiler_identity()
+        key = pkg_writer.source_key(sdists['pkga'], compiler_id)
+        assert_equal(key, pkg_writer.source_key(sdists['pkga'], compiler_id))
+        assert_not_equal(key, pkg_writer.source_key(sdists['pkgb'],
+                                                    compiler_id))
+        assert_not_equal(key, pkg_writer.source_key(sdists['pkga'], 'gcc 1'))
+        other_writer = PkgWriter('test', '1', '3.5.1', ['foo'])
+        assert_not_equal(key, other_writer.source_key(sdists['pkga'],
+                                                      compiler_id))
+        old_target = os.environ.get('MACOSX_DEPLOYMENT_TARGET')
+        os.environ['MACOSX_DEPLOYMENT_TARGET'] = '10.99'
+        try:
+            assert_not_equal(key, pkg_writer.source_key(sdists['pkga'],
+                                                        compiler_id))
+        finally:
+            if old_target is None:
+                del os.environ['MACOSX_DEPLOYMENT_TARGET']
+            else:
+                os.environ['MACOSX_DEPLOYMENT_TARGET'] = old_target
+
+
+def test_compiler_identity():
+    # CC can have arguments
+    pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'])
+    old_cc = os.environ.get('CC')
+    os.environ['CC'] = '{0} -c "print(\'mycc 1.0\')"'.format(sys.executable)
+    try:
+        assert_equal(pkg_writer.compiler_identity(), 'mycc 1.0')
+        os.environ['CC'] = '/nowhere/cc -arch x86_64'
+        assert_equal(pkg_writer.compiler_identity(), '')
+    finally:
+        if old_cc is None:
+            del os.environ['CC']
+        else:
+            os.environ['CC'] = old_cc
+
+def test_process_wheels_cache():
+    # Test we reuse processed wheels from the delocate cache
+    with TemporaryDirectory() as tmpdir:
+        cache_dir = pjoin(tmpdir, 'cache')
+        for exp_stats, action in ((dict(hits=0, misses=1), 'retagged'),
+                                  (dict(hits=1, misses=0), 'cached')):
+            pkg_writer = PkgWriter('test', '1', '3.4.1', ['foo'],
+                                   dmg_build_dir = pjoin(tmpdir, 'build'),
+                                   delocate_wheels = False,
+                                   delocate_cache_dir = cache_dir)
+            events = []
+            pkg_writer.events.add_callback(events.append)
+            wheelhouse = pkg_writer.wheel_build_dir
+            if os.path.isdir(wheelhouse):
+                shutil.rmtree(wheelhouse)
+            os.makedirs(wheelhouse)
+            make_wheel(wheelhouse, 'foo', '1.0', {'foo/__init__.py': b''},
+                       platform='macosx_10_6_intel')
+            pkg_writer.process_wheels()
+            assert_equal(pkg_writer.build_report['delocate_cache'], exp_stats)
+            wheels = [basename(w) for w in glob(pjoin(wheelhouse, '*.whl'))]
+            assert_equal(len(wheels), 1)
+            assert_true('macosx_10_10_x86_64' in wheels[0])
+            assert_equal([event.info for event in events],
+                         [dict(filename=wheels[0], action=action)])
+
+
+def test_writer_close():
+    # Test temporary directories removed, scratch reused after close
+    with TemporaryDirectory() as tmpdir:
+        with PkgWriter('test', '1', '3.4.1', ['foo'],
+                       temp_root=tmpdir) as pkg_writer:
+            build_dir = pkg_writer.dmg_build_dir
+            scratch_dir = pkg_writer.scratch_dir
+            assert_true(os.path.isdir(build_dir))
+            assert_true(os.path.isdir(scratch_dir))
+            assert_equal(dirname(dirname(build_dir)), tmpdir)
+            assert_equal(dirname(scratch_dir), tmpdir)
+            # Nothing but the build itself in the disk image contents
+            assert_equal(os.listdir(build_dir), [])
+            os.mkdir(pjoin(scratch_dir, 'build-logs'))
+        assert_false(os.path.exists(build_dir))
+        pkg_writer.close()
+        REAPER.wait()
+        assert_equal(os.listdir(tmpdir), [basename(scratch_dir)])
+        assert_false(os.path.exists(pjoin(scratch_dir, 'build-logs')))
+        # Next writer gets the same scratch directory
+        with PkgWriter('test', '1', '3.4.1', ['foo'],
+                       temp_root=tmpdir) as pkg_writer:
+            assert_equal(pkg_writer.scratch_dir, scratch_dir)
+            assert_not_equal(pkg_writer.dmg_build_dir, build_dir)
+        REAPER.wait()
+
+
+def test_writer_exit():
+    # Writer not closed before exit does not hang the interpreter
+    with TemporaryDirectory() as tmpdir:
+        script = ('from wheels2dmg.pkgbuilders import PkgWriter\n'
+                  'WRITER = PkgWriter("test", "1", "3.4.1", ["foo"], '
+                  'temp_root={0!r})\n'
+                  'WRITER.dmg_build_dir\n').format(tmpdir)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [dirname(dirname(TEMPLATE_PATH))] +
+            [p for p in [env.get('PYTHONPATH')] if p])
+        proc = Popen([sys.executable, '-c', script], env=env)
+        for i in range(600):
+            if not proc.poll() is None:
+                break
+            time.sleep(0.1)
+        else:
+            proc.kill()
+            proc.wait()
+        assert_equal(proc.returncode, 0)
+        assert_equal(os.listdir(tmpdir), [])
+
+
+def test_record_build():
+    # Test recording build in history database
+    with TemporaryDirectory() as tmpdir:
+        history_db = pjoin(tmpdir, 'history.db')
+        pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['foo'],
+                               history_db = history_db)
+        os.makedirs(pkg_writer.wheel_build_dir)
+        make_wheel(pkg_writer.wheel_build_dir, 'foo', '1.0', {})
+        with pkg_writer.stage('get_wheels'):
+            pass
+        build_id = pkg_writer.record_build(0, pjoin(tmpdir, 'not.dmg'),
+                                           'Failed')
+        build = pkg_writer.history.get(build_id)
+        assert_equal(build['status'], 'failed')
+        assert_equal(build['error'], 'Failed')
+        assert_equal(build['pyv_mm'], '34')
+        assert_equal(build['dmg_size'], None)
+        assert_equal(list(build['stage_times']), ['get_wheels'])
+        assert_equal(list(build['wheels']), ['foo-1.0-py2.py3-none-any.whl'])
+        assert_equal(build['inputs_digest'], pkg_writer.inputs_digest())
+    # Digest depends on inputs
+    digest = PkgWriter('test', '1.0', '3.4.1', ['foo']).inputs_digest()
+    assert_equal(digest,
+                 PkgWriter('test', '1.1', '3.4.1', ['foo']).inputs_digest())
+    assert_not_equal(digest,
+                     PkgWriter('test', '1.0', '3.4.2',
+                               ['foo']).inputs_digest())
+    assert_not_equal(digest,
+                     PkgWriter('test', '1.0', '3.4.1',
+                               ['foo', 'bar']).inputs_digest())
 
 
 def test_chatty_names():
@@ -183,6 +873,55 @@ def test_identifier():
                  'org.dynevor.paul.another-py33')
 
 
+def test_write_outputs():
+    # Test writing wheelhouse archive output, sharing wheel hashes
+    with TemporaryDirectory() as tmpdir:
+        pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['pkga'],
+                               dmg_build_dir = pjoin(tmpdir, 'build'))
+        os.makedirs(pkg_writer.wheel_build_dir)
+        wheel = make_wheel(pkg_writer.wheel_build_dir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 1\n'})
+        assert_equal(pkg_writer.wheel_hashes(), {wheel: file_sha256(wheel)})
+        pkg_writer.write_manifest()
+        assert_raises(ValueError, pkg_writer.write_dmg, tmpdir,
+                      wheelhouse=False, formats=['zip'])
+        dmg_fname = pkg_writer.write_dmg(tmpdir, wheelhouse=False,
+                                         formats=['wheelhouse'])
+        assert_equal(dmg_fname, None)
+        archive = pjoin(tmpdir, 'test-py34-1.0-wheelhouse.tar.gz')
+        assert_equal(dict(pkg_writer.outputs), {'wheelhouse': archive})
+        report = pkg_writer.build_report['outputs']['wheelhouse']
+        assert_equal(report['filename'], basename(archive))
+        assert_true('output_wheelhouse' in pkg_writer.build_report['stages'])
+        # We checked the wheels before writing
+        assert_equal(pkg_writer.build_report['verify']['wheels'], 1)
+        # Size report next to the outputs
+        sizes = pkg_writer.build_report['sizes']
+        assert_equal(sizes['summary'], pjoin(tmpdir,
+                                             'test-py34-1.0-sizes.txt'))
+        with open(pjoin(tmpdir, 'test-py34-1.0-sizes.json'), 'rt') as fobj:
+            assert_equal(json.load(fobj)['total'], sizes['total'])
+        with tarfile.open(archive) as tf:
+            names = tf.getnames()
+        for name in ('README.txt',
+                     'wheels/pkga-1.0-py2.py3-none-any.whl',
+                     'wheels/test-1.0-manifest.json'):
+            assert_true('test-py34-1.0/' + name in names)
+        assert_true(os.path.exists(pjoin(tmpdir,
+                                         'test-py34-1.0-manifest.json')))
+        assert_raises(IOError, pkg_writer.write_dmg, tmpdir,
+                      wheelhouse=False, formats=['wheelhouse'])
+        # Contents over budget
+        pkg_writer.size_budget = sizes['total'] - 1
+        assert_raises(SizeBudgetError, pkg_writer.write_dmg, tmpdir,
+                      clobber=True, wheelhouse=False, formats=['wheelhouse'])
+        assert_false('wheelhouse' in pkg_writer.outputs)
+        # Changed wheels get new hashes
+        wheel = make_wheel(pkg_writer.wheel_build_dir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 2\n'})
+        assert_equal(pkg_writer.wheel_hashes(), {wheel: file_sha256(wheel)})
+
+
 def test_dmg_no_clobber():
     # Test IOError if dmg exists
     pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['foo', 'bar'])
@@ -214,6 +953,51 @@ def test_template_override():
         assert_equal(tpl.filename, original_fname)
 
 
+def test_writer_templates():
+    # Check writers with different template paths can render in parallel
+    from multiprocessing.pool import ThreadPool
+    with TemporaryDirectory() as tmpdir:
+        writers = []
+        for i in range(4):
+            tpl_dir = pjoin(tmpdir, 'templates{0}'.format(i))
+            os.mkdir(tpl_dir)
+            with open(pjoin(tpl_dir, 'README.txt'), 'wt') as fobj:
+                fobj.write('Readme {0} for {{{{ info.pkg_name }}}}'.format(i))
+            writers.append(PkgWriter('pkg{0}'.format(i), '1', '3.4.1',
+                                     ['foo'],
+                                     dmg_build_dir = pjoin(tmpdir,
+                                                           'build{0}'.format(i)),
+                                     template_dirs = [tpl_dir]))
+        default_writer = PkgWriter('test', '1', '3.4.1', ['foo'])
+        pool = ThreadPool(len(writers))
+        try:
+            readmes = pool.map(
+                lambda writer : writer.get_template('README.txt').render(
+                    info = writer),
+                writers * 5)
+        finally:
+            pool.close()
+            pool.join()
+        for i, readme in enumerate(readmes):
+            assert_equal(readme, 'Readme {0} for pkg{0}'.format(i % 4))
+        assert_file_equal_string(writers[1].write_readme(),
+                                 'Readme 1 for pkg1')
+        # Default writer uses default templates
+        assert_equal(default_writer.get_template('README.txt').filename,
+                     pjoin(TEMPLATE_PATH, 'README.txt'))
+        assert_equal(default_writer.get_template('unlikely_name.foo'), None)
+        # Writer template path includes global path at creation
+        insert_template_path(pjoin(tmpdir, 'templates0'))
+        try:
+            writer = PkgWriter('test', '1', '3.4.1', ['foo'])
+        finally:
+            pop_template_path()
+        assert_equal(writer.get_template('README.txt').filename,
+                     pjoin(tmpdir, 'templates0', 'README.txt'))
+        assert_equal(default_writer.get_template('README.txt').filename,
+                     pjoin(TEMPLATE_PATH, 'README.txt'))
+
+
 def test_get_template():
     tpl_fname = pjoin(TEMPLATE_PATH, 'requirements.txt')
     assert_equal(get_template('requirements.txt').filename, tpl_fname)
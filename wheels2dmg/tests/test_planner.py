@@ -0,0 +1,203 @@
+""" Testing planner module
+"""
+
+from os.path import join as pjoin
+
+from ..planner import (version_key, is_prerelease, version_matches,
+                       parse_requires_dist, wheel_compatible, plan_build,
+                       BuildPlanner)
+from ..pkgbuilders import PkgWriter
+from ..catalog import WheelCatalog
+from ..history import BuildHistory
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+
+def test_version_key():
+    versions = ['1.0.post1', '1.0', '1.0rc1', '1.0.dev1', '1.0a1', '1.0b2',
+                '1.0.1', '0.9', '1.0.post2', '1.0b10']
+    assert_equal(sorted(versions, key=version_key),
+                 ['0.9', '1.0.dev1', '1.0a1', '1.0b2', '1.0b10', '1.0rc1',
+                  '1.0', '1.0.post1', '1.0.post2', '1.0.1'])
+    assert_true(version_key('1.0-1') > version_key('1.0'))
+    assert_true(version_key('1.0.post1.dev1') < version_key('1.0.post1'))
+
+
+def test_is_prerelease():
+    for version in ('1.0rc1', '1.0.dev1', '2.0a1', '2.0beta', '1.0c1'):
+        assert_true(is_prerelease(version))
+    for version in ('1.0', '1.0.post1', '1.0-1', '2014.04'):
+        assert_false(is_prerelease(version))
+
+
+def test_version_matches():
+    assert_true(version_matches('1.0', []))
+    assert_true(version_matches('1.6', [('>=', '1.6')]))
+    assert_false(version_matches('1.5.9', [('>=', '1.6')]))
+    assert_true(version_matches('1.10', [('>', '1.9')]))
+    assert_true(version_matches('1.2.0', [('==', '1.2')]))
+    assert_false(version_matches('1.2.1', [('==', '1.2')]))
+    assert_true(version_matches('1.2.1', [('==', '1.2.*')]))
+    assert_false(version_matches('1.2', [('!=', '1.2.0')]))
+    assert_true(version_matches('1.2', [('>=', '1.1'), ('<', '1.3')]))
+    assert_false(version_matches('1.3rc1', [('>=', '1.3')]))
+    assert_true(version_matches('1.4.5', [('~=', '1.4.2')]))
+    assert_false(version_matches('1.5', [('~=', '1.4.2')]))
+
+
+def test_parse_requires_dist():
+    assert_equal(parse_requires_dist('numpy'), ('numpy', [], []))
+    assert_equal(parse_requires_dist('numpy (>=1.6)'),
+                 ('numpy', [], [('>=', '1.6')]))
+    assert_equal(parse_requires_dist('ipython[test] >=1.0,<2'),
+                 ('ipython', ['test'], [('>=', '1.0'), ('<', '2')]))
+    assert_equal(parse_requires_dist('nose; extra == "test"'), None)
+    assert_equal(parse_requires_dist('nose; extra == "test"', ['test']),
+                 ('nose', [], []))
+    assert_equal(parse_requires_dist('pywin32; sys_platform == "win32"'),
+                 None)
+
+
+def test_wheel_compatible():
+    assert_true(wheel_compatible('foo-1.0-py2.py3-none-any.whl', '34'))
+    assert_true(wheel_compatible('foo-1.0-py3-none-any.whl', '34'))
+    assert_false(wheel_compatible('foo-1.0-py3-none-any.whl', '27'))
+    assert_true(wheel_compatible(
+        'foo-1.0-cp34-cp34m-macosx_10_6_intel.whl', '34'))
+    assert_false(wheel_compatible(
+        'foo-1.0-cp33-cp33m-macosx_10_6_intel.whl', '34'))
+    assert_false(wheel_compatible(
+        'foo-1.0-cp34-cp34m-win32.whl', '34'))
+    assert_false(wheel_compatible('foo-1.0.tar.gz', '34'))
+
+
+def fake_index(name, version=None):
+    # Fake index JSON metadata for tests
+    releases = {
+        'pip': {'1.5.6': [{'packagetype': 'bdist_wheel',
+                           'filename': 'pip-1.5.6-py2.py3-none-any.whl',
+                           'url': 'http://example.com/pip.whl',
+                           'size': 1000}]},
+        'setuptools': {'7.0': [{'packagetype': 'bdist_wheel',
+                                'filename':
+                                'setuptools-7.0-py2.py3-none-any.whl',
+                                'url': 'http://example.com/st.whl',
+                                'size': 2000}]},
+        'bar': {'0.9': [{'packagetype': 'sdist',
+                         'filename': 'bar-0.9.tar.gz',
+                         'url': 'http://example.com/bar.tar.gz',
+                         'size': 500}],
+                '1.0': [{'packagetype': 'sdist',
+                         'filename': 'bar-1.0.tar.gz',
+                         'url': 'http://example.com/bar.tar.gz',
+                         'size': 600}]},
+    }
+    if not name in releases:
+        return None
+    versions = releases[name]
+    latest = sorted(versions)[-1]
+    return dict(info=dict(version=latest if version is None else version,
+                          requires_dist=None),
+                releases=versions)
+
+
+def test_from_index():
+    # Pre-releases only when asked for, or nothing else matches; yanked files
+    # only when pinned
+    def sdist(version, **kwargs):
+        info = dict(packagetype='sdist',
+                    filename='qux-{0}.tar.gz'.format(version),
+                    url='http://example.com/qux-{0}.tar.gz'.format(version),
+                    size=100)
+        info.update(kwargs)
+        return [info]
+
+    releases = {'1.0': sdist('1.0'),
+                '1.0.post1': sdist('1.0.post1'),
+                '1.1': sdist('1.1', yanked=True),
+                '2.0rc1': sdist('2.0rc1')}
+
+    def index(name, version=None):
+        return dict(info=dict(version='2.0rc1' if version is None
+                              else version, requires_dist=None),
+                    releases=releases)
+
+    pkg_writer = PkgWriter('test', '1.0', '3.4.1', ['qux'])
+    planner = BuildPlanner(pkg_writer, index)
+    for specs, version in (([], '1.0.post1'),
+                           ([('<', '1.0.post1')], '1.0'),
+                           ([('>=', '2.0rc1')], '2.0rc1'),
+                           ([('==', '1.1')], '1.1'),
+                           ([('>', '1.0.post1')], '2.0rc1')):
+        assert_equal(planner._from_index('qux', specs)[0], version)
+    del releases['2.0rc1']
+    assert_equal(planner._from_index('qux', [('>', '1.0.post1')]), None)
+
+
+def test_plan_build():
+    with TemporaryDirectory() as tmpdir:
+        foo = make_wheel(tmpdir, 'foo', '1.0', {'foo/__init__.py': b''},
+                         platform='macosx_10_6_intel',
+                         requires=['bar (<1.0)', 'baz; extra == "test"'])
+        pkg_writer = PkgWriter('test', '1.0', '3.4.1',
+                               ['foo', 'missing', '-f', tmpdir])
+        plan = plan_build(pkg_writer, fake_index)
+    wheels = dict((w['name'], w) for w in plan['wheels'])
+    assert_equal(sorted(wheels), ['bar', 'foo', 'missing', 'pip',
+                                  'setuptools'])
+    assert_equal(wheels['foo']['source'], foo)
+    assert_true(wheels['foo']['cached'])
+    assert_equal(wheels['foo']['action'], 'download')
+    assert_true(wheels['foo']['needs_delocate'])
+    assert_equal(wheels['bar']['version'], '0.9')
+    assert_equal(wheels['bar']['action'], 'compile')
+    assert_equal(wheels['bar']['size'], 500)
+    assert_equal(wheels['missing']['action'], 'unknown')
+    assert_equal(wheels['pip']['action'], 'download')
+    assert_false(wheels['pip']['needs_delocate'])
+    assert_equal(plan['n_compile'], 1)
+    assert_equal(plan['n_download'], 3)
+    assert_equal(plan['n_unknown'], 1)
+    assert_equal(plan['cache_hit_ratio'], 1 / 5.)
+    assert_equal(plan['wheelhouse_size'],
+                 3500 + wheels['foo']['size'])
+    assert_equal(plan['time_estimate'], None)
+
+
+def test_plan_catalog_history():
+    # Test plan reads catalog without updating it, estimates times
+    with TemporaryDirectory() as tmpdir:
+        make_wheel(tmpdir, 'foo', '1.0', {'foo/__init__.py': b''},
+                   requires=['bar'])
+        catalog_db = pjoin(tmpdir, 'catalog.db')
+        history_db = pjoin(tmpdir, 'history.db')
+        history = BuildHistory(history_db)
+        for total_time in (10., 14., 12.):
+            history.record('test', '1.0', '34', 0., 'digest', 'ok',
+                           total_time, {'get_wheels': total_time - 2},
+                           [], None)
+        history.record('test', '1.0', '34', 0., 'digest', 'failed', 1.,
+                       {}, [], None)
+        history.close()
+        pkg_writer = PkgWriter('test', '1.0', '3.4.1',
+                               ['foo', '--no-index', '-f', tmpdir],
+                               catalog_db = catalog_db,
+                               history_db = history_db)
+        plan = plan_build(pkg_writer)
+        assert_equal(pkg_writer.catalog.query(), [])
+        wheels = dict((w['name'], w) for w in plan['wheels'])
+        assert_equal(sorted(wheels), ['bar', 'foo', 'pip', 'setuptools'])
+        estimate = plan['time_estimate']
+        assert_equal(estimate['total_time'], 12.)
+        assert_equal(estimate['stage_times'], {'get_wheels': 10.})
+        assert_equal(estimate['build_ids'], [3, 2, 1])
+        # Catalog entries used, if current
+        pkg_writer.catalog.update(tmpdir)
+        plan = plan_build(pkg_writer)
+        assert_equal(sorted(w['name'] for w in plan['wheels']),
+                     ['bar', 'foo', 'pip', 'setuptools'])
+        pkg_writer.catalog.close()
+        pkg_writer.history.close()
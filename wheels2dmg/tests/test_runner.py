@@ -0,0 +1,71 @@
+""" Testing runner module
+"""
+
+import sys
+import json
+from subprocess import CalledProcessError
+
+from ..runner import CommandRunner
+from ..tmpdirs import InTemporaryDirectory
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+
+def test_run():
+    # Test running command and recording output, resources
+    runner = CommandRunner(echo=False, tail_lines=2)
+    record = runner.run([sys.executable, '-c',
+                         'print("one"); print("two"); print("three")'])
+    assert_equal(record.returncode, 0)
+    assert_equal(record.output_tail.splitlines(), ['two', 'three'])
+    assert_true(record.wall_time > 0)
+    assert_true(record.user_time >= 0)
+    assert_true(record.sys_time >= 0)
+    assert_true(record.max_rss > 0)
+    assert_equal(record.name, record.cmd[0].split('/')[-1])
+    assert_equal(runner.records, [record])
+    # Failing command recorded, not raised
+    record = runner.run([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    assert_equal(record.returncode, 3)
+    assert_equal(len(runner.records), 2)
+    # Stderr goes to output
+    record = runner.run([sys.executable, '-c',
+                         'import sys; sys.stderr.write("err\\n")'])
+    assert_equal(record.output_tail, 'err\n')
+
+
+def test_check_call():
+    runner = CommandRunner(echo=False)
+    runner.check_call([sys.executable, '-c', 'pass'])
+    assert_raises(CalledProcessError, runner.check_call,
+                  [sys.executable, '-c', 'import sys; sys.exit(1)'])
+    assert_equal([r.returncode for r in runner.records], [0, 1])
+    summary = runner.summary()
+    assert_equal(list(summary), [runner.records[0].name])
+    assert_equal(summary[runner.records[0].name]['calls'], 2)
+
+
+def test_log():
+    # Test logging to JSON lines
+    with InTemporaryDirectory():
+        runner = CommandRunner('commands.jsonl', echo=False)
+        runner.check_call([sys.executable, '-c', 'print("hello")'])
+        runner.check_call([sys.executable, '-c', 'pass'])
+        with open('commands.jsonl', 'rt') as fobj:
+            lines = fobj.readlines()
+        assert_equal(len(lines), 2)
+        record = json.loads(lines[0])
+        assert_equal(record['cmd'], [sys.executable, '-c', 'print("hello")'])
+        assert_equal(record['returncode'], 0)
+        assert_equal(record['output_tail'], 'hello\n')
+        for key in ('wall_time', 'user_time', 'sys_time', 'max_rss',
+                    'start_time'):
+            assert_true(key in record)
+        # Full output to file
+        runner.run([sys.executable, '-c', 'for i in range(100): print(i)'],
+                   output_fname='output.log')
+        with open('output.log', 'rt') as fobj:
+            assert_equal(fobj.read().split(), [str(i) for i in range(100)])
+        assert_equal(runner.records[-1].output_tail.split(),
+                     [str(i) for i in range(80, 100)])
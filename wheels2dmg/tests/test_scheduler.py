@@ -0,0 +1,147 @@
+""" Testing scheduler module
+"""
+
+import time
+import zipfile
+import threading
+from os.path import join as pjoin
+
+from ..scheduler import (build_depends, build_order, run_builds, BuildError,
+                         sdist_build_requires, sdist_build_depends)
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_sdist
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+DEPENDS = {'scipy': ('numpy',),
+           'pandas': ('numpy',),
+           'statsmodels': ('scipy', 'pandas'),
+           'sklearn': ('scipy',)}
+
+
+def test_build_order():
+    assert_equal(build_order(['scipy', 'pyzmq', 'numpy', 'pandas'], DEPENDS),
+                 ['numpy', 'pyzmq', 'pandas', 'scipy'])
+    # Dependencies outside names still order names
+    assert_equal(build_depends(['statsmodels', 'numpy'], DEPENDS),
+                 {'statsmodels': set(['numpy']), 'numpy': set()})
+    assert_equal(build_order(['statsmodels', 'numpy'], DEPENDS),
+                 ['numpy', 'statsmodels'])
+    assert_equal(build_order([], DEPENDS), [])
+    # Default dependencies
+    assert_equal(build_order(['scipy', 'numpy']), ['numpy', 'scipy'])
+    assert_raises(ValueError, build_order, ['a', 'b'],
+                  {'a': ('b',), 'b': ('c',), 'c': ('a',)})
+
+
+def test_run_builds():
+    lock = threading.Lock()
+    started, state = [], dict(running=0, max_running=0)
+
+    def run_build(name, arg):
+        with lock:
+            started.append(name)
+            state['running'] += 1
+            state['max_running'] = max(state['running'],
+                                       state['max_running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        if arg == 'fail':
+            raise RuntimeError('Build failed for ' + name)
+        return arg * 2
+
+    names = ['numpy', 'scipy', 'pandas', 'statsmodels', 'sklearn', 'pyzmq',
+             'tornado']
+    results = run_builds(dict((name, name) for name in names), run_build, 3,
+                         DEPENDS)
+    assert_equal(results, dict((name, name * 2) for name in names))
+    for before, after in (('numpy', 'scipy'), ('numpy', 'pandas'),
+                          ('scipy', 'statsmodels'), ('pandas', 'statsmodels'),
+                          ('scipy', 'sklearn')):
+        assert_true(started.index(before) < started.index(after))
+    assert_equal(state['max_running'], 3)
+    # Failed build skips dependent builds, runs others
+    started[:] = []
+    builds = dict((name, name) for name in names)
+    builds['scipy'] = 'fail'
+    try:
+        run_builds(builds, run_build, 2, DEPENDS)
+    except BuildError as err:
+        assert_equal(list(err.errors), ['scipy'])
+        assert_equal(sorted(err.skipped), ['sklearn', 'statsmodels'])
+    else:
+        raise AssertionError('Expecting BuildError')
+    assert_equal(sorted(started),
+                 ['numpy', 'pandas', 'pyzmq', 'scipy', 'tornado'])
+    assert_equal(run_builds({}, run_build, 2), {})
+
+
+PYPROJECT = b"""\
+[project]
+requires = ["not-build"]
+
+[build-system]
+# Build with numpy headers
+requires = [
+    "setuptools>=40.8",  # comment
+    'Cython',
+    "numpy>=1.16; python_version<'3.9'",
+]
+build-backend = "setuptools.build_meta"
+"""
+
+SETUP_CFG = b"""\
+[metadata]
+name = pkgc
+
+[options]
+setup_requires =
+    pkgb
+    Setuptools_SCM
+install_requires = requests
+"""
+
+SETUP_PY = """\
+from setuptools import setup
+setup(name='pkgd', version='1.0',
+      setup_requires=['pkgc>=1.0', "pkgd"])
+"""
+
+
+def test_sdist_build_requires():
+    with TemporaryDirectory() as tmpdir:
+        pyproject = make_sdist(tmpdir, 'pkga', '1.0',
+                               {'pyproject.toml': PYPROJECT})
+        assert_equal(sdist_build_requires(pyproject),
+                     ['cython', 'numpy', 'setuptools'])
+        setup_cfg = make_sdist(tmpdir, 'pkgc', '1.0',
+                               {'setup.cfg': SETUP_CFG})
+        assert_equal(sdist_build_requires(setup_cfg),
+                     ['pkgb', 'setuptools-scm'])
+        setup_py = make_sdist(tmpdir, 'pkgd', '1.0', setup_py=SETUP_PY)
+        assert_equal(sdist_build_requires(setup_py), ['pkgc', 'pkgd'])
+        # Zip sdists
+        zip_sdist = pjoin(tmpdir, 'pkge-1.0.zip')
+        with zipfile.ZipFile(zip_sdist, 'w') as zf:
+            zf.writestr('pkge-1.0/pyproject.toml', PYPROJECT)
+            zf.writestr('pkge-1.0/sub/setup.cfg', SETUP_CFG)
+        assert_equal(sdist_build_requires(zip_sdist),
+                     ['cython', 'numpy', 'setuptools'])
+        # Nothing declared
+        plain = make_sdist(tmpdir, 'pyzmq', '1.0')
+        assert_equal(sdist_build_requires(plain), None)
+        assert_equal(sdist_build_requires(pjoin(tmpdir, 'missing.tar.gz')),
+                     None)
+        # Declared requirements, table for others
+        sdists = dict(pkga=pyproject, pkgc=setup_cfg, pkgd=setup_py,
+                      pyzmq=plain, scipy=plain)
+        depends = sdist_build_depends(sdists, dict(pyzmq=('pkga',),
+                                                   pkga=('pkgd',)))
+        assert_equal(depends['pkga'], ('cython', 'numpy', 'setuptools'))
+        assert_equal(depends['pkgd'], ('pkgc',))
+        assert_equal(depends['pyzmq'], ('pkga',))
+        assert_false('scipy' in depends)
+        assert_equal(build_order(sdists, depends),
+                     ['pkga', 'pkgc', 'scipy', 'pkgd', 'pyzmq'])
@@ -0,0 +1,105 @@
+""" Testing sizes module
+"""
+
+import os
+import zipfile
+from os.path import join as pjoin
+
+from ..sizes import (parse_size, file_type, top_level, wheel_sizes,
+                     size_report, format_size_report, format_bytes,
+                     check_budget, SizeBudgetError)
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel
+
+from nose.tools import (assert_true, assert_equal, assert_raises)
+
+PLAT = 'macosx_10_6_intel'
+
+FILES = {'pkga/__init__.py': b'x = 1\n' * 100,
+         'pkga/_ext.so': b'\0' * 1000,
+         'pkga/.dylibs/libgfortran.3.dylib': b'\1' * 2000,
+         'pkga/tests/test_a.py': b'assert True\n',
+         'pkga/data/table.csv': b'1,2,3\n' * 10,
+         'pkga-1.0.data/scripts/run-a': b'#!python\n',
+         'helper.py': b'y = 2\n'}
+
+
+def test_parse_size():
+    assert_equal(parse_size('1000'), 1000)
+    assert_equal(parse_size('600M'), 600 * 2 ** 20)
+    assert_equal(parse_size('1.5g'), 3 * 2 ** 29)
+    assert_equal(parse_size(' 2KB '), 2048)
+    for bad in ('', 'M', '10X', '-1'):
+        assert_raises(ValueError, parse_size, bad)
+
+
+def test_classify():
+    assert_equal([file_type(path) for path in sorted(FILES)],
+                 ['py', 'data', 'grafted', 'py', 'so',
+                  'data', 'tests'])
+    assert_equal(file_type('pkga-1.0.dist-info/RECORD'), 'metadata')
+    assert_equal(file_type('pkga/.dylibs/sub/libz.dylib'), 'grafted')
+    assert_equal(file_type('pkga/libz.dylib'), 'dylib')
+    assert_equal(file_type('pkga/tests/_t.so'), 'tests')
+    assert_equal([top_level(path) for path in sorted(FILES)],
+                 ['helper', 'pkga-1.0.data/scripts', 'pkga', 'pkga', 'pkga',
+                  'pkga', 'pkga'])
+    assert_equal(top_level('pkga-1.0.data/purelib/pkgb/x.py'), 'pkgb')
+
+
+def test_size_report():
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0', FILES, platform=PLAT)
+        sizes = wheel_sizes(wheel)
+        assert_equal(sizes['size'], os.path.getsize(wheel))
+        with zipfile.ZipFile(wheel) as zf:
+            infos = zf.infolist()
+        assert_equal(sizes['uncompressed'],
+                     sum(info.file_size for info in infos))
+        assert_equal(sizes['compressed'],
+                     sum(info.compress_size for info in infos))
+        assert_equal(sizes['types']['so']['uncompressed'], 1000)
+        assert_equal(sizes['types']['py']['uncompressed'], 606)
+        assert_equal(sizes['grafted'],
+                     {'libgfortran.3.dylib':
+                      sizes['types']['grafted']})
+        assert_equal(sum(s['uncompressed']
+                         for s in sizes['packages'].values()),
+                     sizes['uncompressed'])
+        # Directory with two wheels and other files
+        image_dir = pjoin(tmpdir, 'image')
+        wheel_dir = pjoin(image_dir, 'wheels')
+        os.makedirs(wheel_dir)
+        make_wheel(wheel_dir, 'pkga', '1.0', FILES, platform=PLAT)
+        make_wheel(wheel_dir, 'pkgb', '1.0',
+                   {'pkgb/.dylibs/libgfortran.3.dylib': b'\1' * 2000},
+                   platform=PLAT)
+        with open(pjoin(image_dir, 'README.txt'), 'wb') as fobj:
+            fobj.write(b'Read me')
+        report = size_report(image_dir)
+        assert_equal(sorted(report['wheels']),
+                     [pjoin('wheels', 'pkga-1.0-cp34-none-{0}.whl'.format(
+                         PLAT)),
+                      pjoin('wheels', 'pkgb-1.0-cp34-none-{0}.whl'.format(
+                          PLAT))])
+        assert_equal(report['other'], {'README.txt': 7})
+        assert_equal(report['total'],
+                     7 + sum(s['size'] for s in report['wheels'].values()))
+        assert_equal(report['grafted']['libgfortran.3.dylib']['copies'], 2)
+        assert_equal(report['grafted']['libgfortran.3.dylib']['uncompressed'],
+                     4000)
+        summary = format_size_report(report)
+        assert_true(summary.startswith('Total: ' +
+                                       format_bytes(report['total'])))
+        assert_true('libgfortran.3.dylib (x2)' in summary)
+        assert_true('README.txt' in summary)
+        check_budget(report, report['total'])
+        assert_raises(SizeBudgetError, check_budget, report,
+                      report['total'] - 1)
+
+
+def test_format_bytes():
+    assert_equal(format_bytes(10), '10 B')
+    assert_equal(format_bytes(1536), '1.5 KB')
+    assert_equal(format_bytes(600 * 2 ** 20), '600.0 MB')
+    assert_equal(format_bytes(2 ** 42), '4096.0 GB')
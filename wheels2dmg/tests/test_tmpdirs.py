@@ -0,0 +1,152 @@
+""" Testing tmpdirs module
+"""
+
+import os
+import time
+from os.path import join as pjoin, isdir, exists, dirname, basename
+
+from ..tmpdirs import (Reaper, TemporaryDirectory, ScratchPool, write_owner,
+                       owner_alive, clean_orphans, BUILD_PREFIX, OWNER_FNAME,
+                       REAP_MARKER)
+
+from nose.tools import assert_true, assert_false, assert_equal
+
+
+def write_text(fname, text):
+    with open(fname, 'wt') as fobj:
+        fobj.write(text)
+
+
+def test_reaper():
+    reaper = Reaper()
+    with TemporaryDirectory() as tmpdir:
+        path = pjoin(tmpdir, 'build')
+        os.makedirs(pjoin(path, 'sub'))
+        write_text(pjoin(path, 'sub', 'file.txt'), 'text')
+        reap_path = reaper.reap(path)
+        # Original name free at once, removed path in same directory
+        assert_false(exists(path))
+        assert_equal(dirname(reap_path), tmpdir)
+        assert_true(REAP_MARKER in basename(reap_path))
+        reaper.wait()
+        assert_false(exists(reap_path))
+        # Files too
+        fname = pjoin(tmpdir, 'file.txt')
+        write_text(fname, 'text')
+        reaper.reap(fname)
+        reaper.wait()
+        assert_equal(os.listdir(tmpdir), [])
+        # Missing paths
+        assert_equal(reaper.reap(path), None)
+
+
+def test_reaper_shutdown():
+    reaper = Reaper()
+    with TemporaryDirectory() as tmpdir:
+        path = pjoin(tmpdir, 'build')
+        os.mkdir(path)
+        write_text(pjoin(path, 'file.txt'), 'text')
+        reaper.shutdown()
+        # Removed at once, without a thread
+        reap_path = reaper.reap(path)
+        assert_false(exists(reap_path))
+        assert_equal(os.listdir(tmpdir), [])
+        assert_equal(reaper._thread, None)
+
+
+def test_temporary_directory_reaper():
+    reaper = Reaper()
+    tmp_dir = TemporaryDirectory(reaper=reaper)
+    with tmp_dir as tmpdir:
+        write_text(pjoin(tmpdir, 'file.txt'), 'text')
+    assert_false(exists(tmpdir))
+    # Safe to clean up again
+    tmp_dir.cleanup()
+    reaper.wait()
+    assert_equal([name for name in os.listdir(dirname(tmpdir))
+                  if name.startswith('.' + basename(tmpdir))], [])
+
+
+def test_owner_alive():
+    with TemporaryDirectory() as tmpdir:
+        assert_equal(owner_alive(tmpdir), None)
+        write_owner(tmpdir)
+        assert_true(owner_alive(tmpdir))
+        with open(pjoin(tmpdir, OWNER_FNAME), 'rt') as fobj:
+            host = fobj.read().split('\n')[1]
+        # Process IDs are below 2 ** 22 on Linux and OSX
+        write_text(pjoin(tmpdir, OWNER_FNAME), '{0}\n{1}\n'.format(
+            2 ** 22 + 1, host))
+        assert_false(owner_alive(tmpdir))
+        # We can't tell for other hosts
+        write_text(pjoin(tmpdir, OWNER_FNAME), '{0}\nnot-{1}\n'.format(
+            2 ** 22 + 1, host))
+        assert_true(owner_alive(tmpdir))
+
+
+def test_clean_orphans():
+    reaper = Reaper()
+    with TemporaryDirectory() as tmpdir:
+        live = pjoin(tmpdir, BUILD_PREFIX + 'live')
+        dead = pjoin(tmpdir, BUILD_PREFIX + 'dead')
+        no_owner = pjoin(tmpdir, BUILD_PREFIX + 'no-owner')
+        reaping = pjoin(tmpdir, '.' + BUILD_PREFIX + 'old' + REAP_MARKER +
+                        '1-0')
+        other = pjoin(tmpdir, 'other')
+        for path in (live, dead, no_owner, reaping, other):
+            os.mkdir(path)
+        write_owner(live)
+        write_owner(dead)
+        with open(pjoin(dead, OWNER_FNAME), 'rt') as fobj:
+            host = fobj.read().split('\n')[1]
+        write_text(pjoin(dead, OWNER_FNAME), '{0}\n{1}\n'.format(
+            2 ** 22 + 1, host))
+        # Directories without owner file are recent
+        assert_equal(clean_orphans(tmpdir, reaper=reaper),
+                     [reaping, dead])
+        reaper.wait()
+        assert_equal(sorted(os.listdir(tmpdir)),
+                     sorted(basename(p) for p in (live, no_owner, other)))
+        # Old directories without owner file
+        old = time.time() - 10
+        os.utime(no_owner, (old, old))
+        assert_equal(clean_orphans(tmpdir, max_age=5, reaper=reaper),
+                     [no_owner])
+        reaper.wait()
+        assert_equal(sorted(os.listdir(tmpdir)),
+                     sorted(basename(p) for p in (live, other)))
+
+
+def test_scratch_pool():
+    reaper = Reaper()
+    pool = ScratchPool(keep=('keep-me',), reaper=reaper)
+    with TemporaryDirectory() as tmpdir:
+        scratch = pool.acquire(tmpdir)
+        assert_true(basename(scratch.name).startswith(BUILD_PREFIX))
+        assert_true(owner_alive(scratch.name))
+        os.mkdir(pjoin(scratch.name, 'keep-me'))
+        os.mkdir(pjoin(scratch.name, 'build-logs'))
+        write_text(pjoin(scratch.name, 'file.txt'), 'text')
+        # New scratch directory while first in use
+        other = pool.acquire(tmpdir)
+        assert_false(other.name == scratch.name)
+        pool.release(scratch, tmpdir)
+        reaper.wait()
+        assert_equal(sorted(os.listdir(scratch.name)),
+                     [OWNER_FNAME, 'keep-me'])
+        # Released directory reused
+        assert_equal(pool.acquire(tmpdir).name, scratch.name)
+        pool.release(scratch, tmpdir)
+        pool.release(other, tmpdir)
+        pool.close()
+        reaper.wait()
+        assert_false(isdir(scratch.name))
+        assert_false(isdir(other.name))
+        assert_equal(os.listdir(tmpdir), [])
+        # Released after close; removed
+        late = ScratchPool(reaper=reaper)
+        scratch = late.acquire(tmpdir)
+        late.close()
+        late.release(scratch, tmpdir)
+        reaper.wait()
+        assert_equal(os.listdir(tmpdir), [])
@@ -0,0 +1,126 @@
+""" Testing verify module
+"""
+
+import struct
+import zipfile
+from os.path import join as pjoin
+
+from ..verify import verify_wheel, verify_wheels, WheelVerifyError
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel
+
+from nose.tools import (assert_true, assert_equal, assert_raises)
+
+CONTENTS = b'Some module contents\n' * 10
+
+
+def rewrite_member(wheel_fname, name, contents):
+    # Write wheel again with new `contents` for `name`, RECORD unchanged
+    with zipfile.ZipFile(wheel_fname) as zf:
+        members = [(info.filename, zf.read(info)) for info in zf.infolist()]
+    with zipfile.ZipFile(wheel_fname, 'w') as zf:
+        for member_name, member_contents in members:
+            if member_name == name:
+                if contents is None:
+                    continue
+                member_contents = contents
+            zf.writestr(member_name, member_contents)
+
+
+def test_verify_wheel():
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0',
+                           {'pkga/__init__.py': CONTENTS,
+                            'pkga/other.py': b'x = 1\n'})
+        assert_equal(verify_wheel(wheel), [])
+        # Changed contents, same size
+        rewrite_member(wheel, 'pkga/__init__.py', CONTENTS.upper())
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 1)
+        assert_true(problems[0].startswith('pkga/__init__.py: sha256 '))
+        # Changed size
+        rewrite_member(wheel, 'pkga/__init__.py', CONTENTS[:-1])
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 2)
+        assert_equal(problems[0],
+                     'pkga/__init__.py: size {0} in RECORD, {1} in '
+                     'wheel'.format(len(CONTENTS), len(CONTENTS) - 1))
+        # Missing and extra files
+        rewrite_member(wheel, 'pkga/__init__.py', None)
+        assert_equal(verify_wheel(wheel),
+                     ['pkga/__init__.py: in RECORD, not in wheel'])
+        wheel = make_wheel(tmpdir, 'pkgb', '1.0', {'pkgb/__init__.py': b''})
+        with zipfile.ZipFile(wheel, 'a') as zf:
+            zf.writestr('pkgb/extra.py', b'')
+        assert_equal(verify_wheel(wheel),
+                     ['pkgb/extra.py: not in RECORD'])
+        # Hashes weaker than sha256
+        wheel = make_wheel(tmpdir, 'pkgd', '1.0', {'pkgd/__init__.py': b''})
+        with zipfile.ZipFile(wheel) as zf:
+            record = zf.read('pkgd-1.0.dist-info/RECORD').decode('utf-8')
+        rewrite_member(wheel, 'pkgd-1.0.dist-info/RECORD',
+                       record.replace('pkgd/__init__.py,sha256=',
+                                      'pkgd/__init__.py,md5='))
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 1)
+        assert_true(problems[0].startswith(
+            'pkgd/__init__.py: hash "md5" in RECORD weaker than sha256'))
+        # Unsupported compression method
+        wheel = make_wheel(tmpdir, 'pkge', '1.0',
+                           {'pkge/__init__.py': CONTENTS},
+                           compression=zipfile.ZIP_STORED)
+        with open(wheel, 'rb') as fobj:
+            contents = bytearray(fobj.read())
+        # Compression method fields of local and central directory headers
+        name = b'pkge/__init__.py'
+        for signature, name_offset, method_offset in (
+            (b'PK\x03\x04', 30, 8), (b'PK\x01\x02', 46, 10)):
+            header = contents.index(signature)
+            while contents[header + name_offset:
+                           header + name_offset + len(name)] != name:
+                header = contents.index(signature, header + 1)
+            struct.pack_into('<H', contents, header + method_offset, 99)
+        with open(wheel, 'wb') as fobj:
+            fobj.write(contents)
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 1)
+        assert_true(problems[0].startswith('pkge/__init__.py: '))
+        # Corrupt member data
+        wheel = make_wheel(tmpdir, 'pkgc', '1.0',
+                           {'pkgc/__init__.py': CONTENTS},
+                           compression=zipfile.ZIP_STORED)
+        with open(wheel, 'rb') as fobj:
+            contents = fobj.read()
+        offset = contents.index(CONTENTS)
+        with open(wheel, 'wb') as fobj:
+            fobj.write(contents[:offset] + b'X' + contents[offset + 1:])
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 1)
+        assert_true('CRC' in problems[0])
+        # Truncated wheel
+        with open(wheel, 'wb') as fobj:
+            fobj.write(contents[:len(contents) // 2])
+        problems = verify_wheel(wheel)
+        assert_equal(len(problems), 1)
+        assert_true(problems[0].startswith('cannot read wheel: '))
+
+
+def test_verify_wheels():
+    with TemporaryDirectory() as tmpdir:
+        wheels = [make_wheel(tmpdir, name, '1.0',
+                             {name + '/__init__.py': CONTENTS})
+                  for name in ('pkga', 'pkgb', 'pkgc')]
+        verify_wheels(wheels)
+        verify_wheels([])
+        rewrite_member(wheels[1], 'pkgb/__init__.py', CONTENTS.upper())
+        rewrite_member(wheels[2], 'pkgc/__init__.py', CONTENTS.upper())
+        # We stop at the first bad wheel
+        try:
+            verify_wheels(wheels, n_jobs=1)
+        except WheelVerifyError as err:
+            assert_equal(list(err.problems), [wheels[1]])
+            assert_true('pkgb-1.0-py2.py3-none-any.whl: pkgb/__init__.py: '
+                        'sha256' in str(err))
+        else:
+            raise AssertionError('Expecting WheelVerifyError')
+        assert_raises(WheelVerifyError, verify_wheels, wheels[2:])
@@ -0,0 +1,220 @@
+""" Testing watch module
+"""
+
+import os
+import threading
+import time
+from os.path import join as pjoin
+
+from ..watch import (classify_changes, package_name, ChangeCollector,
+                     Watcher, Observer, TEMPLATES, REQUIREMENTS, FIND_LINKS)
+from ..pkgbuilders import PkgWriter
+from ..tmpdirs import TemporaryDirectory
+from ..events import BuildCancelled
+
+from nose import SkipTest
+from nose.tools import assert_true, assert_equal, assert_raises
+
+
+class RecordingWriter(PkgWriter):
+    # Record wheel updates and image writes instead of building
+
+    def do_init(self):
+        super(RecordingWriter, self).do_init()
+        self.calls = []
+
+    def update_wheels(self, names, base_manifest=None):
+        self.calls.append(('update_wheels', sorted(names)))
+
+    def write_dmg(self, out_dir, clobber=False, base_manifest=None,
+                  wheelhouse=True, formats=('dmg',)):
+        self.calls.append(('write_dmg', wheelhouse))
+        self.outputs = dict((fmt, pjoin(out_dir, 'test.' + fmt))
+                            for fmt in formats)
+        return self.outputs.get('dmg')
+
+
+class CancellingWriter(PkgWriter):
+    # Cancel build while updating wheels
+
+    def update_wheels(self, names, base_manifest=None):
+        self.events.cancel()
+
+
+def write_text(fname, text):
+    with open(fname, 'wt') as fobj:
+        fobj.write(text)
+
+
+def test_classify_changes():
+    with TemporaryDirectory() as tmpdir:
+        templates = pjoin(tmpdir, 'templates')
+        links = pjoin(tmpdir, 'links')
+        reqs = pjoin(tmpdir, 'requirements.txt')
+        assert_equal(classify_changes([], [templates], [reqs], [links]),
+                     set())
+        assert_equal(classify_changes([pjoin(templates, 'README.txt')],
+                                      [templates], [reqs], [links]),
+                     set([TEMPLATES]))
+        assert_equal(classify_changes([reqs, pjoin(links, 'a.whl')],
+                                      [templates], [reqs], [links]),
+                     set([REQUIREMENTS, FIND_LINKS]))
+        # Similar names, other files in same directory
+        assert_equal(classify_changes([templates + '2/README.txt',
+                                       pjoin(tmpdir, 'other.txt')],
+                                      [templates], [reqs], [links]),
+                     set())
+
+
+def test_package_name():
+    assert_equal(package_name('/links/My_Pkg-1.0-py2.py3-none-any.whl'),
+                 'my-pkg')
+    assert_equal(package_name('links/my.pkg-1.0.tar.gz'), 'my-pkg')
+    assert_equal(package_name('links/README.txt'), None)
+
+
+def test_change_collector():
+    collector = ChangeCollector()
+    assert_equal(collector.wait(0.1, timeout=0.01), set())
+
+    def add_paths():
+        for i in range(3):
+            collector.add('file{0}'.format(i))
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=add_paths)
+    thread.start()
+    start = time.time()
+    paths = collector.wait(0.2)
+    thread.join()
+    # We waited for the changes to settle
+    assert_equal(paths, set(['file0', 'file1', 'file2']))
+    assert_true(time.time() - start >= 0.3)
+    assert_equal(collector.wait(0.1, timeout=0.01), set())
+
+
+def test_watcher_rebuild():
+    with TemporaryDirectory() as tmpdir:
+        templates = pjoin(tmpdir, 'templates')
+        links = pjoin(tmpdir, 'links')
+        os.mkdir(templates)
+        os.mkdir(links)
+        reqs = pjoin(tmpdir, 'requirements.txt')
+        write_text(reqs, 'pkga==1.0\npkgb\n')
+        writer = RecordingWriter('test', '1.0', '3.4.1',
+                                 ['-r', reqs, '-f', links])
+        watcher = Watcher(writer, tmpdir, [templates])
+        assert_equal(watcher.watch_dirs, sorted([tmpdir, templates, links]))
+        # Changes not affecting build
+        assert_equal(watcher.rebuild([pjoin(tmpdir, 'other.txt')]), None)
+        assert_equal(writer.calls, [])
+        # Templates; write image again, with the same wheelhouse
+        assert_equal(watcher.rebuild([pjoin(templates, 'README.txt')]),
+                     {'dmg': pjoin(tmpdir, 'test.dmg')})
+        assert_equal(writer.calls, [('write_dmg', False)])
+        # Requirements; fetch changed and removed requirements
+        writer.calls = []
+        write_text(reqs, 'pkga==1.1\npkgc\n')
+        watcher.rebuild([reqs])
+        assert_equal(writer.calls, [('update_wheels', ['pkga', 'pkgb',
+                                                       'pkgc']),
+                                    ('write_dmg', False)])
+        # Same requirements again; nothing to fetch
+        writer.calls = []
+        watcher.rebuild([reqs])
+        assert_equal(writer.calls, [('write_dmg', False)])
+        # New package in find-links
+        writer.calls = []
+        watcher.rebuild([pjoin(links, 'PkgC-1.1-py2.py3-none-any.whl')])
+        assert_equal(writer.calls, [('update_wheels', ['pkgc']),
+                                    ('write_dmg', False)])
+        # Unknown file in find-links; fetch everything
+        writer.calls = []
+        watcher.rebuild([pjoin(links, 'index.html')])
+        assert_equal(writer.calls, [('update_wheels', ['pkga', 'pkgc']),
+                                    ('write_dmg', False)])
+
+
+def test_watcher_run():
+    if Observer is None:
+        raise SkipTest('Need watchdog to watch for changes')
+    with TemporaryDirectory() as tmpdir:
+        templates = pjoin(tmpdir, 'templates')
+        os.mkdir(templates)
+        writer = RecordingWriter('test', '1.0', '3.4.1', ['pkga'])
+        watcher = Watcher(writer, tmpdir, [templates],
+                          formats=('dmg', 'pkg'), debounce=0.1)
+        rebuilds = []
+        done = threading.Event()
+
+        def callback(outputs, error):
+            rebuilds.append((outputs, error))
+            done.set()
+
+        def edit_template():
+            # Keep editing until the observer has started and seen a change
+            while not done.wait(0.1):
+                write_text(pjoin(templates, 'README.txt'), 'Readme')
+
+        thread = threading.Thread(target=edit_template)
+        thread.start()
+        try:
+            watcher.run(callback, max_rebuilds=1)
+        finally:
+            done.set()
+            thread.join()
+        assert_equal(rebuilds, [({'dmg': pjoin(tmpdir, 'test.dmg'),
+                                  'pkg': pjoin(tmpdir, 'test.pkg')}, None)])
+        assert_equal(writer.calls, [('write_dmg', False)])
+
+
+def test_watcher_cancel():
+    # Cancel while updating wheels stops the rebuild
+    with TemporaryDirectory() as tmpdir:
+        reqs = pjoin(tmpdir, 'requirements.txt')
+        write_text(reqs, 'pkga\n')
+        writer = CancellingWriter('test', '1.0', '3.4.1', ['-r', reqs])
+        watcher = Watcher(writer, tmpdir)
+        write_text(reqs, 'pkgb\n')
+        assert_raises(BuildCancelled, watcher.rebuild, [reqs])
+        assert_true(writer.events.cancelled)
+        # Failed rebuild does not store new requirements
+        assert_equal(watcher.requirements, {'pkga': 'pkga'})
+        assert_equal(watcher.pending, set(['pkga', 'pkgb']))
+
+
+class FailingWriter(RecordingWriter):
+    # Fail to write image while fail flag is set
+
+    fail = True
+
+    def write_dmg(self, *args, **kwargs):
+        if self.fail:
+            raise RuntimeError('Build failed')
+        return super(FailingWriter, self).write_dmg(*args, **kwargs)
+
+
+def test_watcher_failed_rebuild():
+    # Failed rebuild fetches the same packages at next rebuild
+    with TemporaryDirectory() as tmpdir:
+        links = pjoin(tmpdir, 'links')
+        os.mkdir(links)
+        reqs = pjoin(tmpdir, 'requirements.txt')
+        write_text(reqs, 'pkga\n')
+        writer = FailingWriter('test', '1.0', '3.4.1', ['-r', reqs,
+                                                        '-f', links])
+        watcher = Watcher(writer, tmpdir)
+        write_text(reqs, 'pkga\npkgb\n')
+        assert_raises(RuntimeError, watcher.rebuild, [reqs])
+        assert_equal(sorted(watcher.requirements), ['pkga'])
+        writer.fail = False
+        writer.calls = []
+        watcher.rebuild([pjoin(links, 'pkgc-1.0-py2.py3-none-any.whl')])
+        assert_equal(writer.calls, [('update_wheels', ['pkgb', 'pkgc']),
+                                    ('write_dmg', False)])
+        # Successful rebuild stores new requirements
+        assert_equal(sorted(watcher.requirements), ['pkga', 'pkgb'])
+        assert_equal(watcher.pending, set())
+        writer.calls = []
+        watcher.rebuild([reqs])
+        assert_equal(writer.calls, [('write_dmg', False)])
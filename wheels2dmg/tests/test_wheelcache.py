@@ -0,0 +1,84 @@
+""" Testing wheelcache module
+"""
+
+import os
+from os.path import join as pjoin, basename, exists
+
+from ..wheelcache import WheelCache, file_sha256, make_key
+from ..tmpdirs import InTemporaryDirectory
+from .scriptrunner import ScriptRunner
+
+from nose.tools import (assert_true, assert_false, assert_raises,
+                        assert_equal, assert_not_equal)
+
+run_cmd = ScriptRunner().run_command
+
+
+def test_file_sha256():
+    with InTemporaryDirectory():
+        with open('afile', 'wb') as fobj:
+            fobj.write(b'Some data')
+        exp = ('1fe638b478f8f0b2c2aab3dbfd3f05d6'
+               'dfe2191cd7b4482241fe58567e37aef6')
+        assert_equal(file_sha256('afile'), exp)
+        # Block size does not change result
+        assert_equal(file_sha256('afile', 2), exp)
+
+
+def test_make_key():
+    assert_equal(make_key('a', 'b'), make_key('a', 'b'))
+    assert_not_equal(make_key('a', 'b'), make_key('ab'))
+    assert_not_equal(make_key('a', 'b'), make_key('b', 'a'))
+
+
+def test_wheel_cache():
+    with InTemporaryDirectory():
+        cache = WheelCache('cache')
+        os.mkdir('out')
+        assert_equal(cache.get('akey', 'out'), None)
+        assert_equal(cache.stats, dict(hits=0, misses=1))
+        with open('foo-1.0-py2.py3-none-any.whl', 'wb') as fobj:
+            fobj.write(b'Not really a wheel')
+        cache.put('akey', ['foo-1.0-py2.py3-none-any.whl'])
+        assert_equal(cache.get('akey', 'out'),
+                     [pjoin('out', 'foo-1.0-py2.py3-none-any.whl')])
+        assert_equal(cache.stats, dict(hits=1, misses=1))
+        assert_true(exists(pjoin('out', 'foo-1.0-py2.py3-none-any.whl')))
+        # Putting existing key is a no-op
+        cache.put('akey', [])
+        assert_equal(len(cache.get('akey', 'out')), 1)
+        # Cache persists across instances, stats do not
+        cache = WheelCache('cache')
+        assert_equal(len(cache.get('akey', 'out')), 1)
+        assert_equal(cache.stats, dict(hits=1, misses=0))
+
+
+def test_export_import():
+    with InTemporaryDirectory():
+        cache = WheelCache('cache')
+        assert_equal(cache.keys(), [])
+        for name in ('foo', 'bar'):
+            fname = name + '-1.0-py2.py3-none-any.whl'
+            with open(fname, 'wb') as fobj:
+                fobj.write(b'Not really a wheel')
+            cache.put(make_key(name), [fname])
+        assert_equal(cache.keys(), sorted([make_key('foo'), make_key('bar')]))
+        assert_equal(cache.export_archive('cache.tar.gz'), 2)
+        other = WheelCache('other')
+        other.put(make_key('foo'), [])
+        assert_equal(other.import_archive('cache.tar.gz'), 1)
+        assert_equal(other.keys(), cache.keys())
+        os.mkdir('out')
+        assert_equal(other.get(make_key('bar'), 'out'),
+                     [pjoin('out', 'bar-1.0-py2.py3-none-any.whl')])
+        # Existing entries stay as they were
+        assert_equal(other.get(make_key('foo'), 'out'), [])
+        assert_equal(other.import_archive('cache.tar.gz'), 0)
+        assert_equal(sorted(os.listdir('other')), sorted(os.listdir('cache')))
+        # Command line
+        run_cmd(['wheels2dmg-cache', 'cache', 'export', 'cmd.tar'])
+        code, stdout, stderr = run_cmd(['wheels2dmg-cache', 'third',
+                                        'import', 'cmd.tar'])
+        assert_true(b'Imported 2 new entries' in stdout)
+        code, stdout, stderr = run_cmd(['wheels2dmg-cache', 'third', 'list'])
+        assert_equal(stdout.decode('ascii').split(), cache.keys())
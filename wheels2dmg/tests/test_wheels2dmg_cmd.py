@@ -4,6 +4,7 @@
 from nose.tools import (assert_true, assert_false, assert_raises,
                         assert_equal, assert_not_equal)
 
+from ..wheels2dmg_cmd import get_parser
 from .scriptrunner import ScriptRunner
 
 run_cmd = ScriptRunner().run_command
@@ -21,3 +22,12 @@ def test_exit_codes():
     code, stdout, stderr = run_cmd(['wheels2dmg', 'mypackage', '1'],
                                    check_code=False)
     assert_equal(code, 12)
+
+
+def test_clobber_option():
+    # Watching does not imply overwriting outputs of the first build
+    parser = get_parser()
+    args = parser.parse_args(['mypackage', '1', 'foo', '--watch'])
+    assert_false(args.clobber)
+    args = parser.parse_args(['mypackage', '1', 'foo', '--clobber'])
+    assert_true(args.clobber)
@@ -0,0 +1,172 @@
+""" Testing wheeltools module
+"""
+
+import os
+import zipfile
+import tracemalloc
+from os.path import basename, exists, join as pjoin
+
+from ..wheeltools import (unpacked_wheel, retag_wheel, copy_member,
+                          delocate_wheel, WheelToolError, READ_BLOCKSIZE)
+from ..pkgbuilders import recompress_wheel, peak_rss, PkgWriter
+from ..verify import verify_wheel
+from ..tmpdirs import TemporaryDirectory
+from .wheelmaker import make_wheel, record_hash, WHEEL_DATE
+
+from nose import SkipTest
+from nose.tools import (assert_true, assert_false, assert_equal,
+                        assert_raises)
+
+PLAT = 'macosx_10_6_intel'
+
+# Size of large member for memory benchmark.  Set to a few GB to check
+# memory use with very large wheels; ``make benchmark`` does this.
+BENCH_SIZE = int(os.environ.get('WHEELS2DMG_BENCH_SIZE', 2 ** 26))
+
+# Most memory we expect to allocate while processing wheel, whatever its size
+MEMORY_CEILING = 16 * READ_BLOCKSIZE
+
+
+def test_unpacked_wheel():
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 1\n'}, platform=PLAT)
+        out_wheel = pjoin(tmpdir, 'out.whl')
+        with unpacked_wheel(wheel, out_wheel) as wheel_dir:
+            with open(pjoin(wheel_dir, 'pkga', 'new.py'), 'wb') as fobj:
+                fobj.write(b'y = 2\n')
+            with open(pjoin(wheel_dir, 'pkga-1.0.dist-info',
+                            'RECORD.jws'), 'wb') as fobj:
+                fobj.write(b'signature')
+        assert_false(exists(wheel_dir))
+        assert_equal(verify_wheel(out_wheel), [])
+        with zipfile.ZipFile(out_wheel) as zf:
+            names = zf.namelist()
+            record = zf.read('pkga-1.0.dist-info/RECORD').decode('utf-8')
+        assert_true('pkga/new.py,{0},6\n'.format(record_hash(b'y = 2\n'))
+                    in record)
+        # Signature removed; dist-info last
+        assert_false('pkga-1.0.dist-info/RECORD.jws' in names)
+        assert_equal(names[:2], ['pkga/__init__.py', 'pkga/new.py'])
+        # No wheel written after error
+        try:
+            with unpacked_wheel(wheel, pjoin(tmpdir, 'err.whl')):
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert_false(exists(pjoin(tmpdir, 'err.whl')))
+
+
+def test_retag_wheel():
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 1\n'}, platform=PLAT)
+        out_wheel = retag_wheel(wheel, ['macosx_10_6_intel',
+                                        'macosx_10_9_x86_64'])
+        assert_equal(basename(out_wheel),
+                     'pkga-1.0-cp34-none-macosx_10_6_intel.'
+                     'macosx_10_9_x86_64.whl')
+        assert_false(exists(wheel))
+        assert_equal(verify_wheel(out_wheel), [])
+        with zipfile.ZipFile(out_wheel) as zf:
+            info = zf.read('pkga-1.0.dist-info/WHEEL').decode('utf-8')
+            assert_equal(zf.getinfo('pkga/__init__.py').date_time,
+                         WHEEL_DATE)
+        assert_equal([line for line in info.splitlines()
+                      if line.startswith('Tag:')],
+                     ['Tag: cp34-none-macosx_10_6_intel',
+                      'Tag: cp34-none-macosx_10_9_x86_64'])
+        # Already tagged; no change
+        with open(out_wheel, 'rb') as fobj:
+            before = fobj.read()
+        assert_equal(retag_wheel(out_wheel, ['macosx_10_9_x86_64']),
+                     out_wheel)
+        with open(out_wheel, 'rb') as fobj:
+            assert_equal(fobj.read(), before)
+        pure = make_wheel(tmpdir, 'pkgb', '1.0', {'pkgb/__init__.py': b''})
+        assert_raises(WheelToolError, retag_wheel, pure, ['macosx_10_9_x86_64'])
+
+
+def test_copy_member():
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 1\n' * 100})
+        with zipfile.ZipFile(wheel) as zin:
+            info = zin.getinfo('pkga/__init__.py')
+            for compression in (None, zipfile.ZIP_STORED):
+                out_fname = pjoin(tmpdir, 'out.zip')
+                with zipfile.ZipFile(out_fname, 'w') as zout:
+                    copy_member(zin, info, zout, compression)
+                with zipfile.ZipFile(out_fname) as zf:
+                    out_info = zf.getinfo('pkga/__init__.py')
+                    assert_equal(zf.read(out_info), b'x = 1\n' * 100)
+                assert_equal(out_info.compress_type,
+                             info.compress_type if compression is None
+                             else compression)
+                assert_equal(out_info.date_time, info.date_time)
+                assert_equal(out_info.external_attr, info.external_attr)
+
+
+def can_delocate():
+    # Older delocate runs OSX ``otool`` on every file in the wheel
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0', {'pkga/__init__.py': b''},
+                           platform=PLAT)
+        try:
+            delocate_wheel(wheel)
+        except OSError:
+            return False
+    return True
+
+
+def test_delocate_wheel():
+    # Wheel without libraries to copy is not written again
+    if not can_delocate():
+        raise SkipTest('Need OSX tools for this version of delocate')
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_wheel(tmpdir, 'pkga', '1.0',
+                           {'pkga/__init__.py': b'x = 1\n',
+                            'pkga/data.txt': b'data'}, platform=PLAT)
+        os.utime(wheel, (0, 0))
+        assert_equal(delocate_wheel(wheel, require_archs='intel'), {})
+        assert_equal(os.stat(wheel).st_mtime, 0)
+        assert_equal(verify_wheel(wheel), [])
+
+
+def make_large_wheel(out_dir, size):
+    # Compiled wheel with member of `size` bytes, written in blocks
+    wheel = make_wheel(out_dir, 'big', '1.0', {'big/__init__.py': b''},
+                       platform=PLAT)
+    block = bytes(bytearray(range(256))) * (READ_BLOCKSIZE // 256)
+    with zipfile.ZipFile(wheel, 'a') as zf:
+        info = zipfile.ZipInfo('big/data.bin', WHEEL_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with zf.open(info, 'w', force_zip64=True) as fobj:
+            for i in range(0, size, len(block)):
+                fobj.write(block[:size - i])
+    return wheel
+
+
+def test_memory_ceiling():
+    # Memory to delocate, retag, rewrite and recompress wheel does not depend
+    # on size
+    with TemporaryDirectory() as tmpdir:
+        wheel = make_large_wheel(tmpdir, BENCH_SIZE)
+        pkg_writer = PkgWriter('test', '1', '3.4.1', ['big'],
+                               delocate_wheels=can_delocate())
+        rss_before = peak_rss()
+        tracemalloc.start()
+        try:
+            wheel = pkg_writer.process_wheel(wheel)
+            wheel = retag_wheel(wheel, ['macosx_10_9_x86_64'])
+            with unpacked_wheel(wheel, wheel):
+                pass
+            recompress_wheel(wheel, 'store')
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert_true(peak < MEMORY_CEILING)
+        if not rss_before is None:
+            assert_true(peak_rss() - rss_before < MEMORY_CEILING)
+        with zipfile.ZipFile(wheel) as zf:
+            assert_equal(zf.getinfo('big/data.bin').file_size, BENCH_SIZE)
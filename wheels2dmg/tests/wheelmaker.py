@@ -0,0 +1,219 @@
+""" Module to make small synthetic wheels for tests
+
+Usually works something like this in a test module::
+
+    from .wheelmaker import make_wheel
+    wheel_fname = make_wheel(tmpdir, 'mypkg', '1.0',
+                             {'mypkg/__init__.py': b'x = 1\\n'})
+"""
+import base64
+import hashlib
+import struct
+import tarfile
+import zipfile
+from io import BytesIO
+from os.path import join as pjoin
+
+WHEEL_TEMPLATE = """Wheel-Version: 1.0
+Generator: wheels2dmg-tests
+Root-Is-Purelib: {purelib}
+{tags}
+"""
+
+METADATA_TEMPLATE = """Metadata-Version: 2.1
+Name: {name}
+Version: {version}
+{requires}
+"""
+
+
+WHEEL_DATE = (2016, 1, 1, 0, 0, 0)
+
+
+def record_hash(contents):
+    """ Return RECORD hash string for bytes `contents` """
+    digest = hashlib.sha256(contents).digest()
+    return 'sha256=' + base64.urlsafe_b64encode(digest).decode(
+        'ascii').rstrip('=')
+
+
+def make_wheel(out_dir, name, version, files,
+               platform='any', requires=(),
+               compression=zipfile.ZIP_DEFLATED):
+    """ Write wheel with contents `files` to `out_dir`, return filename
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory to which to write wheel
+    name : str
+        Distribution name
+    version : str
+        Distribution version
+    files : dict
+        Mapping of path within wheel to file contents as bytes
+    platform : str, optional
+        Platform tag or dot separated platform tags.  Wheel is pure if
+        ``any``.
+    requires : sequence, optional
+        ``Requires-Dist`` values for wheel metadata
+    compression : int, optional
+        Zipfile compression type for wheel members
+
+    Returns
+    -------
+    wheel_fname : str
+        Filename of written wheel
+    """
+    pure = platform == 'any'
+    abi = 'none'
+    py_tag = 'py2.py3' if pure else 'cp34'
+    tags = ['Tag: {0}-{1}-{2}'.format(py, abi, plat)
+            for py in py_tag.split('.') for plat in platform.split('.')]
+    info_dir = '{0}-{1}.dist-info'.format(name, version)
+    files = dict(files)
+    files[info_dir + '/WHEEL'] = WHEEL_TEMPLATE.format(
+        purelib='true' if pure else 'false',
+        tags='\n'.join(tags)).encode('utf-8')
+    files[info_dir + '/METADATA'] = METADATA_TEMPLATE.format(
+        name=name,
+        version=version,
+        requires='\n'.join('Requires-Dist: ' + r for r in requires)
+    ).encode('utf-8')
+    record_lines = ['{0},{1},{2}'.format(path, record_hash(contents),
+                                         len(contents))
+                    for path, contents in sorted(files.items())]
+    record_lines.append(info_dir + '/RECORD,,')
+    files[info_dir + '/RECORD'] = ('\n'.join(record_lines) + '\n').encode(
+        'utf-8')
+    wheel_fname = pjoin(out_dir, '{0}-{1}-{2}-{3}-{4}.whl'.format(
+        name, version, py_tag, abi, platform))
+    with zipfile.ZipFile(wheel_fname, 'w', compression) as zf:
+        for path in sorted(files):
+            # Fixed date, so wheels with the same contents have the same hash
+            info = zipfile.ZipInfo(path, WHEEL_DATE)
+            info.external_attr = 0o600 << 16
+            info.compress_type = compression
+            zf.writestr(info, files[path])
+    return wheel_fname
+
+
+SETUP_TEMPLATE = """from setuptools import setup
+setup(name={name!r}, version={version!r}, packages=[{name!r}])
+"""
+
+
+def make_sdist(out_dir, name, version, files=None, setup_py=None):
+    """ Write sdist for package `name` to `out_dir`, return filename
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory to which to write sdist
+    name : str
+        Distribution and package name
+    version : str
+        Distribution version
+    files : None or dict, optional
+        Mapping of path within sdist directory to file contents as bytes.
+        None gives an empty package ``__init__.py``.
+    setup_py : None or str, optional
+        Contents of ``setup.py``.  None gives a setup for the pure package
+        `name`.
+
+    Returns
+    -------
+    sdist_fname : str
+        Filename of written sdist
+    """
+    files = {name + '/__init__.py': b''} if files is None else dict(files)
+    if setup_py is None:
+        setup_py = SETUP_TEMPLATE.format(name=name, version=version)
+    files['setup.py'] = setup_py.encode('utf-8')
+    root = '{0}-{1}'.format(name, version)
+    sdist_fname = pjoin(out_dir, root + '.tar.gz')
+    with tarfile.open(sdist_fname, 'w:gz') as tf:
+        for path in sorted(files):
+            info = tarfile.TarInfo(root + '/' + path)
+            info.size = len(files[path])
+            tf.addfile(info, BytesIO(files[path]))
+    return sdist_fname
+
+
+# CPU types for fat binaries
+CPU_TYPES = {'i386': 7, 'x86_64': 0x01000007, 'ppc': 18, 'arm64': 0x0100000c}
+
+
+def make_fat_binary(slices, align=12):
+    """ Return bytes for Mach-O fat binary with given slices
+
+    Parameters
+    ----------
+    slices : sequence
+        Sequence of (arch name, slice bytes) pairs.  The slice bytes need not
+        be a valid Mach-O binary.
+    align : int, optional
+        Alignment of slices in file as power of 2
+
+    Returns
+    -------
+    contents : bytes
+        Fat binary file contents
+    """
+    header = struct.pack('>II', 0xcafebabe, len(slices))
+    alignment = 2 ** align
+    offset = 8 + 20 * len(slices)
+    records, body = [], b''
+    for arch, data in slices:
+        offset = (offset + alignment - 1) // alignment * alignment
+        records.append(struct.pack('>iiIII', CPU_TYPES[arch], 3, offset,
+                                   len(data), align))
+        body += b'\0' * (offset - 8 - 20 * len(slices) - len(body)) + data
+        offset += len(data)
+    return header + b''.join(records) + body
+
+
+def _dylib_command(cmd, name):
+    encoded = name.encode('utf-8')
+    size = (24 + len(encoded) + 8) // 8 * 8
+    return (struct.pack('<IIIIII', cmd, size, 24, 2, 0x10000, 0x10000) +
+            encoded + b'\0' * (size - 24 - len(encoded)))
+
+
+def make_macho(install_id=None, depends=(), pad=64):
+    """ Return bytes for minimal 64-bit Intel Mach-O library or bundle
+
+    Parameters
+    ----------
+    install_id : None or str, optional
+        Install name of library.  If None, make a bundle (as for Python
+        extensions) without an install name.
+    depends : sequence, optional
+        Install names of libraries that the binary depends on
+    pad : int, optional
+        Number of bytes of padding between load commands and the single
+        (``__text``) section
+
+    Returns
+    -------
+    contents : bytes
+        Mach-O file contents
+    """
+    commands = []
+    if not install_id is None:
+        commands.append(_dylib_command(0xd, install_id))
+    commands += [_dylib_command(0xc, name) for name in depends]
+    segment_size = 72 + 80
+    sizeofcmds = sum(len(command) for command in commands) + segment_size
+    text = b'\xc3' * 16
+    text_offset = 32 + sizeofcmds + pad
+    segment = (struct.pack('<II16sQQQQiiII', 0x19, segment_size, b'__TEXT',
+                           0, text_offset + len(text),
+                           0, text_offset + len(text), 5, 5, 1, 0) +
+               struct.pack('<16s16sQQIIIIIIII', b'__text', b'__TEXT',
+                           text_offset, len(text), text_offset, 4, 0, 0,
+                           0x80000400, 0, 0, 0))
+    header = struct.pack('<IiiIIIII', 0xfeedfacf, CPU_TYPES['x86_64'], 3,
+                         8 if install_id is None else 6,
+                         len(commands) + 1, sizeofcmds, 0, 0)
+    return header + segment + b''.join(commands) + b'\0' * pad + text
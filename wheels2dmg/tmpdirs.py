@@ -10,8 +10,194 @@
 '''
 from __future__ import division, print_function, absolute_import
 import os
+from os.path import join as pjoin, dirname, basename, abspath, isdir
+import time
+import errno
 import shutil
-from tempfile import template, mkdtemp
+import socket
+import atexit
+import threading
+import itertools
+from tempfile import template, mkdtemp, gettempdir
+try:
+    from queue import Queue # Python 3
+except ImportError:
+    from Queue import Queue # Python 2
+
+# Prefix for temporary build directories, so we can find orphans
+BUILD_PREFIX = 'wheels2dmg-'
+# File in temporary build directory recording the process using it
+OWNER_FNAME = '.wheels2dmg-owner'
+# Marks path renamed for removal
+REAP_MARKER = '.reaping-'
+# Seconds after which we remove build directories without owner file
+ORPHAN_AGE = 24 * 60 * 60
+
+
+class Reaper(object):
+    """ Remove directories in a background thread
+
+    We first rename the path to a hidden name in the same directory, which
+    is quick, because it is on the same filesystem, and frees the original
+    name at once.  A background thread then deletes the renamed path.
+
+    After :meth:`shutdown`, we delete paths at once, because we cannot start
+    threads while the interpreter exits.
+    """
+
+    def __init__(self):
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._counter = itertools.count()
+        self._shut_down = False
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _remove(self, path):
+        try:
+            if isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._remove(path)
+            finally:
+                self._queue.task_done()
+
+    def reap(self, path, rename=True):
+        """ Rename `path` out of the way, and remove it in the background
+
+        Parameters
+        ----------
+        path : str
+            Directory or file to remove
+        rename : bool, optional
+            If True, rename `path` before queueing it for removal
+
+        Returns
+        -------
+        reap_path : None or str
+            Path we will remove, or None if `path` did not exist
+        """
+        path = abspath(path)
+        if not os.path.lexists(path):
+            return None
+        if rename:
+            new_path = pjoin(dirname(path), '.{0}{1}{2}-{3}'.format(
+                basename(path), REAP_MARKER, os.getpid(),
+                next(self._counter)))
+            os.rename(path, new_path)
+            path = new_path
+        if self._shut_down:
+            self._remove(path)
+            return path
+        self._start()
+        self._queue.put(path)
+        return path
+
+    def wait(self):
+        """ Wait until we have removed all queued paths """
+        self._queue.join()
+
+    def shutdown(self):
+        """ Wait for queued paths, remove later paths without a thread """
+        self._shut_down = True
+        self.wait()
+
+
+# Reaper for this process; finish removals before exit
+REAPER = Reaper()
+atexit.register(REAPER.shutdown)
+
+
+def write_owner(path):
+    """ Record this process as the user of build directory `path` """
+    with open(pjoin(path, OWNER_FNAME), 'wt') as fobj:
+        fobj.write('{0}\n{1}\n'.format(os.getpid(), socket.gethostname()))
+
+
+def owner_alive(path):
+    """ Return True if process using build directory `path` may be running
+
+    Returns
+    -------
+    alive : None or bool
+        None if there is no owner file in `path`.  True if the owning
+        process is running, or is on another host, so we cannot tell.
+    """
+    try:
+        with open(pjoin(path, OWNER_FNAME), 'rt') as fobj:
+            pid, host = fobj.read().split('\n')[:2]
+        pid = int(pid)
+    except (IOError, OSError, ValueError):
+        return None
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+def clean_orphans(root=None, prefix=BUILD_PREFIX, max_age=ORPHAN_AGE,
+                  reaper=None):
+    """ Remove build directories left in `root` by processes that died
+
+    Parameters
+    ----------
+    root : None or str, optional
+        Directory containing build directories.  None means the default
+        directory for temporary files.
+    prefix : str, optional
+        Prefix of build directory names
+    max_age : float, optional
+        Remove build directories without an owner file after this many
+        seconds since the last modification
+    reaper : None or :class:`Reaper` instance, optional
+        Reaper with which to remove directories.  None means ``REAPER``.
+
+    Returns
+    -------
+    removed : list
+        Paths of directories we are removing
+    """
+    root = gettempdir() if root is None else root
+    reaper = REAPER if reaper is None else reaper
+    removed = []
+    for name in sorted(os.listdir(root)):
+        path = pjoin(root, name)
+        if not isdir(path) or os.path.islink(path):
+            continue
+        if name.startswith('.' + prefix) and REAP_MARKER in name:
+            # Removal interrupted by exit
+            if reaper.reap(path, rename=False):
+                removed.append(path)
+            continue
+        if not name.startswith(prefix):
+            continue
+        alive = owner_alive(path)
+        if alive or (alive is None and
+                     time.time() - os.stat(path).st_mtime < max_age):
+            continue
+        try:
+            reaper.reap(path)
+        except OSError: # Removed by someone else
+            continue
+        removed.append(path)
+    return removed
 
 
 class TemporaryDirectory(object):
@@ -31,8 +217,9 @@ class TemporaryDirectory(object):
     >>> os.path.exists(tmpdir)
     False
     """
-    def __init__(self, suffix="", prefix=template, dir=None):
+    def __init__(self, suffix="", prefix=template, dir=None, reaper=None):
         self.name = mkdtemp(suffix, prefix, dir)
+        self.reaper = reaper
         self._closed = False
 
     def __enter__(self):
@@ -40,7 +227,10 @@ class TemporaryDirectory(object):
 
     def cleanup(self):
         if not self._closed:
-            shutil.rmtree(self.name)
+            if self.reaper is None:
+                shutil.rmtree(self.name)
+            else:
+                self.reaper.reap(self.name)
             self._closed = True
 
     def __exit__(self, exc, value, tb):
@@ -48,6 +238,67 @@ class TemporaryDirectory(object):
         return False
 
 
+class ScratchPool(object):
+    """ Scratch directories that builds in this process can reuse
+
+    A released scratch directory goes back in the pool, after we remove its
+    contents in the background, except for entries named in `keep`.  After
+    :meth:`close`, we remove released scratch directories.
+    """
+
+    def __init__(self, keep=(), reaper=None):
+        """ Initialize scratch pool
+
+        Parameters
+        ----------
+        keep : sequence, optional
+            Names of entries to keep in released scratch directories
+        reaper : None or :class:`Reaper` instance, optional
+            Reaper with which to remove contents.  None means ``REAPER``.
+        """
+        self.keep = tuple(keep)
+        self.reaper = REAPER if reaper is None else reaper
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, root=None):
+        """ Return :class:`TemporaryDirectory` for scratch files in `root`
+
+        Reuse a released scratch directory in `root` if there is one.
+        """
+        with self._lock:
+            idle = self._idle.get(root, [])
+            if idle:
+                return idle.pop()
+        tmp_dir = TemporaryDirectory(prefix=BUILD_PREFIX + 'scratch-',
+                                     dir=root, reaper=self.reaper)
+        write_owner(tmp_dir.name)
+        return tmp_dir
+
+    def release(self, tmp_dir, root=None):
+        """ Clear scratch directory `tmp_dir` from `root`, return to pool
+        """
+        if self._closed:
+            tmp_dir.cleanup()
+            return
+        for name in os.listdir(tmp_dir.name):
+            if name in self.keep or name == OWNER_FNAME or REAP_MARKER in name:
+                continue
+            self.reaper.reap(pjoin(tmp_dir.name, name))
+        with self._lock:
+            self._idle.setdefault(root, []).append(tmp_dir)
+
+    def close(self):
+        """ Remove all scratch directories in pool """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._closed = True
+        for tmp_dirs in idle.values():
+            for tmp_dir in tmp_dirs:
+                tmp_dir.cleanup()
+
+
 class InTemporaryDirectory(TemporaryDirectory):
     ''' Create, return, and change directory to a temporary directory
 
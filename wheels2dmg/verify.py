@@ -0,0 +1,206 @@
+""" Check wheel zip CRCs and RECORD hashes and sizes against the contents
+
+We read each member once, in blocks, so memory use does not depend on the
+size of the wheel members.  Reading a member to the end checks its zip CRC;
+we hash the blocks as we go, to check against the hash and size in the
+wheel ``RECORD``.  Decompression and hashing release the GIL for large
+blocks, so checking wheels in threads scales with the number of cores.
+"""
+from __future__ import division, print_function
+
+import csv
+import base64
+import hashlib
+import threading
+import zipfile
+import zlib
+from os.path import basename
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+# Read members in blocks of this many bytes
+READ_BLOCKSIZE = 2 ** 20
+
+# Signature files that RECORD does not list
+UNRECORDED = ('RECORD', 'RECORD.jws', 'RECORD.p7s')
+
+# RECORD hash algorithms as strong as sha256 or stronger; the wheel spec
+# does not allow weaker hashes such as md5 and sha1
+HASH_ALGORITHMS = ('sha256', 'sha384', 'sha512', 'sha3_256', 'sha3_384',
+                   'sha3_512', 'blake2b', 'blake2s')
+
+
+class WheelVerifyError(Exception):
+    """ Error for wheels that fail verification
+
+    Attribute ``problems`` is a dict mapping wheel filename to list of
+    problem descriptions.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        lines = []
+        for wheel_fname in sorted(problems):
+            lines += ['{0}: {1}'.format(basename(wheel_fname), problem)
+                      for problem in problems[wheel_fname]]
+        super(WheelVerifyError, self).__init__(
+            'Wheel verification failed:\n' + '\n'.join(lines))
+
+
+def _record_digest(digest):
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def read_record(zf):
+    """ Return RECORD name and entries for wheel in ``ZipFile`` `zf`
+
+    Returns
+    -------
+    record_name : None or str
+        Name of ``RECORD`` member, or None if there is no single ``RECORD``
+    entries : dict
+        Mapping of path to (hash, size) tuple, where `hash` is "" or of form
+        "<algorithm>=<urlsafe base64 digest>", and `size` is "" or a string
+        giving an integer.
+    """
+    names = [name for name in zf.namelist()
+             if name.count('/') == 1 and
+             name.split('/')[0].endswith('.dist-info') and
+             name.endswith('/RECORD')]
+    if len(names) != 1:
+        return None, {}
+    lines = zf.read(names[0]).decode('utf-8').splitlines()
+    entries = {}
+    for row in csv.reader(lines):
+        if len(row) == 0:
+            continue
+        row = (row + ['', ''])[:3]
+        entries[row[0]] = (row[1], row[2])
+    return names[0], entries
+
+
+def verify_wheel(wheel_fname, cancel=None):
+    """ Check zip CRCs, ``RECORD`` hashes and sizes for wheel `wheel_fname`
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of wheel
+    cancel : None or ``threading.Event``, optional
+        If not None, stop checking when this event is set
+
+    Returns
+    -------
+    problems : list
+        List of strings describing problems with the wheel.  Empty if the
+        wheel is valid (or we were cancelled before finding a problem).
+    """
+    problems = []
+    try:
+        with zipfile.ZipFile(wheel_fname) as zf:
+            record_name, entries = read_record(zf)
+            if record_name is None:
+                return ['no single .dist-info/RECORD']
+            unrecorded = [record_name.rsplit('/', 1)[0] + '/' + name
+                          for name in UNRECORDED]
+            for info in zf.infolist():
+                if not cancel is None and cancel.is_set():
+                    break
+                name = info.filename
+                if name.endswith('/'):
+                    continue
+                if name in unrecorded:
+                    continue
+                if not name in entries:
+                    problems.append('{0}: not in RECORD'.format(name))
+                    continue
+                record_hash, record_size = entries.pop(name)
+                if record_hash == '':
+                    problems.append('{0}: no hash in RECORD'.format(name))
+                    continue
+                algorithm, _, expected = record_hash.partition('=')
+                if not algorithm in HASH_ALGORITHMS:
+                    problems.append('{0}: hash "{1}" in RECORD weaker than '
+                                    'sha256, or unknown'.format(
+                                        name, algorithm))
+                    continue
+                try:
+                    sha = hashlib.new(algorithm)
+                except ValueError:
+                    problems.append('{0}: unknown hash "{1}" in RECORD'.format(
+                        name, algorithm))
+                    continue
+                size = 0
+                try:
+                    with zf.open(info) as fobj:
+                        while True:
+                            block = fobj.read(READ_BLOCKSIZE)
+                            if not block:
+                                break
+                            sha.update(block)
+                            size += len(block)
+                except (zipfile.BadZipfile, zlib.error, EOFError,
+                        NotImplementedError) as err:
+                    # NotImplementedError for unsupported compression
+                    problems.append('{0}: {1}'.format(name, err))
+                    continue
+                if not record_size in ('', str(size)):
+                    problems.append('{0}: size {1} in RECORD, {2} in '
+                                    'wheel'.format(name, record_size, size))
+                actual = _record_digest(sha.digest())
+                if actual != expected:
+                    problems.append('{0}: {1} {2} in RECORD, {3} in '
+                                    'wheel'.format(name, algorithm, expected,
+                                                   actual))
+            else:
+                problems += ['{0}: in RECORD, not in wheel'.format(name)
+                             for name in sorted(entries)
+                             if not name in unrecorded]
+    except (zipfile.BadZipfile, zlib.error, EOFError, IOError,
+            NotImplementedError) as err:
+        problems.append('cannot read wheel: {0}'.format(err))
+    return problems
+
+
+def verify_wheels(wheel_fnames, n_jobs=None):
+    """ Check wheels `wheel_fnames` in parallel, stop at first bad wheel
+
+    Parameters
+    ----------
+    wheel_fnames : sequence
+        Filenames of wheels to check
+    n_jobs : None or int, optional
+        Number of wheels to check at the same time.  None means use the
+        number of CPUs.
+
+    Raises
+    ------
+    WheelVerifyError
+        If any wheel fails verification.  Wheels already being checked when
+        we found the first problem also report their problems.
+    """
+    wheel_fnames = list(wheel_fnames)
+    if len(wheel_fnames) == 0:
+        return
+    cancel = threading.Event()
+
+    def check(wheel_fname):
+        if cancel.is_set():
+            return wheel_fname, []
+        problems = verify_wheel(wheel_fname, cancel)
+        if problems:
+            cancel.set()
+        return wheel_fname, problems
+
+    n_jobs = cpu_count() if n_jobs is None else n_jobs
+    pool = ThreadPool(min(n_jobs, len(wheel_fnames)))
+    try:
+        results = list(pool.imap_unordered(check, wheel_fnames))
+    finally:
+        pool.close()
+        pool.join()
+    problems = dict((wheel_fname, wheel_problems)
+                    for wheel_fname, wheel_problems in results
+                    if wheel_problems)
+    if problems:
+        raise WheelVerifyError(problems)
@@ -0,0 +1,300 @@
+""" Rebuild disk image when templates, requirements or find-links change
+
+We get file system events from the operating system (FSEvents on OSX) via
+the optional ``watchdog`` package, so we do not need to poll for changes.
+After a burst of changes has settled, we run only the build stages that
+depend on the changed inputs.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import abspath, dirname, isdir, basename
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+from .piputils import canonical_name
+from .planner import SDIST_FNAME_RE, parse_wheel_fname
+
+# Kinds of changed input
+TEMPLATES = 'templates'
+REQUIREMENTS = 'requirements'
+FIND_LINKS = 'find_links'
+
+# Seconds without further changes before we rebuild
+DEBOUNCE = 0.5
+
+
+def _in_dir(path, directory):
+    """ True if `path` is `directory` or inside `directory` """
+    return path == directory or path.startswith(directory.rstrip(os.sep) +
+                                                os.sep)
+
+
+def classify_changes(paths, template_dirs=(), requirement_files=(),
+                     find_links=()):
+    """ Return kinds of build input changed by changes to `paths`
+
+    Parameters
+    ----------
+    paths : iterable
+        Paths of changed files
+    template_dirs : sequence, optional
+        Directories containing installer templates
+    requirement_files : sequence, optional
+        Filenames of pip requirement files
+    find_links : sequence, optional
+        Local directories in which pip looks for packages
+
+    Returns
+    -------
+    kinds : set
+        Set containing ``TEMPLATES``, ``REQUIREMENTS``, ``FIND_LINKS`` for
+        each kind of changed input
+    """
+    template_dirs = [abspath(d) for d in template_dirs]
+    requirement_files = [abspath(f) for f in requirement_files]
+    find_links = [abspath(d) for d in find_links]
+    kinds = set()
+    for path in paths:
+        path = abspath(path)
+        if any(_in_dir(path, d) for d in template_dirs):
+            kinds.add(TEMPLATES)
+        if path in requirement_files:
+            kinds.add(REQUIREMENTS)
+        if any(_in_dir(path, d) for d in find_links):
+            kinds.add(FIND_LINKS)
+    return kinds
+
+
+def package_name(fname):
+    """ Return canonical distribution name for package file, or None
+
+    Parameters
+    ----------
+    fname : str
+        Filename of wheel or sdist
+
+    Returns
+    -------
+    name : None or str
+        Canonical distribution name, or None if `fname` is not a wheel or
+        sdist filename
+    """
+    parts = parse_wheel_fname(fname)
+    if parts is None:
+        parts = SDIST_FNAME_RE.match(basename(fname))
+        if parts is None:
+            return None
+        parts = parts.groupdict()
+    return canonical_name(parts['name'])
+
+
+class ChangeCollector(FileSystemEventHandler):
+    """ Collect paths from file system events until the changes settle
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._paths = set()
+        self._last_change = 0
+
+    def add(self, path):
+        """ Record change to `path` """
+        with self._lock:
+            self._paths.add(path)
+            self._last_change = time.time()
+        self._changed.set()
+
+    def on_any_event(self, event):
+        # Directory modification events only tell us about changes we see
+        # from the files
+        if event.is_directory:
+            return
+        self.add(event.src_path)
+        dest_path = getattr(event, 'dest_path', '')
+        if dest_path: # Editors often save by moving a new file into place
+            self.add(dest_path)
+
+    def wait(self, debounce=DEBOUNCE, timeout=None):
+        """ Wait for changes, then for `debounce` seconds without changes
+
+        Parameters
+        ----------
+        debounce : float, optional
+            Seconds without changes after which we return
+        timeout : None or float, optional
+            If not None, maximum time in seconds to wait for first change
+
+        Returns
+        -------
+        paths : set
+            Changed paths.  Empty if there were no changes before `timeout`.
+        """
+        if not self._changed.wait(timeout):
+            return set()
+        while True:
+            with self._lock:
+                quiet = time.time() - self._last_change
+            if quiet >= debounce:
+                break
+            time.sleep(debounce - quiet)
+        with self._lock:
+            paths, self._paths = self._paths, set()
+            self._changed.clear()
+        return paths
+
+
+class Watcher(object):
+    """ Rebuild disk image with :class:`PkgWriter` when inputs change
+    """
+
+    def __init__(self, pkg_writer, out_dir, template_dirs=(),
+                 base_manifest=None, formats=('dmg',), debounce=DEBOUNCE):
+        """ Initialize watcher
+
+        Parameters
+        ----------
+        pkg_writer : :class:`PkgWriter` instance
+            Writer that has already built the disk image once
+        out_dir : str
+            Directory to which to write disk image
+        template_dirs : sequence, optional
+            Directories of installer templates to watch
+        base_manifest : None or str, optional
+            If not None, manifest from previous release, for update image
+            (see :meth:`PkgWriter.write_dmg`)
+        formats : sequence, optional
+            Output formats to write (see :meth:`PkgWriter.write_dmg`)
+        debounce : float, optional
+            Seconds without further changes before we rebuild
+        """
+        self.pkg_writer = pkg_writer
+        self.out_dir = out_dir
+        self.template_dirs = list(template_dirs)
+        self.base_manifest = base_manifest
+        self.formats = formats
+        self.debounce = debounce
+        args = pkg_writer.pip_parser.parse_args(pkg_writer.pip_params)
+        self.requirement_files = [abspath(f) for f in args.requirement or []
+                                  if os.path.exists(f)]
+        self.find_links = [abspath(d) for d in args.find_links or []
+                           if isdir(d)]
+        self.requirements = self.get_requirements()
+        # Names of packages to fetch again, from failed rebuilds
+        self.pending = set()
+        self.collector = ChangeCollector()
+
+    def get_requirements(self):
+        """ Return dict of requirement string by canonical name """
+        writer = self.pkg_writer
+        return dict(
+            (canonical_name(name), req) for name, req in zip(
+                writer.get_requirement_strings(extras=False, versions=False),
+                writer.get_requirement_strings()))
+
+    @property
+    def watch_dirs(self):
+        """ Directories to watch for changes """
+        dirs = (self.template_dirs +
+                [dirname(f) for f in self.requirement_files] +
+                self.find_links)
+        return sorted(set(abspath(d) for d in dirs))
+
+    def rebuild(self, paths):
+        """ Rebuild for changes to `paths`, return outputs
+
+        We only store the new requirements after a successful rebuild.  If
+        the rebuild fails, we read the requirements again, and fetch the same
+        packages again, at the next rebuild.
+
+        Returns
+        -------
+        outputs : None or dict
+            Mapping of output format to filename, or None if the changes do
+            not affect the build
+        """
+        kinds = classify_changes(paths, self.template_dirs,
+                                 self.requirement_files, self.find_links)
+        if len(kinds) == 0:
+            return None
+        # New build; clear cancellation of an earlier build
+        self.pkg_writer.events.reset()
+        names = set(self.pending)
+        requirements = self.requirements
+        if REQUIREMENTS in kinds or self.pending:
+            requirements = self.get_requirements()
+            names.update(name for name in set(requirements) |
+                         set(self.requirements)
+                         if requirements.get(name) !=
+                         self.requirements.get(name))
+        if FIND_LINKS in kinds:
+            for path in paths:
+                if not any(_in_dir(abspath(path), d)
+                           for d in self.find_links):
+                    continue
+                name = package_name(path)
+                # Other files might change anything; fetch all again
+                names.update(requirements if name is None else [name])
+        self.pending = names
+        if names:
+            self.pkg_writer.update_wheels(names, self.base_manifest)
+        self.pkg_writer.write_dmg(self.out_dir,
+                                  clobber=True,
+                                  base_manifest=self.base_manifest,
+                                  wheelhouse=False,
+                                  formats=self.formats)
+        self.requirements = requirements
+        self.pending = set()
+        return dict(self.pkg_writer.outputs)
+
+    def run(self, callback=None, max_rebuilds=None):
+        """ Watch inputs, rebuild on changes
+
+        Parameters
+        ----------
+        callback : None or callable, optional
+            If not None, call as ``callback(outputs, error)`` after each
+            rebuild, where `outputs` is the return value from
+            :meth:`rebuild`, and `error` is None or the exception from a
+            failed rebuild.  A failed rebuild does not stop the watch.
+        max_rebuilds : None or int, optional
+            If not None, stop after this many rebuilds.  Otherwise watch
+            until interrupted.
+
+        Raises
+        ------
+        RuntimeError
+            If we do not have the ``watchdog`` package
+        """
+        if Observer is None:
+            raise RuntimeError('Need watchdog package for watching inputs')
+        observer = Observer()
+        for watch_dir in self.watch_dirs:
+            observer.schedule(self.collector, watch_dir, recursive=True)
+        observer.start()
+        n_rebuilds = 0
+        try:
+            while max_rebuilds is None or n_rebuilds < max_rebuilds:
+                paths = self.collector.wait(self.debounce)
+                try:
+                    outputs = self.rebuild(paths)
+                except Exception as err:
+                    outputs, error = None, err
+                else:
+                    if outputs is None:
+                        continue
+                    error = None
+                n_rebuilds += 1
+                if not callback is None:
+                    callback(outputs, error)
+        finally:
+            observer.stop()
+            observer.join()
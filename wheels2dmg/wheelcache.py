@@ -0,0 +1,193 @@
+""" Directory cache of processed wheels
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import exists, join as pjoin, basename, dirname
+import shutil
+import hashlib
+import tarfile
+from glob import glob
+from tempfile import mkdtemp
+
+# Read files in chunks of this many bytes when hashing
+HASH_BLOCKSIZE = 2 ** 20
+
+
+def file_sha256(fname, blocksize=HASH_BLOCKSIZE):
+    """ Return hex SHA256 digest for contents of file `fname`
+
+    Parameters
+    ----------
+    fname : str
+        Filename of file to hash
+    blocksize : int, optional
+        Number of bytes to read at a time
+
+    Returns
+    -------
+    hexdigest : str
+        Hex SHA256 digest of file contents
+    """
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as fobj:
+        while True:
+            block = fobj.read(blocksize)
+            if not block:
+                break
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def make_key(*parts):
+    """ Make cache key string from string `parts`
+
+    Parameters
+    ----------
+    \\*parts : str
+        Strings which together identify cached item
+
+    Returns
+    -------
+    key : str
+        Hex SHA256 digest of `parts`
+    """
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class WheelCache(object):
+    """ Cache of wheel files in a directory, keyed by string
+
+    Each key corresponds to a subdirectory containing the wheels stored for
+    that key.  We write new entries to a temporary directory in the cache
+    directory and rename into place, so concurrent builds sharing the cache
+    never see partly written entries.
+    """
+
+    def __init__(self, cache_dir):
+        """ Initialize wheel cache
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory containing cache.  Created if it does not exist.
+        """
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def key_path(self, key):
+        """ Return directory path for cache entry `key` """
+        return pjoin(self.cache_dir, key[:2], key)
+
+    def get(self, key, out_dir):
+        """ Copy wheels for `key` into `out_dir` if present
+
+        Parameters
+        ----------
+        key : str
+            Cache key
+        out_dir : str
+            Directory to which to copy cached wheels
+
+        Returns
+        -------
+        out_fnames : None or list
+            None if `key` is not in the cache, otherwise list of copied wheel
+            filenames in `out_dir`
+        """
+        key_path = self.key_path(key)
+        if not exists(key_path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        out_fnames = []
+        for cached in sorted(glob(pjoin(key_path, '*.whl'))):
+            out_fname = pjoin(out_dir, basename(cached))
+            shutil.copyfile(cached, out_fname)
+            out_fnames.append(out_fname)
+        return out_fnames
+
+    def put(self, key, wheel_fnames):
+        """ Store copies of `wheel_fnames` as entry for `key`
+
+        Parameters
+        ----------
+        key : str
+            Cache key
+        wheel_fnames : sequence
+            Filenames of wheels to store
+        """
+        key_path = self.key_path(key)
+        if exists(key_path):
+            return
+        parent = dirname(key_path)
+        if not exists(parent):
+            os.makedirs(parent)
+        tmp_dir = mkdtemp(dir=parent)
+        for wheel_fname in wheel_fnames:
+            shutil.copyfile(wheel_fname, pjoin(tmp_dir, basename(wheel_fname)))
+        try:
+            os.rename(tmp_dir, key_path)
+        except OSError: # Another process stored this key first
+            shutil.rmtree(tmp_dir)
+
+    def keys(self):
+        """ Return sorted list of keys in cache """
+        return sorted(basename(path)
+                      for path in glob(pjoin(self.cache_dir, '??', '*'))
+                      if not basename(path).startswith('tmp'))
+
+    def export_archive(self, archive_fname):
+        """ Write all cache entries to tar archive `archive_fname`
+
+        Returns
+        -------
+        n_keys : int
+            Number of cache entries written
+        """
+        keys = self.keys()
+        mode = 'w:gz' if archive_fname.endswith(('.gz', '.tgz')) else 'w'
+        with tarfile.open(archive_fname, mode) as tf:
+            for key in keys:
+                tf.add(self.key_path(key), arcname=key)
+        return len(keys)
+
+    def import_archive(self, archive_fname):
+        """ Add cache entries from tar archive `archive_fname`
+
+        Entries already in the cache stay as they are.
+
+        Returns
+        -------
+        n_added : int
+            Number of cache entries added
+        """
+        tmp_dir = mkdtemp(dir=self.cache_dir)
+        try:
+            with tarfile.open(archive_fname) as tf:
+                members = []
+                for member in tf.getmembers():
+                    parts = member.name.split('/')
+                    if (len(parts) > 2 or parts[0] in ('', '.', '..') or
+                        not (member.isdir() or member.isfile())):
+                        raise ValueError('Unexpected archive member ' +
+                                         member.name)
+                    members.append(member)
+                tf.extractall(tmp_dir, members)
+            n_added = 0
+            for key in sorted(os.listdir(tmp_dir)):
+                if exists(self.key_path(key)):
+                    continue
+                self.put(key, glob(pjoin(tmp_dir, key, '*.whl')))
+                n_added += 1
+        finally:
+            shutil.rmtree(tmp_dir)
+        return n_added
+
+    @property
+    def stats(self):
+        """ Dictionary of hit and miss counts since cache was opened """
+        return dict(hits=self.hits, misses=self.misses)
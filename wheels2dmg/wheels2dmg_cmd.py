@@ -4,10 +4,17 @@ from __future__ import division, print_function
 
 import sys
 import os
+import json
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
 from .piputils import make_pip_parser, recon_pip_args
-from .pkgbuilders import (insert_template_path, PkgWriter)
+from .pkgbuilders import (PkgWriter, RECOMPRESS_POLICIES, DEDUP_MODES,
+                          OUTPUT_FORMATS)
+from .planner import plan_build
+from .sizes import parse_size
+from .watch import Watcher
+from .events import format_event
+from .tmpdirs import clean_orphans
 
 # Defaults
 PYTHON_VERSION='2.7.8'
@@ -47,6 +54,12 @@ There must be at least one REQ_SPEC or REQUIREMENT.
     parser.add_argument('--dmg-out-dir', type=str, default=os.getcwd(),
                         help='Directory to which we write dmg disk image '
                         '(default is current directory)')
+    parser.add_argument('--formats', type=str, default='dmg',
+                        help='Comma-separated output formats to write from '
+                        'the same wheelhouse, from ' +
+                        ', '.join('"{0}"'.format(fmt)
+                                  for fmt in OUTPUT_FORMATS) +
+                        ' (default is "dmg")')
     parser.add_argument('--template-dir', type=str,
                         help='Alternative directory containing jinja '
                         'templates for installer files')
@@ -55,9 +68,121 @@ There must be at least one REQ_SPEC or REQUIREMENT.
                         '(default is "com.github.MacPython")')
     parser.add_argument('--delocate-wheels', action='store_true',
                         help='Automatically delocate libraries in wheels')
+    parser.add_argument('--compile-wheels', action='store_true',
+                        help='Add byte-compiled files to wheels at build time, '
+                        'so the installer does not need to compile them '
+                        '(Python >= 3.7)')
+    parser.add_argument('--thin-archs', type=str,
+                        help='Comma-separated architectures to keep in fat '
+                        'binaries in compiled wheels, e.g. "x86_64" (default '
+                        'is to keep all architectures)')
+    parser.add_argument('--recompress', default='keep',
+                        choices=sorted(RECOMPRESS_POLICIES),
+                        help='Zip compression for wheels in wheelhouse; '
+                        '"store" lets the disk image compress across wheels, '
+                        '"max-deflate" gives the smallest wheels (default is '
+                        'to keep compression from the wheel build)')
+    parser.add_argument('--dedup-libs', choices=DEDUP_MODES,
+                        help='Find libraries bundled into more than one '
+                        'wheel; "report" reports the duplicated bytes, '
+                        '"consolidate" also moves them into one support '
+                        'wheel (default is to leave libraries as they are)')
+    parser.add_argument('--no-verify-wheels', action='store_true',
+                        help='Do not check zip CRCs and RECORD hashes of '
+                        'wheels before writing the installer')
+    parser.add_argument('--size-budget', type=str,
+                        help='Fail if the disk image contents are larger '
+                        'than this, e.g. "600M" (default is no budget); we '
+                        'always write a size report next to the disk image')
+    parser.add_argument('--build-env-dir', type=str,
+                        help='Directory for reusable build virtualenvs, so '
+                        'we do not install pip and wheel into the Python.org '
+                        'Python (default is to upgrade the Python.org Python)')
+    parser.add_argument('--build-jobs', type=int,
+                        help='Build wheels from source in parallel, in order '
+                        'of build dependencies, using up to this many CPUs '
+                        '(default is to build with a single "pip wheel" '
+                        'command)')
+    parser.add_argument('--compiler-cache-dir', type=str,
+                        help='Directory for ccache compiler caches, used when '
+                        'building wheels from source (default is no compiler '
+                        'cache)')
+    parser.add_argument('--source-cache-dir', type=str,
+                        help='Directory in which to cache wheels built from '
+                        'source between builds (default is no cache); see '
+                        'wheels2dmg-cache to share the cache between hosts')
+    parser.add_argument('--base-manifest', type=str,
+                        help='Manifest JSON file written next to the disk '
+                        'image of a previous release; build an update image '
+                        'with only new or changed wheels')
+    parser.add_argument('--delocate-cache-dir', type=str,
+                        help='Directory in which to cache delocated and '
+                        'retagged wheels between builds (default is no '
+                        'cache)')
+    parser.add_argument('--command-log', type=str,
+                        help='File to which to append JSON lines recording '
+                        'time and resource use of external commands')
+    parser.add_argument('--catalog-db', type=str,
+                        help='SQLite wheel catalog to update with the '
+                        'wheelhouse, and use for wheel metadata')
+    parser.add_argument('--history-db', type=str,
+                        help='SQLite database in which to record build '
+                        'times and sizes (see wheels2dmg-history)')
+    parser.add_argument('--temp-root', type=str,
+                        help='Directory in which to make temporary build '
+                        'directories (default is the system temporary '
+                        'directory); we also remove directories left there '
+                        'by builds that did not finish')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Print build progress only, without the output '
+                        'of pip and other commands')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print JSON plan of wheels to fetch, compile and '
+                        'delocate, with size estimates, without building')
+    parser.add_argument('--clobber', action='store_true',
+                        help='Overwrite existing output files (default is '
+                        'to stop with an error)')
+    parser.add_argument('--watch', action='store_true',
+                        help='After building, watch the template directory, '
+                        'requirement files and find-links directories, and '
+                        'rebuild the parts of the image that depend on '
+                        'changed inputs (needs the watchdog package); '
+                        'rebuilds overwrite the outputs')
     return make_pip_parser(parser)
 
 
+def _format_value(value):
+    """ Format report value for printing """
+    if isinstance(value, float):
+        return '{0:.2f}'.format(value)
+    if isinstance(value, dict):
+        return ', '.join('{0}={1}'.format(k, _format_value(value[k]))
+                         for k in sorted(value))
+    return str(value)
+
+
+def print_report(report):
+    """ Print summary of build report dictionary `report`
+    """
+    for name in sorted(report):
+        value = report[name]
+        if not isinstance(value, dict) or not all(
+            isinstance(v, dict) for v in value.values()):
+            print('{0}: {1}'.format(name, _format_value(value)))
+            continue
+        print(name + ':')
+        for key in sorted(value):
+            print('    {0}: {1}'.format(key, _format_value(value[key])))
+
+
+def print_event(event):
+    """ Print progress message for build event `event`, if any """
+    message = format_event(event)
+    if not message is None:
+        print(message)
+        sys.stdout.flush()
+
+
 def main():
     # parse the command line
     parser = get_parser()
@@ -68,8 +193,15 @@ def main():
     if len(req_params) == 0:
         parser.print_help()
         sys.exit(12)
-    if not args.template_dir is None:
-        insert_template_path(args.template_dir)
+    try:
+        size_budget = (None if args.size_budget is None
+                       else parse_size(args.size_budget))
+    except ValueError as err:
+        parser.error(str(err))
+    orphans = clean_orphans(args.temp_root)
+    if orphans:
+        print('Removing {0} directories from unfinished builds'.format(
+            len(orphans)))
     pkg_writer = PkgWriter(args.pkg_name,
                            args.pkg_version,
                            args.python_version,
@@ -78,5 +210,60 @@ def main():
                            args.dmg_build_dir,
                            args.scratch_dir,
                            pkg_id_root = args.pkg_id_root,
-                           delocate_wheels = args.delocate_wheels)
-    pkg_writer.write_dmg(args.dmg_out_dir)
+                           delocate_wheels = args.delocate_wheels,
+                           compile_wheels = args.compile_wheels,
+                           delocate_cache_dir = args.delocate_cache_dir,
+                           command_log = args.command_log,
+                           catalog_db = args.catalog_db,
+                           history_db = args.history_db,
+                           thin_archs = (None if args.thin_archs is None
+                                         else args.thin_archs.split(',')),
+                           recompress = args.recompress,
+                           template_dirs = (None if args.template_dir is None
+                                            else [args.template_dir]),
+                           build_env_dir = args.build_env_dir,
+                           build_jobs = args.build_jobs,
+                           compiler_cache_dir = args.compiler_cache_dir,
+                           source_cache_dir = args.source_cache_dir,
+                           dedup_libs = args.dedup_libs,
+                           verify_wheels = not args.no_verify_wheels,
+                           size_budget = size_budget,
+                           temp_root = args.temp_root)
+    with pkg_writer:
+        if args.plan:
+            print(json.dumps(plan_build(pkg_writer), indent=2,
+                             sort_keys=True))
+            return
+        pkg_writer.runner.echo = not args.quiet
+        pkg_writer.events.add_callback(print_event)
+        formats = args.formats.split(',')
+        for fmt in formats:
+            if not fmt in OUTPUT_FORMATS:
+                parser.error('Unknown output format "{0}"'.format(fmt))
+        pkg_writer.write_dmg(args.dmg_out_dir,
+                             clobber=args.clobber,
+                             base_manifest=args.base_manifest,
+                             formats=formats)
+        print_report(pkg_writer.build_report)
+        if not args.watch:
+            return
+        template_dirs = ([] if args.template_dir is None
+                         else [args.template_dir])
+        watcher = Watcher(pkg_writer,
+                          args.dmg_out_dir,
+                          template_dirs,
+                          base_manifest=args.base_manifest,
+                          formats=formats)
+        print('Watching ' + ', '.join(watcher.watch_dirs))
+
+        def report(outputs, error):
+            if not error is None:
+                print('Rebuild failed: {0}'.format(error))
+                return
+            print('Rebuilt ' + ', '.join(outputs.values()))
+            print_report(pkg_writer.build_report)
+
+        try:
+            watcher.run(report)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,349 @@
+""" Tools for modifying wheels
+
+Delocate's ``InWheel`` changes the working directory of the process, so it
+is not safe to use from several threads at the same time.  The tools here
+work on absolute paths instead.
+
+Wheels can be very large (a gigabyte or more, for wheels bundling data or
+numerical libraries).  The tools here copy and hash wheel members in blocks
+of ``READ_BLOCKSIZE`` bytes, so memory use does not depend on the size of the
+wheel or its members.
+"""
+from __future__ import division, print_function
+
+import os
+from os.path import (join as pjoin, relpath, basename, dirname, abspath,
+                     exists, realpath)
+import io
+import csv
+import base64
+import shutil
+import hashlib
+import zipfile
+from tempfile import mkdtemp
+from contextlib import contextmanager
+
+from delocate.tools import zip2dir, set_install_id, find_package_dirs
+from delocate.delocating import (delocate_path, check_archs, bads_report,
+                                 DelocationError, DLC_PREFIX)
+try:
+    from delocate.tools import validate_signature
+except ImportError: # Delocate before signature checks
+    validate_signature = None
+
+from .tmpdirs import REAPER
+
+# Copy and hash files in blocks of this many bytes
+READ_BLOCKSIZE = 2 ** 20
+
+# Signature files invalidated by a new RECORD
+SIGNATURES = ('RECORD.jws', 'RECORD.p7s')
+
+
+class WheelToolError(Exception):
+    """ Error for wheels we cannot modify """
+
+
+def _record_hash(sha):
+    return 'sha256=' + base64.urlsafe_b64encode(sha.digest()).decode(
+        'ascii').rstrip('=')
+
+
+def _copy_hashed(in_fobj, out_fobj=None):
+    """ Copy `in_fobj` to `out_fobj` in blocks, return RECORD hash, size """
+    sha = hashlib.sha256()
+    size = 0
+    while True:
+        block = in_fobj.read(READ_BLOCKSIZE)
+        if not block:
+            break
+        sha.update(block)
+        size += len(block)
+        if not out_fobj is None:
+            out_fobj.write(block)
+    return _record_hash(sha), size
+
+
+def _info_dir(names):
+    """ Return single ``.dist-info`` directory name from `names` """
+    info_dirs = set(name.split('/')[0] for name in names
+                    if name.split('/')[0].endswith('.dist-info'))
+    if len(info_dirs) != 1:
+        raise WheelToolError('Should be exactly one .dist-info directory')
+    return info_dirs.pop()
+
+
+def write_record(wheel_dir):
+    """ Write new ``RECORD`` for unpacked wheel in directory `wheel_dir`
+
+    Remove any ``RECORD`` signature files, which the new ``RECORD``
+    invalidates.
+    """
+    paths = []
+    for root, dirs, files in os.walk(wheel_dir):
+        paths += [relpath(pjoin(root, fname), wheel_dir).replace(os.sep, '/')
+                  for fname in files]
+    info_dir = _info_dir(paths)
+    for signature in SIGNATURES:
+        path = info_dir + '/' + signature
+        if path in paths:
+            os.unlink(pjoin(wheel_dir, path))
+            paths.remove(path)
+    record = info_dir + '/RECORD'
+    rows = []
+    for path in sorted(paths):
+        if path == record:
+            continue
+        with open(pjoin(wheel_dir, path), 'rb') as fobj:
+            rows.append((path,) + _copy_hashed(fobj))
+    rows.append((record, '', ''))
+    with io.open(pjoin(wheel_dir, record), 'wt', encoding='utf-8',
+                 newline='') as fobj:
+        csv.writer(fobj, lineterminator='\n').writerows(rows)
+
+
+def _zip_order(names):
+    """ Return `names` sorted with ``.dist-info`` files last, as pip writes
+    """
+    return sorted(names, key=lambda name: (
+        name.split('/')[0].endswith('.dist-info'), name))
+
+
+def write_wheel_zip(wheel_dir, wheel_fname):
+    """ Write unpacked wheel in directory `wheel_dir` to `wheel_fname`
+
+    We read each file in blocks, and keep file permissions and modification
+    times.
+    """
+    paths = []
+    for root, dirs, files in os.walk(wheel_dir):
+        paths += [relpath(pjoin(root, fname), wheel_dir).replace(os.sep, '/')
+                  for fname in files]
+    with zipfile.ZipFile(wheel_fname, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for path in _zip_order(paths):
+            zout.write(pjoin(wheel_dir, path), path)
+
+
+@contextmanager
+def unpacked_wheel(wheel_fname, out_fname=None):
+    """ Context manager yielding directory containing unpacked wheel
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of wheel to unpack
+    out_fname : None or str, optional
+        If not None, filename to which to write the wheel from the modified
+        directory, with a new ``RECORD``.  We only write the wheel if the
+        block exits without an error.  Can be the same as `wheel_fname`.
+
+    Yields
+    ------
+    wheel_dir : str
+        Absolute path of temporary directory containing unpacked wheel
+    """
+    wheel_dir = mkdtemp()
+    try:
+        zip2dir(wheel_fname, wheel_dir)
+        yield wheel_dir
+        if not out_fname is None:
+            write_record(wheel_dir)
+            write_wheel_zip(wheel_dir, out_fname)
+    finally:
+        REAPER.reap(wheel_dir)
+
+
+def copy_member(zin, info, zout, compression=None, level=None):
+    """ Copy member `info` of ``ZipFile`` `zin` to ``ZipFile`` `zout`
+
+    Keep the member name, date and permissions.  Copy in blocks, so memory
+    use does not depend on the member size.
+
+    Parameters
+    ----------
+    zin : ``ZipFile`` instance
+        Zipfile open for reading
+    info : ``ZipInfo`` instance
+        Member of `zin` to copy
+    zout : ``ZipFile`` instance
+        Zipfile open for writing
+    compression : None or int, optional
+        Zipfile compression type for copy.  None means use the compression
+        type of `info`.
+    level : None or int, optional
+        Compression level for copy.  None means use the default level.
+    """
+    out_info = zipfile.ZipInfo(info.filename, info.date_time)
+    out_info.external_attr = info.external_attr
+    out_info.create_system = info.create_system
+    out_info.compress_type = (info.compress_type if compression is None
+                              else compression)
+    # ZipFile.open only takes the compression level from the ZipInfo
+    out_info._compresslevel = level
+    with zin.open(info) as in_fobj:
+        with zout.open(out_info, 'w',
+                       force_zip64=info.file_size > zipfile.ZIP64_LIMIT
+                       ) as out_fobj:
+            shutil.copyfileobj(in_fobj, out_fobj, READ_BLOCKSIZE)
+
+
+def delocate_wheel(wheel_fname, lib_sdir='.dylibs', require_archs=None):
+    """ Copy libraries that wheel `wheel_fname` needs into the wheel
+
+    Version of delocate's ``delocate_wheel`` that writes the wheel with
+    :func:`unpacked_wheel`; delocate reads each whole member into memory to
+    write the wheel.  We only write the wheel, in-place, if we copied
+    libraries.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of compiled wheel
+    lib_sdir : str, optional
+        Name of directory, in each package of the wheel, for copied
+        libraries
+    require_archs : None or str or sequence, optional
+        If not None, architectures that the copied libraries, and the
+        binaries depending on them, must have (see delocate's
+        ``check_archs``)
+
+    Returns
+    -------
+    copied_libs : dict
+        Dict with original paths of copied libraries as keys, and, as
+        values, dicts mapping binaries in the wheel that use the library to
+        the install name they use.
+
+    Raises
+    ------
+    DelocationError
+        If the copied libraries or binaries do not have `require_archs`, or
+        a package already has a `lib_sdir` directory and we need to copy
+        libraries into it.
+    """
+    all_copied = {}
+    with unpacked_wheel(wheel_fname) as wheel_dir:
+        # Library paths from delocate have symlinks resolved (e.g. /var to
+        # /private/var on OSX)
+        wheel_dir = realpath(wheel_dir)
+        for package_path in find_package_dirs(wheel_dir):
+            lib_path = pjoin(package_path, lib_sdir)
+            lib_path_exists = exists(lib_path)
+            copied_libs = delocate_path(package_path, lib_path)
+            if copied_libs and lib_path_exists:
+                raise DelocationError(
+                    '{0} already exists in wheel but need to copy {1}'.format(
+                        lib_path, '; '.join(copied_libs)))
+            if exists(lib_path) and len(os.listdir(lib_path)) == 0:
+                shutil.rmtree(lib_path)
+            if not require_archs is None:
+                bads = check_archs(copied_libs, require_archs)
+                if len(bads) != 0:
+                    raise DelocationError(
+                        'Some missing architectures in wheel\n' +
+                        bads_report(bads, wheel_dir))
+            # Install ids unique within Python space
+            install_id_root = (DLC_PREFIX + relpath(package_path, wheel_dir) +
+                               '/')
+            for lib in copied_libs:
+                copied_path = pjoin(lib_path, basename(lib))
+                set_install_id(copied_path, install_id_root + basename(lib))
+                if not validate_signature is None:
+                    validate_signature(copied_path)
+            for lib, dependings in copied_libs.items():
+                all_copied.setdefault(lib, {}).update(dependings)
+        if len(all_copied) != 0:
+            write_record(wheel_dir)
+            write_wheel_zip(wheel_dir, wheel_fname)
+    return all_copied
+
+
+def _unique(seq):
+    out = []
+    for item in seq:
+        if not item in out:
+            out.append(item)
+    return out
+
+
+def retag_wheel(wheel_fname, platforms):
+    """ Add platform tags `platforms` to wheel filename and ``WHEEL`` tags
+
+    Streaming version of delocate's ``add_platforms``.  We copy the wheel
+    members across without unpacking, changing only the ``WHEEL`` and
+    ``RECORD`` files, and delete `wheel_fname` if the wheel filename changes.
+
+    Parameters
+    ----------
+    wheel_fname : str
+        Filename of compiled wheel
+    platforms : sequence
+        Platform tags to add, e.g. ``['macosx_10_9_x86_64']``
+
+    Returns
+    -------
+    out_fname : str
+        Absolute filename of retagged wheel; `wheel_fname` if the wheel
+        already had all the tags.
+
+    Raises
+    ------
+    WheelToolError
+        If `wheel_fname` is a pure wheel
+    """
+    wheel_fname = abspath(wheel_fname)
+    parts = basename(wheel_fname)[:-len('.whl')].split('-')
+    fname_tags = parts[-1].split('.')
+    new_fname_tags = _unique(fname_tags + list(platforms))
+    out_fname = pjoin(dirname(wheel_fname),
+                      '-'.join(parts[:-1] + ['.'.join(new_fname_tags)]) +
+                      '.whl')
+    with zipfile.ZipFile(wheel_fname) as zin:
+        info_dir = _info_dir(zin.namelist())
+        wheel_path = info_dir + '/WHEEL'
+        record_path = info_dir + '/RECORD'
+        signature_paths = [info_dir + '/' + name for name in SIGNATURES]
+        lines = zin.read(wheel_path).decode('utf-8').splitlines()
+        if 'Root-Is-Purelib: true' in lines:
+            raise WheelToolError('Cannot add platforms to pure wheel')
+        tag_lines = [i for i, line in enumerate(lines)
+                     if line.startswith('Tag:')]
+        tags = [lines[i].split(':', 1)[1].strip() for i in tag_lines]
+        pyc_apis = _unique(tag.rsplit('-', 1)[0] for tag in tags)
+        new_tags = [pyc_api + '-' + plat
+                    for pyc_api in pyc_apis for plat in platforms
+                    if not pyc_api + '-' + plat in tags]
+        if len(new_tags) == 0 and out_fname == wheel_fname:
+            return wheel_fname
+        insert_at = tag_lines[-1] + 1 if tag_lines else len(lines)
+        lines[insert_at:insert_at] = ['Tag: ' + tag for tag in new_tags]
+        wheel_contents = ('\n'.join(lines) + '\n').encode('utf-8')
+        record_rows = []
+        for row in csv.reader(
+                zin.read(record_path).decode('utf-8').splitlines()):
+            if len(row) == 0 or row[0] in signature_paths:
+                continue
+            if row[0] == wheel_path:
+                row = [wheel_path,
+                       _record_hash(hashlib.sha256(wheel_contents)),
+                       str(len(wheel_contents))]
+            record_rows.append(row)
+        record_io = io.StringIO()
+        csv.writer(record_io, lineterminator='\n').writerows(record_rows)
+        new_contents = {wheel_path: wheel_contents,
+                        record_path: record_io.getvalue().encode('utf-8')}
+        tmp_fname = out_fname + '.retag'
+        with zipfile.ZipFile(tmp_fname, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for member in zin.infolist():
+                name = member.filename
+                if name in new_contents:
+                    out_info = zipfile.ZipInfo(name, member.date_time)
+                    out_info.external_attr = member.external_attr
+                    out_info.compress_type = zipfile.ZIP_DEFLATED
+                    zout.writestr(out_info, new_contents[name])
+                elif not name in signature_paths:
+                    copy_member(zin, member, zout)
+    os.rename(tmp_fname, out_fname)
+    if out_fname != wheel_fname:
+        os.unlink(wheel_fname)
+    return out_fname